@@ -133,8 +133,7 @@ def get_monthly_averages(
     # Tier Check (Pro+)
     from app.services import user_preference as preference_service
 
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(user_id, current_user)
 
     if tier == "free":
         raise HTTPException(
@@ -271,8 +270,7 @@ def check_subscriptions(current_user: dict = Depends(get_current_user)):
     from app.services import user_preference as preference_service
     from app.services.analysis_service import analysis_service
 
-    prefs = preference_service.get_preferences(current_user["uid"])
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(current_user["uid"], current_user)
 
     if tier != "premium":
         raise HTTPException(
@@ -297,8 +295,7 @@ def check_anomalies(
     # Tier Check (Pro+)
     from app.services import user_preference as preference_service
 
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(user_id, current_user)
 
     if tier == "free":
         raise HTTPException(
@@ -1,12 +1,16 @@
+import json
 import uuid
+from datetime import date, datetime, timedelta, timezone
 from typing import Annotated, List, Optional
 
 from app.core.logger import get_logger
 from app.core.rate_limiter import limiter
-from app.core.security import get_current_user
-from app.services import ai_service
+from app.core.security import get_admin_user, get_current_user
+from app.services import ai_service, ai_usage, receipt_image
 from app.services import user_preference as preference_service
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 logger = get_logger(__name__)
@@ -14,6 +18,32 @@ logger = get_logger(__name__)
 router = APIRouter()
 
 
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def _sse_response(events) -> StreamingResponse:
+    """
+    Server-Sent Events a partir dos eventos de ai_service.*_stream:
+    `chunk` ({"text"}) conforme o modelo gera e `done` ({"content"}) no fim.
+    O primeiro evento é consumido aqui: a vaga do usuário é reservada (ou 429)
+    antes de a resposta começar.
+    """
+    await anext(events)
+
+    async def body():
+        try:
+            async for event, data in events:
+                key = "text" if event == "chunk" else "content"
+                payload = json.dumps({key: data}, ensure_ascii=False)
+                yield f"event: {event}\ndata: {payload}\n\n"
+        except Exception as e:
+            logger.error("AI stream error: %s", e, exc_info=True)
+            payload = json.dumps({"detail": "Stream interrupted"})
+            yield f"event: error\ndata: {payload}\n\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 class LimitsResponse(BaseModel):
     classify: dict
     chat: dict
@@ -23,8 +53,7 @@ class LimitsResponse(BaseModel):
 @router.get("/limits", response_model=LimitsResponse)
 def get_limits(current_user: Annotated[dict, Depends(get_current_user)]):
     user_id = current_user["uid"]
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(user_id, current_user)
 
     classify_info = limiter.get_usage_info(user_id, "classify", tier)
     chat_info = limiter.get_usage_info(user_id, "chat", tier)
@@ -41,16 +70,17 @@ class ClassificationResponse(BaseModel):
 
 
 @router.post("/classify", response_model=ClassificationResponse)
-def classify_endpoint(
+async def classify_endpoint(
     request: ClassificationRequest,
     current_user: Annotated[dict, Depends(get_current_user)],
 ):
     user_id = current_user["uid"]
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
 
     # 1. Check Rate Limit
-    limiter.check_limit(user_id, "classify", tier)
+    await run_in_threadpool(limiter.check_limit, user_id, "classify", tier)
 
     """
     Recebe uma descrição e retorna o ID da categoria sugerida pela IA.
@@ -58,7 +88,7 @@ def classify_endpoint(
     if not request.description:
         raise HTTPException(status_code=400, detail="Description is required")
 
-    category_id = ai_service.classify_transaction(
+    category_id = await ai_service.classify_transaction_async(
         request.description, user_id, tier=tier
     )
 
@@ -76,7 +106,7 @@ class ChatResponse(BaseModel):
 
 
 @router.post("/chat", response_model=ChatResponse)
-def chat_endpoint(
+async def chat_endpoint(
     request: ChatRequest, current_user: Annotated[dict, Depends(get_current_user)]
 ):
     """
@@ -86,8 +116,9 @@ def chat_endpoint(
         raise HTTPException(status_code=400, detail="Message is required")
 
     user_id = current_user["uid"]
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
 
     # 1. Check Feature Access & Rate Limit
     if tier == "free":
@@ -95,9 +126,9 @@ def chat_endpoint(
             status_code=403, detail="Feature not available for Free plan."
         )
 
-    limiter.check_limit(user_id, "chat", tier)
+    await run_in_threadpool(limiter.check_limit, user_id, "chat", tier)
 
-    response_text = ai_service.chat_finance(
+    response_text = await ai_service.chat_finance_async(
         request.message,
         user_id,
         tier=tier,
@@ -108,6 +139,40 @@ def chat_endpoint(
     return ChatResponse(response=response_text)
 
 
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: ChatRequest, current_user: Annotated[dict, Depends(get_current_user)]
+):
+    """
+    Chat em streaming (SSE). O texto chega em eventos `chunk`; o evento `done`
+    traz a mensagem final, já com o resultado de eventuais ações.
+    """
+    if not request.message:
+        raise HTTPException(status_code=400, detail="Message is required")
+
+    user_id = current_user["uid"]
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
+
+    if tier == "free":
+        raise HTTPException(
+            status_code=403, detail="Feature not available for Free plan."
+        )
+
+    await run_in_threadpool(limiter.check_limit, user_id, "chat", tier)
+
+    return await _sse_response(
+        ai_service.chat_finance_stream(
+            request.message,
+            user_id,
+            tier=tier,
+            persona=request.persona or "friendly",
+            history=request.history,
+        )
+    )
+
+
 class ScanItem(BaseModel):
     description: str
     amount: float
@@ -128,7 +193,7 @@ class ScanResponse(BaseModel):
 
 
 @router.post("/scan", response_model=ScanResponse)
-def scan_receipt_endpoint(
+async def scan_receipt_endpoint(
     file: Annotated[Optional[UploadFile], File()] = None,
     file_url: Optional[str] = None,
     current_user: Annotated[dict, Depends(get_current_user)] = None,
@@ -137,8 +202,9 @@ def scan_receipt_endpoint(
     Recebe uma imagem de comprovante (UploadFile) OU uma URL local (file_url) e retorna os dados extraídos.
     """
     user_id = current_user["uid"]
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
 
     # 1. Check Rate Limit && Feature Access
     if tier == "free":
@@ -146,7 +212,8 @@ def scan_receipt_endpoint(
             status_code=403, detail="Scanner not available for Free plan."
         )
 
-    limiter.check_limit(user_id, "classify", tier)  # Uses classify quota
+    # Uses classify quota
+    await run_in_threadpool(limiter.check_limit, user_id, "classify", tier)
 
     content = None
     content_type = "image/jpeg"  # Default fallback
@@ -157,19 +224,24 @@ def scan_receipt_endpoint(
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
 
-        # Use synchronous read for sync endpoint
-        content = file.file.read()
-        content_type = file.content_type
+        # Reduz/recomprime antes de guardar e de enviar ao modelo
+        content, content_type = await run_in_threadpool(
+            receipt_image.prepare_receipt, await file.read(), file.content_type
+        )
 
         # Save file using StorageService
-        file_ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
+        if content_type == receipt_image.OUTPUT_MIME_TYPE:
+            file_ext = "jpg"
+        else:
+            file_ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
         filename = f"{uuid.uuid4()}.{file_ext}"
 
         from app.services.storage_service import storage_service
 
         try:
             # New Isolated Storage
-            internal_path = storage_service.upload_file(
+            internal_path = await run_in_threadpool(
+                storage_service.upload_file,
                 file_content=content,
                 filename=filename,
                 folder="attachments",
@@ -201,7 +273,9 @@ def scan_receipt_endpoint(
         try:
             # Extract internal path from API URL
             internal_path = file_url.replace("/api/attachments/", "")
-            content = storage_service.get_file_content(internal_path)
+            content = await run_in_threadpool(
+                storage_service.get_file_content, internal_path
+            )
             # Infer mime type? Simple check
             lower_url = file_url.lower().split("?")[0]
             if lower_url.endswith(".png"):
@@ -211,6 +285,12 @@ def scan_receipt_endpoint(
             else:
                 content_type = "image/jpeg"
 
+            # Anexos antigos (originais) também são reduzidos; os já
+            # processados voltam inalterados e acertam o cache de leitura
+            content, content_type = await run_in_threadpool(
+                receipt_image.prepare_receipt, content, content_type
+            )
+
             attachment_url = file_url
         except Exception as e:
             logger.error("Error reading file: %s", e)
@@ -219,7 +299,9 @@ def scan_receipt_endpoint(
     else:
         raise HTTPException(status_code=400, detail="Must provide 'file' or 'file_url'")
 
-    result = ai_service.parse_receipt(content, content_type, user_id, tier=tier)
+    result = await ai_service.parse_receipt_async(
+        content, content_type, user_id, tier=tier
+    )
 
     if not result:
         raise HTTPException(status_code=500, detail="Could not parse receipt")
@@ -231,12 +313,13 @@ def scan_receipt_endpoint(
 
 
 @router.get("/report")
-def generate_report(
+async def generate_report(
     month: int, year: int, current_user: Annotated[dict, Depends(get_current_user)]
 ):
     user_id = current_user["uid"]
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
 
     # 1. Check Feature Access & Rate Limit
     if tier == "free":
@@ -244,11 +327,36 @@ def generate_report(
             status_code=403, detail="Reports not available for Free plan."
         )
 
-    limiter.check_limit(user_id, "chat", tier)  # Use chat quota
+    # Use chat quota
+    await run_in_threadpool(limiter.check_limit, user_id, "chat", tier)
+
+    content = await ai_service.generate_monthly_report_async(
+        user_id, month, year, tier=tier
+    )
+    return {"content": content}
+
+
+@router.get("/report/stream")
+async def generate_report_stream(
+    month: int, year: int, current_user: Annotated[dict, Depends(get_current_user)]
+):
+    """Relatório mensal em streaming (SSE); se já estiver em cache, vem no `done`."""
+    user_id = current_user["uid"]
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
+
+    if tier == "free":
+        raise HTTPException(
+            status_code=403, detail="Reports not available for Free plan."
+        )
+
+    # Use chat quota
+    await run_in_threadpool(limiter.check_limit, user_id, "chat", tier)
 
-    return {
-        "content": ai_service.generate_monthly_report(user_id, month, year, tier=tier)
-    }
+    return await _sse_response(
+        ai_service.generate_monthly_report_stream(user_id, month, year, tier=tier)
+    )
 
 
 class CostOfLivingAnalysisRequest(BaseModel):
@@ -261,8 +369,7 @@ def analyze_cost_of_living_endpoint(
     current_user: Annotated[dict, Depends(get_current_user)],
 ):
     user_id = current_user["uid"]
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(user_id, current_user)
 
     if tier != "premium":
         raise HTTPException(
@@ -273,3 +380,31 @@ def analyze_cost_of_living_endpoint(
 
     analysis = ai_service.analyze_cost_of_living(user_id, request.data, tier=tier)
     return {"analysis": analysis}
+
+
+USAGE_MAX_DAYS = 93
+
+
+@router.get("/usage")
+def get_ai_usage(
+    admin: Annotated[dict, Depends(get_admin_user)],
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[str] = None,
+):
+    """
+    (Admin) Consumo da IA por dia e por caller/modelo/tier: tokens, latência,
+    retentativas, custo estimado e taxa de acerto dos caches. Com `user_id`,
+    os totais diários daquele usuário. Padrão: últimos 7 dias.
+    """
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=6)
+    if start > end or (end - start).days >= USAGE_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid range (max {USAGE_MAX_DAYS} days).",
+        )
+
+    # Inclui o que ainda está em memória neste processo
+    ai_usage.flush()
+    return ai_usage.get_usage(start, end, user_id=user_id)
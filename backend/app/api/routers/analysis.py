@@ -18,8 +18,7 @@ def get_subscription_suggestions(
     Zombie Hunter: Detecta possíveis assinaturas recorrentes não cadastradas.
     """
     # Verify Tier (Premium Feature)
-    prefs = preference_service.get_preferences(current_user["uid"])
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(current_user["uid"], current_user)
 
     if tier != "premium":
         raise HTTPException(
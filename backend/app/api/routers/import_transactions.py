@@ -4,6 +4,7 @@ from app.core.security import get_current_user
 from app.services import ai_service
 from app.utils.parsers import parse_csv, parse_ofx
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -26,8 +27,9 @@ async def preview_import(
     # Tier Check (Pro+)
     from app.services import user_preference as preference_service
 
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = await run_in_threadpool(
+        preference_service.get_subscription_tier, user_id, current_user
+    )
 
     if tier == "free":
         raise HTTPException(
@@ -61,17 +63,22 @@ async def preview_import(
         )
 
     # 2. Auto-Categorize (AI)
-    # Note: Doing this in loop might be slow for large files.
-    # Ideal: Batch API or parallel tasks. For MVP, we do sequential or limit to N.
+    # Classificação em lote: descrições repetidas e já conhecidas (cache) não
+    # geram chamadas; as demais vão em poucos prompts com vários itens.
+    # Síncrona (Gemini com backoff + escritas em batch): fora do event loop.
+    predictions = await run_in_threadpool(
+        ai_service.classify_transactions_batch,
+        [tx["description"] for tx in transactions if tx["type"] == "expense"],
+        user_id,
+        tier,
+    )
 
     drafts = []
     for tx in transactions:
         # Suggest Category using AI
         cat_id = None
         if tx["type"] == "expense":  # Usually only categorize expenses
-            cat_id = ai_service.classify_transaction(
-                tx["description"], current_user["uid"]
-            )
+            cat_id = predictions.get((tx["description"] or "").strip().lower())
 
         drafts.append(
             DraftTransaction(
@@ -18,8 +18,7 @@ def get_my_invoices(current_user: dict = Depends(get_current_user)):
     # Tier Check (Pro+)
     from app.services import user_preference as preference_service
 
-    prefs = preference_service.get_preferences(user_id)
-    tier = prefs.subscription_tier or "free"
+    tier = preference_service.get_subscription_tier(user_id, current_user)
 
     if tier == "free":
         # Allows 'get' maybe? Use cases say "Management".
@@ -10,7 +10,12 @@ from app.schemas.budget import Budget, BudgetCreate
 from app.schemas.category import Category, CategoryCreate, CategoryType
 from app.schemas.dashboard import DashboardSummary
 from app.schemas.recurrence import Recurrence, RecurrenceCreate, RecurrenceUpdate
-from app.schemas.transaction import Transaction, TransactionCreate, TransactionUpdate
+from app.schemas.transaction import (
+    Transaction,
+    TransactionCreate,
+    TransactionPage,
+    TransactionUpdate,
+)
 from app.services import account as account_service
 from app.services import budget as budget_service
 from app.services import category as category_service
@@ -125,8 +130,29 @@ def read_transactions(
     limit: Optional[int] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1, le=500),
     current_user: dict = Depends(get_current_user),
 ):
+    # Paginação por cursor: ativada quando o cliente envia cursor ou page_size.
+    # Sem eles, mantém a resposta em lista (compatibilidade).
+    if cursor is not None or page_size is not None:
+        if cursor:
+            try:
+                transaction_service.decode_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail="Invalid cursor") from e
+        items, next_cursor = transaction_service.list_transactions_page(
+            user_id=current_user["uid"],
+            cursor=cursor or None,
+            page_size=page_size or 50,
+            month=month,
+            year=year,
+            start_date=start_date,
+            end_date=end_date,
+        )
+        return TransactionPage(items=items, next_cursor=next_cursor).model_dump()
+
     transactions = transaction_service.list_transactions(
         user_id=current_user["uid"],
         month=month,
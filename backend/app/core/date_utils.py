@@ -25,15 +25,17 @@ def calculate_next_due_date(current_date: datetime, periodicity: str) -> datetim
     # Importação local para evitar ciclo se houver
     from dateutil.relativedelta import relativedelta
 
-    if periodicity == "mensal":
+    if periodicity in ("mensal", "monthly"):
         return current_date + relativedelta(months=1)
+    elif periodicity in ("semanal", "weekly"):
+        return current_date + relativedelta(weeks=1)
     elif periodicity == "bimestral":
         return current_date + relativedelta(months=2)
     elif periodicity == "trimestral":
         return current_date + relativedelta(months=3)
     elif periodicity == "semestral":
         return current_date + relativedelta(months=6)
-    elif periodicity == "anual":
+    elif periodicity in ("anual", "yearly"):
         return current_date + relativedelta(years=1)
 
     return current_date
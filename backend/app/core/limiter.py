@@ -1,4 +1,43 @@
+"""
+Limitador por rota do slowapi (`@limiter.limit`).
+
+- Chave: uid do usuário autenticado (gravado em `request.state.uid` por
+  `get_current_user`); sem login, o IP do cliente (já corrigido pelo
+  ProxyHeadersMiddleware). Atrás do proxy, vários usuários não dividem mais
+  a mesma cota.
+- Armazenamento compartilhado entre instâncias via RATE_LIMIT_STORAGE_URI:
+  `redis://host:6379/0` (extra `redis`: `pip install "backend[redis]"`),
+  `firestore://` (app/core/limiter_storage.py) ou `memory://` (padrão, por
+  processo).
+"""
+
+import os
+
+from app.core import limiter_storage  # noqa: F401 (registra o esquema firestore://)
+from fastapi import Request
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
-limiter = Limiter(key_func=get_remote_address)
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+
+
+def rate_limit_key(request: Request) -> str:
+    uid = getattr(request.state, "uid", None)
+    if uid:
+        return f"uid:{uid}"
+    return f"ip:{get_remote_address(request)}"
+
+
+def build_limiter(storage_uri: str, **storage_options) -> Limiter:
+    """Limiter da API; `storage_options` vão para o storage do `limits`."""
+    return Limiter(
+        key_func=rate_limit_key,
+        storage_uri=storage_uri,
+        storage_options=storage_options,
+        # Backend indisponível: segue com contagem em memória em vez de derrubar a API
+        in_memory_fallback_enabled=storage_uri != "memory://",
+        key_prefix="slowapi",
+    )
+
+
+limiter = build_limiter(RATE_LIMIT_STORAGE_URI)
@@ -0,0 +1,173 @@
+"""
+Backend `firestore://` de contadores para o slowapi (biblioteca `limits`).
+
+Alternativa ao Redis quando não há um disponível: os contadores de janela
+fixa ficam em `rate_limit_counters/{hash(chave)}_{janela}` e sobrevivem à
+troca de instâncias do Cloud Run.
+
+Para não colocar uma ida ao Firestore em cada requisição, a decisão usa um
+contador local: `incr` soma em memória e devolve (contagem remota conhecida +
+incrementos locais). Uma thread de fundo grava os incrementos com
+`Increment` e relê o total a cada SYNC_INTERVAL_SECONDS. A contagem entre
+instâncias é, portanto, aproximada por até um intervalo de sincronização.
+
+Cada janela cria um documento novo; os vencidos são apagados pela política de
+TTL em `expires_at` (fieldOverrides do firestore.indexes.json).
+"""
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from app.core.database import get_db
+from app.core.logger import get_logger
+from google.cloud import firestore
+from limits.storage import Storage
+
+logger = get_logger(__name__)
+
+COLLECTION_NAME = "rate_limit_counters"
+SYNC_INTERVAL_SECONDS = 1.0
+MAX_TRACKED_KEYS = 10_000
+
+
+class _Window:
+    __slots__ = (
+        "index",
+        "expiry",
+        "local",
+        "flushed",
+        "remote",
+        "synced_at",
+        "busy",
+    )
+
+    def __init__(self, index: int, expiry: float):
+        self.index = index
+        self.expiry = expiry
+        self.local = 0  # incrementos feitos nesta instância
+        self.flushed = 0  # quantos deles já estão no Firestore
+        self.remote = 0  # contagem das outras instâncias na última leitura
+        self.synced_at = 0.0
+        self.busy = False
+
+    @property
+    def resets_at(self) -> float:
+        return (self.index + 1) * self.expiry
+
+    @property
+    def count(self) -> int:
+        return self.remote + self.local
+
+
+class FirestoreStorage(Storage):
+    """Contadores de janela fixa (estratégia padrão do slowapi) no Firestore."""
+
+    STORAGE_SCHEME = ["firestore"]
+
+    def __init__(
+        self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options
+    ):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._lock = threading.Lock()
+        self._windows: Dict[str, _Window] = {}
+        self._sync_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="limiter-sync"
+        )
+
+    @property
+    def base_exceptions(self):
+        return Exception
+
+    @staticmethod
+    def _doc_id(key: str, window: _Window) -> str:
+        digest = hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+        return f"{digest}_{window.index}"
+
+    def _current(self, key: str) -> Optional[_Window]:
+        window = self._windows.get(key)
+        if window and time.time() < window.resets_at:
+            return window
+        return None
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        now = time.time()
+        index = int(now // expiry)
+        with self._lock:
+            window = self._windows.get(key)
+            if not window or window.index != index or window.expiry != expiry:
+                if len(self._windows) >= MAX_TRACKED_KEYS:
+                    self._prune(now)
+                window = _Window(index, expiry)
+                self._windows[key] = window
+            window.local += amount
+            count = window.count
+            schedule = (
+                not window.busy and now - window.synced_at >= SYNC_INTERVAL_SECONDS
+            )
+            if schedule:
+                window.busy = True
+
+        if schedule:
+            self._sync_executor.submit(self._sync, key, window)
+        return count
+
+    def _prune(self, now: float):
+        """Descarta janelas vencidas (chamado com o lock)."""
+        expired = [k for k, w in self._windows.items() if now >= w.resets_at]
+        for k in expired:
+            del self._windows[k]
+
+    def _sync(self, key: str, window: _Window):
+        """Grava os incrementos locais pendentes e relê o total da janela."""
+        ref = get_db().collection(COLLECTION_NAME).document(self._doc_id(key, window))
+        try:
+            with self._lock:
+                pending = window.local - window.flushed
+            if pending:
+                ref.set(
+                    {
+                        "count": firestore.Increment(pending),
+                        "expires_at": datetime.fromtimestamp(
+                            window.resets_at, tz=timezone.utc
+                        ),
+                    },
+                    merge=True,
+                )
+            snap = ref.get()
+            total = (snap.to_dict() or {}).get("count", 0) if snap.exists else 0
+            with self._lock:
+                window.flushed += pending
+                window.remote = max(0, int(total) - window.flushed)
+                window.synced_at = time.time()
+        except Exception as e:
+            logger.warning("Falha ao sincronizar contador de rate limit: %s", e)
+        finally:
+            with self._lock:
+                window.busy = False
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            window = self._current(key)
+            return window.count if window else 0
+
+    def get_expiry(self, key: str) -> float:
+        with self._lock:
+            window = self._current(key)
+            return window.resets_at if window else time.time()
+
+    def check(self) -> bool:
+        return True
+
+    def reset(self) -> Optional[int]:
+        with self._lock:
+            count = len(self._windows)
+            self._windows.clear()
+        return count
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            self._windows.pop(key, None)
@@ -1,119 +1,286 @@
+"""
+Limite diário de uso das features de IA por usuário e plano.
+
+Estado compacto em `rate_limits/{user_id}`: `buckets.{action}` é um mapa
+{hora UTC "YYYYMMDDHH": contagem} com no máximo WINDOW_BUCKETS entradas. A
+janela deslizante de 24h é a soma das últimas 24 horas, atualizada com
+`Increment` dentro de uma transação (sem corrida entre requisições).
+
+Na frente do Firestore há uma concessão local (token bucket) por processo:
+quando a transação mostra que ainda sobra bastante cota, o processo recebe
+até LEASE_MAX usos para decidir sozinho por LEASE_TTL_SECONDS, sem leitura.
+O uso consumido localmente é gravado em segundo plano (Increment, sem
+leitura). Cada concessão é de no máximo 1/LEASE_FRACTION do saldo restante
+(e nenhuma quando o saldo é pequeno), então o excesso possível entre workers
+fica limitado às concessões em aberto. Concessões vencidas e sem uso pendente
+são descartadas (no máximo uma varredura a cada LEASE_TTL_SECONDS), então o
+mapa só guarda usuários ativos recentemente.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Tuple
 
 from app.core.database import get_db
+from app.core.logger import get_logger
 from fastapi import HTTPException
+from google.cloud import firestore
+
+logger = get_logger(__name__)
+
+COLLECTION_NAME = "rate_limits"
+
+TIER_LIMITS = {"premium": 500, "pro": 50, "free": 0}
+
+BUCKET_FORMAT = "%Y%m%d%H"
+WINDOW_BUCKETS = 24
+
+LEASE_MAX = 10
+LEASE_TTL_SECONDS = 30
+LEASE_FRACTION = 4
+
+
+def _bucket_key(dt: datetime) -> str:
+    return dt.strftime(BUCKET_FORMAT)
+
+
+def _window_keys(now: datetime) -> set:
+    """Chaves das últimas WINDOW_BUCKETS horas, incluindo a atual."""
+    return {_bucket_key(now - timedelta(hours=i)) for i in range(WINDOW_BUCKETS)}
+
+
+def _window_used(buckets: Dict[str, int], now: datetime) -> int:
+    window = _window_keys(now)
+    return sum(int(n) for key, n in buckets.items() if key in window)
+
+
+def _legacy_buckets(timestamps, now: datetime) -> Dict[str, int]:
+    """Converte a lista antiga de timestamps (formato anterior) em buckets."""
+    cutoff = now - timedelta(days=1)
+    buckets: Dict[str, int] = {}
+    for t in timestamps or []:
+        if isinstance(t, str):
+            try:
+                t = datetime.fromisoformat(t)
+            except ValueError:
+                continue
+        if not isinstance(t, datetime):
+            continue
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        if t > cutoff:
+            key = _bucket_key(t.astimezone(timezone.utc))
+            buckets[key] = buckets.get(key, 0) + 1
+    return buckets
+
+
+def _action_buckets(data: dict, action: str, now: datetime) -> Tuple[dict, bool]:
+    """(buckets da ação, veio do formato antigo?)"""
+    buckets = (data.get("buckets") or {}).get(action)
+    if isinstance(buckets, dict):
+        return buckets, False
+    if isinstance(data.get(action), list):
+        return _legacy_buckets(data[action], now), True
+    return {}, False
+
+
+def _bucket_update(
+    buckets: dict, action: str, now: datetime, delta: int, legacy: bool
+) -> dict:
+    """Payload (set merge) que soma `delta` na hora atual e apaga horas vencidas."""
+    current = _bucket_key(now)
+    window = _window_keys(now)
+    if legacy:
+        # Migração: grava os buckets derivados por completo e remove a lista
+        values = {k: n for k, n in buckets.items() if k in window}
+        values[current] = values.get(current, 0) + delta
+        return {"buckets": {action: values}, action: firestore.DELETE_FIELD}
+
+    changes = {k: firestore.DELETE_FIELD for k in buckets if k not in window}
+    if delta:
+        changes[current] = firestore.Increment(delta)
+    return {"buckets": {action: changes}} if changes else {}
+
+
+@firestore.transactional
+def _reserve_in_transaction(transaction, ref, action, limit, pending, now):
+    """
+    Grava `pending` (uso já concedido localmente) e, se couber, mais 1 uso.
+    Retorna (permitido, usados na janela depois da operação).
+    """
+    snap = ref.get(transaction=transaction)
+    data = snap.to_dict() if snap.exists else {}
+    buckets, legacy = _action_buckets(data or {}, action, now)
+
+    used = _window_used(buckets, now) + pending
+    allowed = used < limit
+    update = _bucket_update(buckets, action, now, pending + int(allowed), legacy)
+    if update:
+        transaction.set(ref, update, merge=True)
+    return allowed, used + int(allowed)
+
+
+class _Lease:
+    __slots__ = ("remaining", "expires_at", "pending", "flush_scheduled")
+
+    def __init__(self, remaining: int, expires_at: float):
+        self.remaining = remaining
+        self.expires_at = expires_at
+        self.pending = 0
+        self.flush_scheduled = False
 
 
 class RateLimiter:
     def __init__(self):
         # Base limits (fallback)
         self.DEFAULT_LIMITS = {"classify": 20, "chat": 20}
+        self._lock = threading.Lock()
+        self._leases: Dict[Tuple[str, str], _Lease] = {}
+        self._next_sweep = 0.0
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rate-limit-writer"
+        )
+
+    def _limit_for(self, tier: str) -> int:
+        return TIER_LIMITS.get(tier, 0)
+
+    def _doc_ref(self, user_id: str):
+        return get_db().collection(COLLECTION_NAME).document(user_id)
+
+    def _take_local(self, key) -> bool:
+        """Consome um uso da concessão local, se houver; agenda a gravação."""
+        with self._lock:
+            lease = self._leases.get(key)
+            if not lease or lease.remaining <= 0:
+                return False
+            if lease.expires_at <= time.monotonic():
+                return False
+            lease.remaining -= 1
+            lease.pending += 1
+            schedule = not lease.flush_scheduled
+            lease.flush_scheduled = True
+
+        if schedule:
+            self._writer.submit(self._flush_pending, key)
+        return True
+
+    def _take_pending(self, key) -> int:
+        with self._lock:
+            lease = self._leases.get(key)
+            if not lease:
+                return 0
+            pending, lease.pending = lease.pending, 0
+            lease.flush_scheduled = False
+            if lease.expires_at <= time.monotonic():
+                # Vencida e agora sem pendência: não há por que guardá-la
+                del self._leases[key]
+            return pending
+
+    def _sweep_expired(self, now: float):
+        """Descarta concessões vencidas sem uso pendente (chamar com o lock)."""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + LEASE_TTL_SECONDS
+        expired = [
+            key
+            for key, lease in self._leases.items()
+            if lease.expires_at <= now
+            and not lease.pending
+            and not lease.flush_scheduled
+        ]
+        for key in expired:
+            del self._leases[key]
 
-    def _get_clean_timestamps(self, timestamps, cutoff):
-        """Helper to filter old timestamps"""
-        valid = []
-        for t in timestamps:
-            # Handle string dates if any (legacy)
-            if isinstance(t, str):
-                try:
-                    t = datetime.fromisoformat(t)
-                except ValueError:
-                    continue
-
-            # Ensure timezone awareness for comparison
-            if isinstance(t, datetime):
-                if t.tzinfo is None:
-                    t = t.replace(tzinfo=timezone.utc)
-                if t > cutoff:
-                    valid.append(t)
-        return valid
+    def _return_pending(self, key, pending: int):
+        with self._lock:
+            lease = self._leases.setdefault(key, _Lease(0, 0.0))
+            lease.pending += pending
+
+    def _flush_pending(self, key):
+        """Grava em segundo plano o uso concedido localmente (sem leitura)."""
+        pending = self._take_pending(key)
+        if not pending:
+            return
+        user_id, action = key
+        now = datetime.now(timezone.utc)
+        try:
+            self._doc_ref(user_id).set(
+                {"buckets": {action: {_bucket_key(now): firestore.Increment(pending)}}},
+                merge=True,
+            )
+        except Exception as e:
+            logger.warning("Falha ao gravar rate_limits (User: %s): %s", user_id, e)
+            self._return_pending(key, pending)
 
     def check_limit(self, user_id: str, action: str, tier: str = "free"):
         """
         Verifica se o usuário excedeu o limite para a ação, baseado no plano.
         Persiste no Firestore.
         """
-        now = datetime.now(timezone.utc)
-
-        # 1. Determina o limite baseado no Tier
-        limit = 0  # Default (Free)
-
-        if tier == "premium":
-            limit = 500
-        elif tier == "pro":
-            limit = 50
-        elif tier == "free":
-            limit = 0
+        limit = self._limit_for(tier)
 
-        # 2. Se limite é 0, bloqueia imediatamente
+        # Se limite é 0, bloqueia imediatamente
         if limit == 0:
             raise HTTPException(
                 status_code=403,
                 detail=f"Feature '{action}' is not available for Free plan. Please upgrade.",
             )
 
-        # 3. Carrega do Firestore
-        db = get_db()
-        doc_ref = db.collection("rate_limits").document(user_id)
-        doc = doc_ref.get()
-
-        data = doc.to_dict() if doc.exists else {}
-        timestamps = data.get(action, [])
+        key = (user_id, action)
+        if self._take_local(key):
+            return
 
-        # 4. Limpa timestamps antigos (> 24h)
-        cutoff = now - timedelta(days=1)
-        valid_timestamps = self._get_clean_timestamps(timestamps, cutoff)
-
-        # 5. Verifica contagem
-        count = len(valid_timestamps)
+        # Caminho com transação: aplica o uso local pendente e decide
+        pending = self._take_pending(key)
+        db = get_db()
+        try:
+            allowed, used = _reserve_in_transaction(
+                db.transaction(),
+                self._doc_ref(user_id),
+                action,
+                limit,
+                pending,
+                datetime.now(timezone.utc),
+            )
+        except Exception:
+            self._return_pending(key, pending)
+            raise
 
-        if count >= limit:
-            # Update cleaned timestamps even if blocked, to save space?
-            # Optional, but good practice.
-            if len(timestamps) != len(valid_timestamps):
-                doc_ref.set({action: valid_timestamps}, merge=True)
+        remaining = limit - used
+        grant = min(LEASE_MAX, remaining // LEASE_FRACTION) if allowed else 0
+        with self._lock:
+            now = time.monotonic()
+            self._sweep_expired(now)
+            lease = self._leases.get(key)
+            carried = lease.pending if lease else 0
+            lease = _Lease(grant, now + LEASE_TTL_SECONDS)
+            lease.pending = carried
+            self._leases[key] = lease
 
+        if not allowed:
             raise HTTPException(
                 status_code=429,
                 detail=f"Rate limit exceeded for '{action}'. Max {limit} per day. Upgrade to Premium for unlimited access.",
             )
 
-        # 6. Registra uso e salva
-        valid_timestamps.append(now)
-        doc_ref.set({action: valid_timestamps}, merge=True)
-
     def get_usage_info(self, user_id: str, action: str, tier: str = "free"):
         """
         Retorna informações de uso: {used, limit, remaining}
         """
         now = datetime.now(timezone.utc)
+        limit = self._limit_for(tier)
 
-        # 1. Determina limite
-        limit = 0
-        if tier == "premium":
-            limit = 500
-        elif tier == "pro":
-            limit = 50
-        elif tier == "free":
-            limit = 0
-
-        # 2. Carrega do Firestore
-        db = get_db()
-        doc_ref = db.collection("rate_limits").document(user_id)
-        doc = doc_ref.get()
-
+        doc = self._doc_ref(user_id).get()
         data = doc.to_dict() if doc.exists else {}
-        timestamps = data.get(action, [])
-
-        # 3. Limpa timestamps antigos
-        cutoff = now - timedelta(days=1)
-        valid_timestamps = self._get_clean_timestamps(timestamps, cutoff)
-
-        used = len(valid_timestamps)
+        buckets, _ = _action_buckets(data or {}, action, now)
 
-        # Optional: Save cleaned list to DB if it changed significantly?
-        # Let's avoid extra writes on GET unless necessary.
+        with self._lock:
+            lease = self._leases.get((user_id, action))
+            pending = lease.pending if lease else 0
 
+        used = _window_used(buckets, now) + pending
         return {"used": used, "limit": limit, "remaining": max(0, limit - used)}
 
 
@@ -0,0 +1,98 @@
+"""
+Cache de dados de referência com escopo de requisição (contextvars).
+
+Uma mesma requisição costuma ler categorias, contas e preferências várias
+vezes (dashboard, orçamentos, IA, importação). Com o middleware ativo, cada
+coleção é lida no máximo uma vez por requisição; escritas da própria
+requisição invalidam o namespace afetado.
+
+Fora de uma requisição (scripts, jobs, testes) não há escopo ativo e as
+funções decoradas consultam o Firestore normalmente.
+"""
+
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_MISSING = object()
+
+_request_cache: ContextVar[Optional[dict]] = ContextVar("request_cache", default=None)
+
+
+def begin():
+    """Abre um escopo novo e retorna o token para `end`."""
+    return _request_cache.set({})
+
+
+def end(token):
+    _request_cache.reset(token)
+
+
+@contextmanager
+def request_scope():
+    token = begin()
+    try:
+        yield
+    finally:
+        end(token)
+
+
+def memoize(namespace: str):
+    """
+    Memoiza o resultado da função por (argumentos) dentro do escopo atual.
+    Listas são devolvidas como cópia rasa para que o chamador possa ordenar
+    ou filtrar sem afetar as próximas leituras.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = _request_cache.get()
+            if cache is None:
+                return func(*args, **kwargs)
+
+            bucket = cache.setdefault(namespace, {})
+            key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+            try:
+                value = bucket.get(key, _MISSING)
+            except TypeError:
+                # Argumento não-hashable: sem cache
+                return func(*args, **kwargs)
+
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                bucket[key] = value
+
+            return list(value) if isinstance(value, list) else value
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(*namespaces: str):
+    """Descarta o que foi memoizado nos namespaces (chamado após escritas)."""
+    cache = _request_cache.get()
+    if cache is None:
+        return
+    for namespace in namespaces:
+        cache.pop(namespace, None)
+
+
+class RequestCacheMiddleware:
+    """Middleware ASGI que abre um escopo de cache por requisição HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = begin()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            end(token)
@@ -1,23 +1,138 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
 from app.core.logger import get_logger
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from firebase_admin import auth
+from firebase_admin import _token_gen, auth
 
 logger = get_logger(__name__)
 
 # Isso cria o esquema de segurança no Swagger UI (o cadeado)
 security = HTTPBearer()
 
+# E-mails com acesso administrativo além da custom claim `admin`
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+
+# --- Cache de tokens verificados ---
+# Um carregamento do dashboard faz várias chamadas autenticadas com o mesmo
+# token; a verificação (RSA + certificados) só roda na primeira. As claims
+# ficam em cache pelo digest do token até o `exp` dele (no máximo 1h).
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_MAX_LIFETIME_SECONDS = 3600
+
+_token_lock = threading.Lock()
+_token_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+# uid -> instante da revogação; tokens autenticados antes disso são recusados
+_revoked_at: Dict[str, int] = {}
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _is_revoked(claims: dict) -> bool:
+    revoked = _revoked_at.get(claims.get("uid"))
+    if revoked is None:
+        return False
+    return (claims.get("auth_time") or claims.get("iat") or 0) < revoked
+
+
+def verify_token(token: str) -> dict:
+    """
+    `auth.verify_id_token` com cache: tokens já verificados nesta instância
+    e ainda não expirados não passam de novo pela criptografia.
+    """
+    digest = _token_digest(token)
+    now = time.time()
+    with _token_lock:
+        entry = _token_cache.get(digest)
+        if entry and entry[0] > now:
+            _token_cache.move_to_end(digest)
+            claims = entry[1]
+        else:
+            _token_cache.pop(digest, None)
+            claims = None
+
+    if claims is None:
+        claims = auth.verify_id_token(token)
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)) and exp > now and not _is_revoked(claims):
+            with _token_lock:
+                _token_cache[digest] = (float(exp), claims)
+                while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+                    _token_cache.popitem(last=False)
+
+    if _is_revoked(claims):
+        raise auth.RevokedIdTokenError("O token foi revogado.")
+    return dict(claims)
+
+
+def revoke_user_tokens(user_id: str):
+    """
+    Gancho de revogação: descarta do cache os tokens do usuário e recusa os
+    emitidos antes de agora (conta excluída, logout forçado). Vale para esta
+    instância; nas demais o token cacheado expira em até 1h.
+    """
+    now = int(time.time())
+    with _token_lock:
+        _revoked_at[user_id] = now
+        for uid in [
+            u for u, at in _revoked_at.items() if now - at > TOKEN_MAX_LIFETIME_SECONDS
+        ]:
+            del _revoked_at[uid]
+        for digest in [
+            d for d, (_, c) in _token_cache.items() if c.get("uid") == user_id
+        ]:
+            del _token_cache[digest]
+
+
+def clear_token_cache():
+    with _token_lock:
+        _token_cache.clear()
+        _revoked_at.clear()
+
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def warm_public_keys() -> bool:
+    """
+    Busca no startup os certificados públicos do Google usados na verificação
+    do ID token, para que a primeira requisição não pague o download. Usa a
+    mesma sessão HTTP (com cache-control) do verificador do firebase_admin,
+    que não tem API pública para isso: firebase-admin fica fixado em 7.x e
+    test_token_cache confere o caminho dos atributos internos.
+    """
+    try:
+        verifier = auth._get_client(None)._token_verifier
+        verifier.request(_token_gen.ID_TOKEN_CERT_URI)
+        return True
+    except Exception as e:
+        logger.warning("Não foi possível pré-carregar as chaves do Firebase: %s", e)
+        return False
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    request: Request = None,
+):
     """
     Valida o token JWT do Firebase e retorna os dados do usuário (payload).
+    O uid fica em `request.state.uid` (chave do rate limit por usuário).
     """
     token = credentials.credentials
 
     try:
-        # Verifica o token com a chave pública do Google
-        decoded_token = auth.verify_id_token(token)
+        # Verifica o token com a chave pública do Google (ou usa o cache)
+        decoded_token = verify_token(token)
+        if request is not None:
+            request.state.uid = decoded_token.get("uid")
         return decoded_token
 
     except Exception as e:
@@ -42,7 +157,22 @@ def get_current_user_optional(
 
     try:
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        return decoded_token
+        return verify_token(token)
     except Exception:
         return None
+
+
+def get_admin_user(current_user: dict = Depends(get_current_user)):
+    """
+    Exige usuário administrador: custom claim `admin` no token ou e-mail
+    verificado listado em ADMIN_EMAILS.
+    """
+    email = (current_user.get("email") or "").lower()
+    is_admin = current_user.get("admin") is True or (
+        email in ADMIN_EMAILS and current_user.get("email_verified") is True
+    )
+    if not is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required."
+        )
+    return current_user
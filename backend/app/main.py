@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 from app.api.calculator import router as calculator_router
@@ -9,6 +10,9 @@ from app.api.routers import ai, analysis, attachments, import_transactions, stri
 from app.api.routes import router as api_router
 from app.core.database import get_db
 from app.core.limiter import limiter
+from app.core import security
+from app.core.request_cache import RequestCacheMiddleware
+from app.services import ai_usage
 from app.core.logger import get_logger
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
@@ -91,6 +95,9 @@ async def add_cors_headers(request: Request, call_next):
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=["*"])
 # --------------------------------------------------
 
+# Cache de categorias/contas/preferências por requisição (app/core/request_cache.py)
+app.add_middleware(RequestCacheMiddleware)
+
 
 #  Adicione as rotas ao app principal
 app.include_router(api_router, prefix="/api")
@@ -125,6 +132,20 @@ async def startup_event():
         # Não vamos crashar o app aqui para permitir que /health responda,
         # mas rotas que usam DB vão falhar.
 
+    # Certificados do Google para verificar ID tokens (sem custo no 1º request)
+    await asyncio.to_thread(security.warm_public_keys)
+
+    # Grava periodicamente a contabilidade de uso da IA (ai_usage)
+    app.state.ai_usage_flusher = asyncio.create_task(ai_usage.run_flusher())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    flusher = getattr(app.state, "ai_usage_flusher", None)
+    if flusher:
+        flusher.cancel()
+    await asyncio.to_thread(ai_usage.flush)
+
 
 @app.get("/")
 def read_root():
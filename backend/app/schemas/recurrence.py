@@ -80,6 +80,7 @@ class Recurrence(RecurrenceBase):
     user_id: str
     created_at: datetime = Field(default_factory=datetime.now)
     last_processed_at: Optional[datetime] = None
+    next_due_at: Optional[datetime] = None
     cancellation_date: Optional[date] = None
 
     class Config:
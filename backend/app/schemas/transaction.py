@@ -202,3 +202,9 @@ class Transaction(TransactionBase):
 
     class Config:
         from_attributes = True
+
+
+# 5. Página de transações (paginação por cursor)
+class TransactionPage(BaseModel):
+    items: List[Transaction]
+    next_cursor: Optional[str] = None
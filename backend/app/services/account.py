@@ -1,3 +1,4 @@
+from app.core import request_cache
 from app.core.database import get_db
 from app.schemas.account import Account, AccountCreate, AccountType
 from fastapi import HTTPException
@@ -13,10 +14,12 @@ def create_account(account_in: AccountCreate, user_id: str) -> Account:
     data["user_id"] = user_id  # MARCA O DONO
 
     update_time, doc_ref = db.collection(COLLECTION_NAME).add(data)
+    request_cache.invalidate("accounts")
     return Account(id=doc_ref.id, **data)
 
 
 # Listar: Só traz as contas DO usuário
+@request_cache.memoize("accounts")
 def list_accounts(user_id: str) -> list[Account]:
     db = get_db()
     # FILTRO DE SEGURANÇA
@@ -46,6 +49,7 @@ def update_account(account_id: str, account_in: AccountCreate, user_id: str) ->
     data = account_in.model_dump()
     data["user_id"] = user_id  # Garante que não perde a posse
     doc_ref.update(data)
+    request_cache.invalidate("accounts")
 
     return Account(id=account_id, **data)
 
@@ -59,10 +63,12 @@ def delete_account(account_id: str, user_id: str):
         raise HTTPException(status_code=404, detail="Account not found")
 
     doc_snapshot.reference.delete()
+    request_cache.invalidate("accounts")
     return {"status": "success"}
 
 
 # Helper para uso interno (Transaction Service usa isso)
+@request_cache.memoize("accounts")
 def get_account(account_id: str, user_id: str = None):
     db = get_db()
     doc = db.collection(COLLECTION_NAME).document(account_id).get()
@@ -100,6 +106,7 @@ def delete_all_accounts(user_id: str):
         batch.commit()
         deleted_count += count
 
+    request_cache.invalidate("accounts")
     return deleted_count
 
 
@@ -0,0 +1,301 @@
+"""
+Gateway assíncrono para o Gemini (cliente `client.aio`).
+
+- Backoff exponencial com `asyncio.sleep`: um 429 não prende thread do pool.
+- Semáforo global + semáforo por tier limitam as chamadas simultâneas ao modelo
+  (a espera do backoff acontece fora dos semáforos). O do tier vem primeiro:
+  uma fila do free não segura vagas globais enquanto espera a sua.
+- Limite de chamadas em andamento por usuário: o excedente recebe 429 na hora,
+  em vez de enfileirar e ocupar a fila de todo mundo.
+- Single-flight: chamadas idênticas simultâneas (mesma chave) aguardam uma só
+  chamada ao modelo e compartilham o resultado, entre threads e corrotinas.
+- Streaming (`generate_stream`) para respostas enviadas por SSE.
+- Toda chamada é contabilizada em ai_usage (tokens, latência, retentativas).
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import random
+import threading
+import weakref
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from app.core.logger import get_logger
+from app.services import ai_usage
+from fastapi import HTTPException
+
+logger = get_logger(__name__)
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "16"))
+AI_TIER_CONCURRENCY = {"free": 2, "pro": 8, "premium": 12}
+AI_MAX_INFLIGHT_PER_USER = int(os.getenv("AI_MAX_INFLIGHT_PER_USER", "2"))
+
+
+class AIRequest(NamedTuple):
+    """Chamada ao modelo solicitada por um fluxo de ai_service."""
+
+    model_name: str
+    contents: Any
+    config: Any = None
+    retries: int = 3
+    # Chave de single-flight (None = sem coalescência)
+    key: Optional[str] = None
+
+
+def flight_key(*parts) -> str:
+    """Chave de single-flight a partir das partes que definem a chamada."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        elif not isinstance(part, bytes):
+            part = repr(part).encode()
+        digest.update(part)
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """Rate limit / indisponibilidade temporária (429, 500, 503)."""
+    error_str = str(e).lower()
+    return (
+        "429" in error_str
+        or "quota" in error_str
+        or "resourceexhausted" in error_str
+        or "503" in error_str
+        or "unavailable" in error_str
+        or "500" in error_str
+    )
+
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas em andamento no processo.
+
+    A primeira chamada com uma chave executa; as que chegam enquanto ela não
+    termina esperam o mesmo `concurrent.futures.Future` (bloqueando, em
+    `do`, ou com await, em `do_async`) e recebem o mesmo resultado ou exceção.
+    Nada fica guardado depois que a chamada termina.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, concurrent.futures.Future] = {}
+
+    def _join(self, key: str):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key: str, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable[[], Any]):
+        future, leader = self._join(key)
+        if not leader:
+            logger.debug("Single-flight: aguardando chamada em andamento %s", key)
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        future, leader = self._join(key)
+        if not leader:
+            logger.debug("Single-flight: aguardando chamada em andamento %s", key)
+            # shield: cancelar quem espera não cancela o resultado dos demais
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+single_flight = SingleFlight()
+
+
+class _Limits:
+    def __init__(self):
+        self.global_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        self.tier_semaphores = {
+            tier: asyncio.Semaphore(n) for tier, n in AI_TIER_CONCURRENCY.items()
+        }
+        self.inflight = Counter()
+
+    def tier_semaphore(self, tier: str) -> asyncio.Semaphore:
+        return self.tier_semaphores.get(tier) or self.tier_semaphores["free"]
+
+
+# Semáforos pertencem a um event loop; um conjunto de limites por loop
+_limits_by_loop: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _limits() -> _Limits:
+    loop = asyncio.get_running_loop()
+    limits = _limits_by_loop.get(loop)
+    if limits is None:
+        limits = _Limits()
+        _limits_by_loop[loop] = limits
+    return limits
+
+
+@asynccontextmanager
+async def user_slot(user_id: str):
+    """Reserva uma vaga de chamada em andamento para o usuário (ou 429)."""
+    limits = _limits()
+    if limits.inflight[user_id] >= AI_MAX_INFLIGHT_PER_USER:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many AI requests in progress. Try again shortly.",
+        )
+
+    limits.inflight[user_id] += 1
+    try:
+        yield
+    finally:
+        limits.inflight[user_id] -= 1
+        if limits.inflight[user_id] <= 0:
+            del limits.inflight[user_id]
+
+
+async def generate(
+    client,
+    model_name: str,
+    contents,
+    config=None,
+    tier: str = "free",
+    retries: int = 3,
+    initial_delay: float = 2,
+    key: Optional[str] = None,
+    usage: Optional[ai_usage.Usage] = None,
+) -> Optional[Any]:
+    """
+    client.aio.models.generate_content com limites de concorrência e backoff.
+    Com `key`, chamadas idênticas simultâneas compartilham uma execução;
+    `usage` identifica a chamada na contabilidade de ai_usage.
+    """
+    if not client:
+        return None
+
+    if key:
+        return await single_flight.do_async(
+            key,
+            lambda: generate(
+                client,
+                model_name,
+                contents,
+                config,
+                tier,
+                retries,
+                initial_delay,
+                usage=usage,
+            ),
+        )
+
+    limits = _limits()
+    delay = initial_delay
+    with ai_usage.track(usage, model_name) as timer:
+        for attempt in range(retries):
+            try:
+                async with limits.tier_semaphore(tier), limits.global_semaphore:
+                    timer.response = await client.aio.models.generate_content(
+                        model=model_name, contents=contents, config=config
+                    )
+                    return timer.response
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                if attempt >= retries - 1:
+                    logger.error("Max retries reached for AI call.")
+                    raise
+
+                timer.retries += 1
+                sleep_time = delay + random.uniform(0, 1)  # Add jitter
+                logger.info(
+                    "Quota exceeded. Retrying in %.2fs... (Attempt %d/%d)",
+                    sleep_time,
+                    attempt + 1,
+                    retries,
+                )
+                await asyncio.sleep(sleep_time)
+                delay *= 2  # Exponential backoff
+
+
+async def generate_stream(
+    client,
+    model_name: str,
+    contents,
+    config=None,
+    tier: str = "free",
+    retries: int = 3,
+    initial_delay: float = 2,
+    usage: Optional[ai_usage.Usage] = None,
+) -> AsyncIterator[str]:
+    """
+    Versão streaming de `generate`: repassa o texto dos chunks conforme chegam.
+    Só há retentativa enquanto nenhum chunk foi entregue ao chamador.
+    """
+    if not client:
+        return
+
+    limits = _limits()
+    delay = initial_delay
+    with ai_usage.track(usage, model_name) as timer:
+        for attempt in range(retries):
+            started = False
+            try:
+                async with limits.tier_semaphore(tier), limits.global_semaphore:
+                    stream = await client.aio.models.generate_content_stream(
+                        model=model_name, contents=contents, config=config
+                    )
+                    async for chunk in stream:
+                        # O usage_metadata final vem no último chunk
+                        if getattr(chunk, "usage_metadata", None) is not None:
+                            timer.response = chunk
+                        if chunk.text:
+                            started = True
+                            yield chunk.text
+                return
+            except Exception as e:
+                if started or not is_retryable_error(e):
+                    raise
+                if attempt >= retries - 1:
+                    logger.error("Max retries reached for AI call.")
+                    raise
+
+                timer.retries += 1
+                sleep_time = delay + random.uniform(0, 1)  # Add jitter
+                logger.info(
+                    "Quota exceeded. Retrying in %.2fs... (Attempt %d/%d)",
+                    sleep_time,
+                    attempt + 1,
+                    retries,
+                )
+                await asyncio.sleep(sleep_time)
+                delay *= 2  # Exponential backoff
@@ -1,16 +1,21 @@
+import asyncio
 import hashlib
 import json
 import os
 import random
+import re
 import time
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
 
 from app.core.database import get_db
 from app.core.logger import get_logger
 from app.services import account as account_service
+from app.services import ai_gateway, ai_usage
 from app.services import budget as budget_service
 from app.services import category as category_service
+from app.services import category_classifier
+from app.services import monthly_rollup, receipt_image
 from app.services import transaction as transaction_service
 from google import genai
 from google.genai import types
@@ -51,6 +56,17 @@ class ClassificationResponse(BaseModel):
     category_id: str = Field(description="The ID of the predicted category.")
 
 
+class BatchClassificationItem(BaseModel):
+    index: int = Field(description="Index of the description in the request list.")
+    category_id: Optional[str] = Field(
+        None, description="The ID of the predicted category, or null."
+    )
+
+
+class BatchClassificationResponse(BaseModel):
+    items: List[BatchClassificationItem]
+
+
 # --- SYSTEM INSTRUCTIONS (Moved out of Prompt to save tokens) ---
 SYSTEM_FINANCE_BASE = """Role: Financial Assistant. Task: Manage finances clearly and concisely. Language: PT-BR.
 Rules:
@@ -71,6 +87,13 @@ SYSTEM_CLASSIFY = """You are an expert financial assistant. Your task is to clas
 Output ONLY the category ID in JSON format. If no suitable category is found, output null.
 Example: {"category_id": "12345"}"""
 
+SYSTEM_CLASSIFY_BATCH = """You are an expert financial assistant. Your task is to classify each numbered transaction description into one of the provided categories.
+Output JSON with one item per description: its index and the category ID (null if no suitable category is found).
+Example: {"items": [{"index": 0, "category_id": "12345"}, {"index": 1, "category_id": null}]}"""
+
+# Descrições por prompt na classificação em lote (importação de extratos)
+CLASSIFY_BATCH_SIZE = 40
+
 # Configura o Cliente (carregado do .env)
 GENAI_API_KEY = os.getenv("GOOGLE_API_KEY")
 
@@ -82,14 +105,40 @@ else:
 
 
 def _call_with_retry(
-    model_name, prompt_or_parts, retries=3, initial_delay=2, config=None
+    model_name,
+    prompt_or_parts,
+    retries=3,
+    initial_delay=2,
+    config=None,
+    key=None,
+    usage=None,
 ):
     """
     Helper function to call client.models.generate_content with exponential backoff for rate limits (429).
+    With `key`, identical concurrent calls share one request (single-flight).
+    `usage` (ai_usage.Usage) tags the call for token/latency/cost accounting.
     """
     if not client:
         return None
 
+    if key:
+        return ai_gateway.single_flight.do(
+            key,
+            lambda: _call_with_retry(
+                model_name, prompt_or_parts, retries, initial_delay, config, usage=usage
+            ),
+        )
+
+    with ai_usage.track(usage, model_name) as timer:
+        timer.response = _generate_with_backoff(
+            timer, model_name, prompt_or_parts, retries, initial_delay, config
+        )
+        return timer.response
+
+
+def _generate_with_backoff(
+    timer, model_name, prompt_or_parts, retries, initial_delay, config
+):
     delay = initial_delay
     for attempt in range(retries):
         try:
@@ -97,16 +146,9 @@ def _call_with_retry(
                 model=model_name, contents=prompt_or_parts, config=config
             )
         except Exception as e:
-            error_str = str(e).lower()
-            if (
-                "429" in error_str
-                or "quota" in error_str
-                or "resourceexhausted" in error_str
-                or "503" in error_str
-                or "unavailable" in error_str
-                or "500" in error_str
-            ):
+            if ai_gateway.is_retryable_error(e):
                 if attempt < retries - 1:
+                    timer.retries += 1
                     sleep_time = delay + random.uniform(0, 1)  # Add jitter
                     logger.info(
                         "Quota exceeded. Retrying in %.2fs... (Attempt %d/%d)",
@@ -136,21 +178,243 @@ def get_model_for_tier(tier: str = "free") -> str:
         return "gemini-2.5-flash-lite"
 
 
+# --- Fluxos (sync/async) ---
+# As funções abaixo são escritas uma vez como geradores: montam o contexto
+# (Firestore, síncrono), fazem `response = yield AIRequest(...)` e tratam a
+# resposta. `_run_flow` atende a chamada com o cliente síncrono; `_run_flow_async`
+# roda os trechos síncronos em thread e a chamada ao modelo pelo ai_gateway
+# (asyncio, com semáforos e backoff sem bloquear threads).
+AIRequest = ai_gateway.AIRequest
+flight_key = ai_gateway.flight_key
+
+
+def _advance(flow, value=None, error=None):
+    """Avança o fluxo até o próximo AIRequest -> (terminou, AIRequest | resultado)."""
+    try:
+        if error is not None:
+            return False, flow.throw(error)
+        return False, flow.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _run_flow(flow, usage: Optional[ai_usage.Usage] = None):
+    done, value = _advance(flow)
+    while not done:
+        try:
+            response = _call_with_retry(
+                value.model_name,
+                value.contents,
+                retries=value.retries,
+                config=value.config,
+                key=value.key,
+                usage=usage,
+            )
+        except Exception as e:
+            done, value = _advance(flow, error=e)
+        else:
+            done, value = _advance(flow, response)
+    return value
+
+
+async def _run_flow_async(flow, usage: ai_usage.Usage):
+    async with ai_gateway.user_slot(usage.user_id):
+        done, value = await asyncio.to_thread(_advance, flow)
+        while not done:
+            try:
+                response = await ai_gateway.generate(
+                    client,
+                    value.model_name,
+                    value.contents,
+                    config=value.config,
+                    tier=usage.tier,
+                    retries=value.retries,
+                    key=value.key,
+                    usage=usage,
+                )
+            except Exception as e:
+                done, value = await asyncio.to_thread(_advance, flow, None, e)
+            else:
+                done, value = await asyncio.to_thread(_advance, flow, response)
+        return value
+
+
+class _StreamedResponse(NamedTuple):
+    """Resposta montada a partir dos chunks do stream (fluxos só leem `.text`)."""
+
+    text: str
+
+
+class _JsonStringField:
+    """
+    Extrai de forma incremental o valor de um campo string de um JSON que chega
+    em pedaços (ex: `response` do AIResponse), para repassar o texto ao usuário
+    antes do JSON terminar.
+    """
+
+    def __init__(self, field: str = "response"):
+        self._pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._pos = None
+        self._closed = False
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if self._closed:
+            return ""
+        if self._pos is None:
+            match = self._pattern.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        buf = self._buffer
+        out = []
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self._closed = True
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+
+            # Escape: espera a sequência completa (\uXXXX, com par substituto)
+            size = 2
+            if buf[i + 1 : i + 2] == "u":
+                size = 6
+                if "d800" <= buf[i + 2 : i + 6].lower() <= "dbff":
+                    size = 12
+            if i + size > len(buf):
+                break
+            out.append(json.loads(f'"{buf[i : i + size]}"'))
+            i += size
+
+        self._pos = i
+        return "".join(out)
+
+
+async def _stream_flow(
+    flow, usage: ai_usage.Usage, extract=None
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Versão streaming de `_run_flow_async`. Produz eventos (tipo, dados):
+    "start" assim que a vaga do usuário é reservada, "chunk" com o texto
+    conforme chega do modelo e "done" com o resultado final do fluxo (que
+    recebe o texto completo, como numa chamada normal).
+    `extract` cria o filtro que decide o que do texto vai nos chunks.
+    """
+    async with ai_gateway.user_slot(usage.user_id):
+        yield "start", None
+        done, value = await asyncio.to_thread(_advance, flow)
+        while not done:
+            parts = []
+            visible = extract() if extract else None
+            try:
+                async for text in ai_gateway.generate_stream(
+                    client,
+                    value.model_name,
+                    value.contents,
+                    config=value.config,
+                    tier=usage.tier,
+                    retries=value.retries,
+                    usage=usage,
+                ):
+                    parts.append(text)
+                    piece = visible.feed(text) if visible else text
+                    if piece:
+                        yield "chunk", piece
+            except Exception as e:
+                done, value = await asyncio.to_thread(_advance, flow, None, e)
+            else:
+                response = _StreamedResponse("".join(parts)) if parts else None
+                done, value = await asyncio.to_thread(_advance, flow, response)
+        yield "done", value
+
+
+def _prediction_hash(user_id: str, desc_clean: str) -> str:
+    # Hash inclui description e user_id (privacidade e precisão)
+    return hashlib.md5(
+        f"{user_id}:{desc_clean}".encode("utf-8"), usedforsecurity=False
+    ).hexdigest()
+
+
+def _classification_context(user_id: str):
+    """Categorias do usuário + contexto minificado (categorias e few-shot) do prompt."""
+    # 1. Contexto Minificado (Token Saving)
+    categories = category_service.list_categories(user_id)
+    # Ex: "Transporte,123\nAlimentação,456"
+    cat_lines = [f"{c.name},{c.id}" for c in categories]
+    cat_context = "C:\n" + "\n".join(cat_lines)
+
+    # 2. Few-Shot (Últimas 15 txs para economia de tokens)
+    history = transaction_service.list_transactions(user_id, limit=15)
+    examples = []
+    for t in history:
+        if t.category and t.title:
+            clean_title = t.title.replace('"', "").strip()[:30]  # Limit length
+            examples.append(f"{clean_title}->{t.category.id}")
+
+    examples_block = "Hist:\n" + "\n".join(examples)
+
+    return categories, f"{cat_context}\n{examples_block}"
+
+
+def _classify_locally(
+    descriptions: List[str], user_id: str
+) -> Dict[str, Optional[str]]:
+    """
+    Classificador local (histórico do usuário). Só devolve as descrições com
+    confiança >= CONFIDENCE_THRESHOLD; as demais seguem para cache/LLM.
+    """
+    try:
+        valid_ids = {c.id for c in category_service.list_all_categories_flat(user_id)}
+        results = {}
+        for desc in descriptions:
+            cat_id, confidence = category_classifier.predict(user_id, desc, valid_ids)
+            if cat_id and confidence >= category_classifier.CONFIDENCE_THRESHOLD:
+                results[desc] = cat_id
+        return results
+    except Exception as e:
+        logger.warning("Local classifier error (User: %s): %s", user_id, e)
+        return {}
+
+
 def classify_transaction(
     description: str, user_id: str, tier: str = "pro"
 ) -> Optional[str]:
     """
     Usa IA para classificar transação.
+    Tenta antes o classificador local; o LLM só entra com confiança baixa.
     """
+    usage = ai_usage.Usage("classify_transaction", user_id, tier)
+    return _run_flow(_classify_transaction_flow(description, usage), usage)
+
+
+async def classify_transaction_async(
+    description: str, user_id: str, tier: str = "pro"
+) -> Optional[str]:
+    usage = ai_usage.Usage("classify_transaction", user_id, tier)
+    return await _run_flow_async(_classify_transaction_flow(description, usage), usage)
+
+
+def _classify_transaction_flow(description: str, usage: ai_usage.Usage):
+    user_id, tier = usage.user_id, usage.tier
+    local = _classify_locally([description], user_id)
+    if description in local:
+        logger.debug(
+            "Local classifier hit: '%s' -> %s", description, local[description]
+        )
+        return local[description]
+
     if not client:
         return None
 
     try:
-        # Hash inclui description, user_id E tier (privacidade e precisão)
         desc_clean = description.strip().lower()
-        desc_hash = hashlib.md5(
-            f"{user_id}:{desc_clean}".encode("utf-8"), usedforsecurity=False
-        ).hexdigest()
+        desc_hash = _prediction_hash(user_id, desc_clean)
 
         db = get_db()
         cache_ref = db.collection("ai_predictions").document(desc_hash)
@@ -162,39 +426,29 @@ def classify_transaction(
                 logger.debug(
                     "AI Cache Hit: '%s' -> %s", description, data.get("category_id")
                 )
+                ai_usage.record_cache(usage, hit=True)
                 return data.get("category_id")
+        ai_usage.record_cache(usage, hit=False)
 
-        # 1. Contexto Minificado (Token Saving)
-        categories = category_service.list_categories(user_id)
-        # Ex: "Transporte,123\nAlimentação,456"
-        cat_lines = [f"{c.name},{c.id}" for c in categories]
-        cat_context = "C:\n" + "\n".join(cat_lines)
-
-        # 2. Few-Shot (Últimas 15 txs para economia de tokens)
-        history = transaction_service.list_transactions(user_id, limit=15)
-        examples = []
-        for t in history:
-            if t.category and t.title:
-                clean_title = t.title.replace('"', "").strip()[:30]  # Limit length
-                examples.append(f"{clean_title}->{t.category.id}")
-
-        examples_block = "Hist:\n" + "\n".join(examples)
+        # 1-2. Categorias + few-shot
+        categories, context = _classification_context(user_id)
 
         # 3. Prompt Compacto
         model_name = get_model_for_tier(tier)
 
-        prompt = f"{cat_context}\n{examples_block}\nClassify:'{description}'"
+        prompt = f"{context}\nClassify:'{description}'"
 
         # 4. Chama IA com JSON Nativo
-        response = _call_with_retry(
-            model_name=model_name,
-            prompt_or_parts=prompt,
+        response = yield AIRequest(
+            model_name,
+            prompt,
             config=types.GenerateContentConfig(
                 system_instruction=SYSTEM_CLASSIFY,
                 response_mime_type="application/json",
                 response_schema=ClassificationResponse,
                 temperature=0.1,
             ),
+            key=flight_key("classify", desc_hash, tier),
         )
 
         if not response or not response.text:
@@ -227,6 +481,130 @@ def classify_transaction(
         return None
 
 
+def classify_transactions_batch(
+    descriptions: List[str], user_id: str, tier: str = "pro"
+) -> Dict[str, Optional[str]]:
+    """
+    Classifica várias descrições (ex: linhas de um extrato importado).
+    Deduplica, tenta o classificador local, resolve o cache com um único
+    get_all, monta o contexto uma vez e envia as que faltam em prompts de até
+    CLASSIFY_BATCH_SIZE itens.
+    Retorna {descrição normalizada (strip/lower): category_id ou None}.
+    """
+    unique = list(dict.fromkeys(d.strip().lower() for d in descriptions if d))
+    if not unique:
+        return {}
+
+    # 0. Classificador local: comerciantes conhecidos não vão ao cache nem ao LLM
+    results: Dict[str, Optional[str]] = _classify_locally(unique, user_id)
+    unique = [desc for desc in unique if desc not in results]
+    if not unique or not client:
+        return results
+
+    usage = ai_usage.Usage("classify_transactions_batch", user_id, tier)
+
+    db = get_db()
+    refs = {
+        desc: db.collection("ai_predictions").document(_prediction_hash(user_id, desc))
+        for desc in unique
+    }
+
+    # 1. Cache: uma ida ao Firestore para todas as descrições
+    try:
+        by_hash = {snap.id: snap for snap in db.get_all(list(refs.values()))}
+    except Exception as e:
+        logger.warning("AI cache get_all falhou (User: %s): %s", user_id, e)
+        by_hash = {}
+
+    misses = []
+    for desc, ref in refs.items():
+        snap = by_hash.get(ref.id)
+        cached_id = snap.to_dict().get("category_id") if snap and snap.exists else None
+        if cached_id:
+            results[desc] = cached_id
+        else:
+            misses.append(desc)
+
+    logger.debug(
+        "AI batch classify: %d únicas, %d cache hits", len(unique), len(unique) - len(misses)
+    )
+    ai_usage.record_cache(usage, hit=True, count=len(unique) - len(misses))
+    ai_usage.record_cache(usage, hit=False, count=len(misses))
+    if not misses:
+        return results
+
+    try:
+        categories, context = _classification_context(user_id)
+    except Exception as e:
+        logger.error("Error building AI classification context: %s", e)
+        return results
+
+    valid_ids = {c.id for c in categories}
+    model_name = get_model_for_tier(tier)
+
+    batch = db.batch()
+    pending = 0
+
+    for start in range(0, len(misses), CLASSIFY_BATCH_SIZE):
+        chunk = misses[start : start + CLASSIFY_BATCH_SIZE]
+        lines = "\n".join(f"{i}:'{desc}'" for i, desc in enumerate(chunk))
+        prompt = f"{context}\nClassify:\n{lines}"
+
+        try:
+            response = _call_with_retry(
+                model_name=model_name,
+                prompt_or_parts=prompt,
+                config=types.GenerateContentConfig(
+                    system_instruction=SYSTEM_CLASSIFY_BATCH,
+                    response_mime_type="application/json",
+                    response_schema=BatchClassificationResponse,
+                    temperature=0.1,
+                ),
+                key=flight_key("classify_batch", user_id, model_name, prompt),
+                usage=usage,
+            )
+            if not response or not response.text:
+                continue
+            res_data = BatchClassificationResponse.model_validate_json(response.text)
+        except Exception as e:
+            logger.error("Error calling AI batch (%s): %s", tier, e)
+            continue
+
+        for item in res_data.items:
+            if not 0 <= item.index < len(chunk):
+                continue
+            if item.category_id not in valid_ids:
+                continue
+
+            desc = chunk[item.index]
+            results[desc] = item.category_id
+
+            # SALVA NO CACHE (em lote)
+            batch.set(
+                refs[desc],
+                {
+                    "description": desc,
+                    "category_id": item.category_id,
+                    "tier_used": tier,
+                    "created_at": datetime.now(),
+                },
+            )
+            pending += 1
+
+            if pending >= 400:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+
+    if pending > 0:
+        try:
+            batch.commit()
+        except Exception as e:
+            logger.warning("AI cache batch write falhou (User: %s): %s", user_id, e)
+
+    return results
+
+
 def chat_finance(
     message: str,
     user_id: str,
@@ -237,6 +615,50 @@ def chat_finance(
     """
     Chatbot financeiro.
     """
+    usage = ai_usage.Usage("chat_finance", user_id, tier)
+    return _run_flow(_chat_finance_flow(message, usage, persona, history), usage)
+
+
+async def chat_finance_async(
+    message: str,
+    user_id: str,
+    tier: str = "pro",
+    persona: str = "friendly",
+    history: Optional[List[dict]] = None,
+) -> str:
+    usage = ai_usage.Usage("chat_finance", user_id, tier)
+    return await _run_flow_async(
+        _chat_finance_flow(message, usage, persona, history), usage
+    )
+
+
+def chat_finance_stream(
+    message: str,
+    user_id: str,
+    tier: str = "pro",
+    persona: str = "friendly",
+    history: Optional[List[dict]] = None,
+):
+    """
+    Chat em streaming: os chunks trazem o texto de `response` conforme o modelo
+    gera; a ação estruturada é processada quando o stream termina e a mensagem
+    final (com o resultado da ação) vem no evento "done".
+    """
+    usage = ai_usage.Usage("chat_finance_stream", user_id, tier)
+    return _stream_flow(
+        _chat_finance_flow(message, usage, persona, history),
+        usage,
+        extract=_JsonStringField,
+    )
+
+
+def _chat_finance_flow(
+    message: str,
+    usage: ai_usage.Usage,
+    persona: str,
+    history: Optional[List[dict]],
+):
+    user_id, tier = usage.user_id, usage.tier
     if tier == "free":
         return "Upgrade to Pro to chat with AI!"
 
@@ -310,16 +732,18 @@ def chat_finance(
             types.Content(role="user", parts=[types.Part.from_text(text=user_prompt)])
         )
 
-        # 4. Chama a IA com Schema JSON Nativo
-        response = client.models.generate_content(
-            model=model_name,
-            contents=contents,
+        # 4. Chama a IA com Schema JSON Nativo (sem retentativas, como antes)
+        response = yield AIRequest(
+            model_name,
+            contents,
             config=types.GenerateContentConfig(
                 system_instruction=sys_instr,
                 response_mime_type="application/json",
                 response_schema=AIResponse,
                 temperature=0.8 if persona == "roast" else 0.4,
             ),
+            retries=1,
+            key=flight_key("chat", user_id, model_name, persona, contents),
         )
 
         if not response or not response.text:
@@ -499,10 +923,36 @@ def parse_receipt(
     """
     Extrai dados de comprovante com foco em descrição detalhada (Itens + Localização).
     """
+    usage = ai_usage.Usage("parse_receipt", user_id, tier)
+    return _run_flow(_parse_receipt_flow(image_bytes, mime_type, usage), usage)
+
+
+async def parse_receipt_async(
+    image_bytes: bytes, mime_type: str, user_id: str, tier: str = "pro"
+) -> Optional[dict]:
+    usage = ai_usage.Usage("parse_receipt", user_id, tier)
+    return await _run_flow_async(
+        _parse_receipt_flow(image_bytes, mime_type, usage), usage
+    )
+
+
+def _parse_receipt_flow(image_bytes: bytes, mime_type: str, usage: ai_usage.Usage):
+    user_id, tier = usage.user_id, usage.tier
     if not client:
         return None
 
     try:
+        # Cache por conteúdo: o mesmo comprovante nunca vai duas vezes ao modelo
+        digest = receipt_image.content_hash(image_bytes)
+        db = get_db()
+        cache_ref = db.collection("receipt_scans").document(f"{user_id}_{digest}")
+        cache_doc = cache_ref.get()
+        if cache_doc.exists and (cache_doc.to_dict() or {}).get("result"):
+            logger.debug("Receipt cache hit: %s", digest)
+            ai_usage.record_cache(usage, hit=True)
+            return dict(cache_doc.to_dict()["result"])
+        ai_usage.record_cache(usage, hit=False)
+
         categories = category_service.list_categories(user_id)
         cat_str = ";".join([f"{c.id}:{c.name}" for c in categories])
 
@@ -538,7 +988,12 @@ def parse_receipt(
             max_output_tokens=1000,
         )
 
-        response = _call_with_retry(model_name, [prompt, img_part], config=config)
+        response = yield AIRequest(
+            model_name,
+            [prompt, img_part],
+            config=config,
+            key=flight_key("receipt", user_id, model_name, mime_type, digest),
+        )
         if not response:
             return {"error": "Sem resposta da AI após o upload."}
 
@@ -550,7 +1005,7 @@ def parse_receipt(
 
         try:
             data = json.loads(text)
-            return {
+            result = {
                 "date": data.get("date"),
                 "amount": float(data.get("amount", 0)),
                 "title": data.get("title", "Desconhecido"),
@@ -563,6 +1018,21 @@ def parse_receipt(
             logger.warning("AI Parse Failed (Invalid JSON). Response: %s", text)
             return None
 
+        try:
+            cache_ref.set(
+                {
+                    "user_id": user_id,
+                    "hash": digest,
+                    "mime_type": mime_type,
+                    "result": result,
+                    "created_at": datetime.now(),
+                }
+            )
+        except Exception as e:
+            logger.warning("Receipt cache write failed (User: %s): %s", user_id, e)
+
+        return result
+
     except Exception as e:
         logger.error("Receipt Error: %s", e)
         return None
@@ -574,6 +1044,27 @@ def generate_monthly_report(
     """
     Relatório mensal com Cache e Modelo Dinâmico.
     """
+    usage = ai_usage.Usage("generate_monthly_report", user_id, tier)
+    return _run_flow(_monthly_report_flow(month, year, usage), usage)
+
+
+async def generate_monthly_report_async(
+    user_id: str, month: int, year: int, tier: str = "pro"
+) -> str:
+    usage = ai_usage.Usage("generate_monthly_report", user_id, tier)
+    return await _run_flow_async(_monthly_report_flow(month, year, usage), usage)
+
+
+def generate_monthly_report_stream(
+    user_id: str, month: int, year: int, tier: str = "pro"
+):
+    """Relatório mensal em streaming; o texto completo vai para o cache no fim."""
+    usage = ai_usage.Usage("generate_monthly_report_stream", user_id, tier)
+    return _stream_flow(_monthly_report_flow(month, year, usage), usage)
+
+
+def _monthly_report_flow(month: int, year: int, usage: ai_usage.Usage):
+    user_id, tier = usage.user_id, usage.tier
     if not client:
         return "IA indisponível."
 
@@ -585,14 +1076,42 @@ def generate_monthly_report(
         else:
             end_date = datetime(year, month + 1, 1) - timedelta(seconds=1)
 
-        txs = transaction_service.list_transactions(
-            user_id, start_date=start_date, end_date=end_date
-        )
+        # Agregado mensal (1 leitura) quando disponível; senão varre as transações
+        month_key = f"{year:04d}-{month:02d}"
+        rollups = monthly_rollup.get_rollups(user_id, [month_key])
+
+        total = 0
+        cat_vals = {}
+        if rollups is not None:
+            rollup = rollups[month_key]
+            tx_count = rollup["count"]
+            total_amount = sum(
+                v for types_ in rollup["categories"].values() for v in types_.values()
+            )
+            cat_names = {
+                c.id: c.name
+                for c in category_service.list_all_categories_flat(user_id)
+            }
+            for cat_id, v in monthly_rollup.category_totals(rollup, "expense").items():
+                total += v
+                c = cat_names.get(cat_id, "Oth")
+                cat_vals[c] = cat_vals.get(c, 0) + v
+        else:
+            txs = transaction_service.list_transactions(
+                user_id, start_date=start_date, end_date=end_date
+            )
+            tx_count = len(txs)
+            total_amount = sum(t.amount for t in txs)
+            for t in txs:
+                if t.type == "expense":
+                    v = abs(t.amount)
+                    total += v
+                    c = t.category.name if t.category else "Oth"
+                    cat_vals[c] = cat_vals.get(c, 0) + v
 
         # 2. Cache Key (Hash rápido: User+Date+Length+Sum+Tier)
-        total_amount = sum(t.amount for t in txs)
         full_hash = hashlib.md5(
-            f"{user_id}:{month}:{year}:{len(txs)}:{total_amount:.2f}:{tier}".encode(),
+            f"{user_id}:{month}:{year}:{tx_count}:{total_amount:.2f}:{tier}".encode(),
             usedforsecurity=False,
         ).hexdigest()
 
@@ -608,18 +1127,11 @@ def generate_monthly_report(
             d = doc.to_dict()
             if d.get("hash") == full_hash and d.get("content"):
                 logger.info("[REPORTE] Cache hit.")
+                ai_usage.record_cache(usage, hit=True)
                 return d.get("content")
+        ai_usage.record_cache(usage, hit=False)
 
         # 3. Processamento
-        total = 0
-        cat_vals = {}
-        for t in txs:
-            if t.type == "expense":
-                v = abs(t.amount)
-                total += v
-                c = t.category.name if t.category else "Oth"
-                cat_vals[c] = cat_vals.get(c, 0) + v
-
         top3 = dict(sorted(cat_vals.items(), key=lambda x: x[1], reverse=True)[:3])
         logger.info("[REPORTE] Tópicos calculados: %s", top3)
 
@@ -661,7 +1173,9 @@ def generate_monthly_report(
             Keep it actionable.
             """
 
-        response = _call_with_retry(model_name, prompt)
+        response = yield AIRequest(
+            model_name, prompt, key=flight_key("monthly_report", full_hash)
+        )
         if not response:
             return "Não foi possível conectar ao consultor financeiro agora. Tente novamente em instantes."
 
@@ -751,7 +1265,12 @@ def generate_budget_plan(user_id: str, tier: str = "pro") -> str:
         Format: Markdown. Concise. Use bullets.
         """
 
-        response = _call_with_retry(model_name, prompt)
+        response = _call_with_retry(
+            model_name,
+            prompt,
+            key=flight_key("budget_plan", user_id, prompt),
+            usage=ai_usage.Usage("generate_budget_plan", user_id, tier),
+        )
         if not response:
             return "Erro ao contatar a IA para o plano."
 
@@ -815,7 +1334,12 @@ def generate_debt_advice(
         Format: Markdown. Short and encouraging.
         """
 
-        response = _call_with_retry(model_name, prompt)
+        response = _call_with_retry(
+            model_name,
+            prompt,
+            key=flight_key("debt_advice", user_id, prompt),
+            usage=ai_usage.Usage("generate_debt_advice", user_id, tier),
+        )
         if not response:
             return "O consultor de dívidas está ocupado. Tente logo mais."
 
@@ -865,7 +1389,12 @@ def analyze_cost_of_living(user_id: str, data: dict, tier: str = "premium") -> s
         Estilo: Markdown. Linguagem super acessível, direta, como se estivesse explicando para um amigo no café. Evite termos técnicos complicados. Máximo 3 parágrafos curtos.
         """
 
-        response = _call_with_retry(model_name, prompt)
+        response = _call_with_retry(
+            model_name,
+            prompt,
+            key=flight_key("cost_of_living", user_id, prompt),
+            usage=ai_usage.Usage("analyze_cost_of_living", user_id, tier),
+        )
         if not response:
             return "Não foi possível analisar o custo de vida agora."
 
@@ -887,6 +1416,19 @@ def generate_weekly_insights(user_id: str, data: dict, tier: str = "pro") -> str
         "period": str (ex: "09 Mar - 16 Mar")
     }
     """
+    usage = ai_usage.Usage("generate_weekly_insights", user_id, tier)
+    return _run_flow(_weekly_insights_flow(data, usage), usage)
+
+
+async def generate_weekly_insights_async(
+    user_id: str, data: dict, tier: str = "pro"
+) -> str:
+    usage = ai_usage.Usage("generate_weekly_insights", user_id, tier)
+    return await _run_flow_async(_weekly_insights_flow(data, usage), usage)
+
+
+def _weekly_insights_flow(data: dict, usage: ai_usage.Usage):
+    user_id, tier = usage.user_id, usage.tier
     if not client:
         return ""
 
@@ -918,7 +1460,9 @@ def generate_weekly_insights(user_id: str, data: dict, tier: str = "pro") -> str
         Estilo: Texto puro, sem markdown complexo.
         """
 
-        response = _call_with_retry(model_name, prompt)
+        response = yield AIRequest(
+            model_name, prompt, key=flight_key("weekly_insights", user_id, prompt)
+        )
         if not response:
             return ""
 
@@ -933,13 +1477,21 @@ def generate_weekly_insights(user_id: str, data: dict, tier: str = "pro") -> str
 class AIService:
     def __init__(self):
         self.chat_finance = chat_finance
+        self.chat_finance_async = chat_finance_async
+        self.chat_finance_stream = chat_finance_stream
         self.classify_transaction = classify_transaction
+        self.classify_transaction_async = classify_transaction_async
+        self.classify_transactions_batch = classify_transactions_batch
         self.parse_receipt = parse_receipt
+        self.parse_receipt_async = parse_receipt_async
         self.generate_monthly_report = generate_monthly_report
+        self.generate_monthly_report_async = generate_monthly_report_async
+        self.generate_monthly_report_stream = generate_monthly_report_stream
         self.generate_budget_plan = generate_budget_plan
         self.generate_debt_advice = generate_debt_advice
         self.analyze_cost_of_living = analyze_cost_of_living
         self.generate_weekly_insights = generate_weekly_insights
+        self.generate_weekly_insights_async = generate_weekly_insights_async
 
 
 ai_service = AIService()
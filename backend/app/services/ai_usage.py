@@ -0,0 +1,349 @@
+"""
+Contabilidade de uso da IA: tokens, latência, retentativas, custo e cache.
+
+Cada chamada ao modelo (via `_call_with_retry` ou `ai_gateway.generate*`) e
+cada consulta aos caches de IA (`ai_predictions`, relatórios) é somada em
+memória; `flush` grava os agregados com `Increment` no rollup `ai_usage`:
+
+- `ai_usage/{YYYY-MM-DD}`: mapa `entries` por "caller|modelo|tier".
+- `ai_usage/{YYYY-MM-DD}/users/{user_id}`: totais do usuário no dia.
+
+`run_flusher` (iniciado no startup da API) chama `flush` periodicamente.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.database import get_db
+from app.core.logger import get_logger
+from google.cloud import firestore
+
+logger = get_logger(__name__)
+
+COLLECTION_NAME = "ai_usage"
+USERS_SUBCOLLECTION = "users"
+
+FLUSH_INTERVAL_SECONDS = int(os.getenv("AI_USAGE_FLUSH_SECONDS", "60"))
+
+# USD por 1M de tokens (entrada, saída) — tabela pública do Gemini;
+# atualizar junto com get_model_for_tier.
+MODEL_PRICES_USD_PER_MTOK = {
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
+
+class Usage(NamedTuple):
+    """Quem está chamando o modelo (para o rollup)."""
+
+    caller: str
+    user_id: Optional[str] = None
+    tier: Optional[str] = None
+
+
+def estimate_cost(model_name: str, prompt_tokens: int, output_tokens: int) -> float:
+    prices = MODEL_PRICES_USD_PER_MTOK.get(model_name)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+
+
+def token_counts(response) -> Tuple[int, int]:
+    """(tokens de entrada, tokens de saída incluindo raciocínio) do usage_metadata."""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return 0, 0
+    prompt = getattr(meta, "prompt_token_count", None) or 0
+    output = (getattr(meta, "candidates_token_count", None) or 0) + (
+        getattr(meta, "thoughts_token_count", None) or 0
+    )
+    return int(prompt), int(output)
+
+
+# --- Agregação em memória ---
+_lock = threading.Lock()
+_calls: Dict[Tuple[str, str, str, str], Counter] = {}
+_latency_max: Dict[Tuple[str, str, str, str], float] = {}
+_users: Dict[Tuple[str, str], Counter] = {}
+_user_tiers: Dict[Tuple[str, str], str] = {}
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _add(usage: Usage, model_name: str, counters: Dict[str, float], latency=None):
+    day = _today()
+    tier = usage.tier or "unknown"
+    key = (day, usage.caller, model_name, tier)
+    with _lock:
+        _calls.setdefault(key, Counter()).update(counters)
+        if latency is not None:
+            _latency_max[key] = max(_latency_max.get(key, 0.0), latency)
+        if usage.user_id:
+            user_key = (day, usage.user_id)
+            _users.setdefault(user_key, Counter()).update(counters)
+            _user_tiers[user_key] = tier
+
+
+def record_call(
+    usage: Optional[Usage],
+    model_name: str,
+    latency_ms: float,
+    retries: int = 0,
+    response=None,
+    error: bool = False,
+):
+    """Soma uma chamada ao modelo (já com todas as retentativas)."""
+    if usage is None:
+        return
+    prompt_tokens, output_tokens = token_counts(response)
+    _add(
+        usage,
+        model_name,
+        {
+            "calls": 1,
+            "errors": int(error),
+            "retries": retries,
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "latency_ms_total": round(latency_ms, 1),
+            "cost_usd": estimate_cost(model_name, prompt_tokens, output_tokens),
+        },
+        latency=round(latency_ms, 1),
+    )
+
+
+def record_cache(usage: Optional[Usage], hit: bool, count: int = 1):
+    """Soma consultas a um cache de IA (hit = o modelo não foi chamado)."""
+    if usage is None or count <= 0:
+        return
+    _add(usage, "cache", {"cache_hits" if hit else "cache_misses": count})
+
+
+class CallTimer:
+    """Mede latência/retentativas de uma chamada; use com `track`."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.retries = 0
+        self.response = None
+
+    @property
+    def latency_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+@contextmanager
+def track(usage: Optional[Usage], model_name: str):
+    """
+    Registra a chamada ao sair do bloco: o chamador incrementa `timer.retries`
+    e guarda a resposta em `timer.response` para a contagem de tokens.
+    """
+    timer = CallTimer()
+    try:
+        yield timer
+    except BaseException:
+        record_call(usage, model_name, timer.latency_ms, timer.retries, error=True)
+        raise
+    record_call(usage, model_name, timer.latency_ms, timer.retries, timer.response)
+
+
+# --- Persistência ---
+def _take_pending():
+    global _calls, _latency_max, _users, _user_tiers
+    with _lock:
+        pending = (_calls, _latency_max, _users, _user_tiers)
+        _calls, _latency_max, _users, _user_tiers = {}, {}, {}, {}
+    return pending
+
+
+def _restore_pending(calls, latency_max, users, user_tiers):
+    with _lock:
+        for key, counters in calls.items():
+            _calls.setdefault(key, Counter()).update(counters)
+        for key, value in latency_max.items():
+            _latency_max[key] = max(_latency_max.get(key, 0.0), value)
+        for key, counters in users.items():
+            _users.setdefault(key, Counter()).update(counters)
+        for key, tier in user_tiers.items():
+            _user_tiers.setdefault(key, tier)
+
+
+def _increments(counters: Counter) -> dict:
+    return {name: firestore.Increment(value) for name, value in counters.items()}
+
+
+def flush() -> int:
+    """Grava os agregados pendentes no Firestore. Retorna documentos gravados."""
+    calls, latency_max, users, user_tiers = _take_pending()
+    if not calls and not users:
+        return 0
+
+    days: Dict[str, dict] = {}
+    for (day, caller, model_name, tier), counters in calls.items():
+        entry = {
+            "caller": caller,
+            "model": model_name,
+            "tier": tier,
+            **_increments(counters),
+        }
+        if (day, caller, model_name, tier) in latency_max:
+            entry["latency_ms_max"] = firestore.Maximum(
+                latency_max[(day, caller, model_name, tier)]
+            )
+        days.setdefault(day, {})[f"{caller}|{model_name}|{tier}"] = entry
+
+    try:
+        db = get_db()
+        batch = db.batch()
+        count = 0
+        written = 0
+
+        writes = [
+            (
+                db.collection(COLLECTION_NAME).document(day),
+                {"date": day, "entries": entries},
+            )
+            for day, entries in days.items()
+        ]
+        for (day, user_id), counters in users.items():
+            ref = (
+                db.collection(COLLECTION_NAME)
+                .document(day)
+                .collection(USERS_SUBCOLLECTION)
+                .document(user_id)
+            )
+            data = {
+                "date": day,
+                "user_id": user_id,
+                "tier": user_tiers.get((day, user_id)),
+                **_increments(counters),
+            }
+            writes.append((ref, data))
+
+        for ref, data in writes:
+            batch.set(ref, data, merge=True)
+            count += 1
+            written += 1
+            if count >= 400:
+                batch.commit()
+                batch = db.batch()
+                count = 0
+
+        if count > 0:
+            batch.commit()
+    except Exception as e:
+        logger.warning("Falha ao gravar ai_usage, mantendo em memória: %s", e)
+        _restore_pending(calls, latency_max, users, user_tiers)
+        return 0
+
+    return written
+
+
+async def run_flusher(interval: float = FLUSH_INTERVAL_SECONDS):
+    """Laço do startup da API: grava os agregados a cada `interval` segundos."""
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(flush)
+
+
+# --- Leitura (endpoint administrativo) ---
+def _date_range(start: date, end: date) -> List[str]:
+    days = (end - start).days
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days + 1)]
+
+
+def _summary_row(data: dict) -> dict:
+    calls = data.get("calls", 0)
+    lookups = data.get("cache_hits", 0) + data.get("cache_misses", 0)
+    return {
+        **data,
+        "latency_ms_avg": (
+            round(data.get("latency_ms_total", 0) / calls, 1) if calls else None
+        ),
+        "cache_hit_rate": (
+            round(data.get("cache_hits", 0) / lookups, 3) if lookups else None
+        ),
+    }
+
+
+def get_usage(start: date, end: date, user_id: Optional[str] = None) -> dict:
+    """
+    Rollup de uso no intervalo [start, end]: por dia e totalizado por
+    caller/modelo/tier (ou os totais diários de um usuário, com `user_id`).
+    """
+    db = get_db()
+    day_ids = _date_range(start, end)
+
+    if user_id:
+        refs = [
+            db.collection(COLLECTION_NAME)
+            .document(day)
+            .collection(USERS_SUBCOLLECTION)
+            .document(user_id)
+            for day in day_ids
+        ]
+        days = [snap.to_dict() for snap in db.get_all(refs) if snap.exists]
+        days.sort(key=lambda d: d.get("date", ""))
+
+        total = Counter()
+        for data in days:
+            total.update({k: v for k, v in data.items() if isinstance(v, (int, float))})
+        return {
+            "user_id": user_id,
+            "days": [_summary_row(d) for d in days],
+            "total": _summary_row(dict(total)),
+        }
+
+    refs = [db.collection(COLLECTION_NAME).document(day) for day in day_ids]
+    days = []
+    totals: Dict[str, Counter] = {}
+    latency_max: Dict[str, float] = {}
+    labels: Dict[str, dict] = {}
+    for snap in db.get_all(refs):
+        if not snap.exists:
+            continue
+        data = snap.to_dict()
+        entries = data.get("entries", {})
+        days.append(
+            {
+                "date": data.get("date", snap.id),
+                "entries": [_summary_row(e) for e in entries.values()],
+            }
+        )
+        for key, entry in entries.items():
+            labels[key] = {k: entry.get(k) for k in ("caller", "model", "tier")}
+            totals.setdefault(key, Counter()).update(
+                {
+                    k: v
+                    for k, v in entry.items()
+                    if isinstance(v, (int, float)) and k != "latency_ms_max"
+                }
+            )
+            latency_max[key] = max(
+                latency_max.get(key, 0.0), entry.get("latency_ms_max", 0.0)
+            )
+
+    days.sort(key=lambda d: d["date"])
+    summary = [
+        _summary_row(
+            {**labels[key], **counters, "latency_ms_max": latency_max.get(key)}
+        )
+        for key, counters in totals.items()
+    ]
+    summary.sort(key=lambda row: row.get("cost_usd", 0), reverse=True)
+    return {
+        "start": day_ids[0],
+        "end": day_ids[-1],
+        "days": days,
+        "summary": summary,
+        "total_cost_usd": round(sum(row.get("cost_usd", 0) for row in summary), 6),
+    }
@@ -4,6 +4,7 @@ from typing import Optional
 
 from app.core.database import get_db
 from app.core.logger import get_logger
+from app.services import category_stats
 from google.cloud import firestore
 
 logger = get_logger(__name__)
@@ -16,39 +17,24 @@ class AnalysisService:
         """
         Calcula se o valor foge do padrão (Média + 2x Desvio Padrão).
         Retorna string de alerta ou None.
+
+        Usa as estatísticas móveis da categoria (um documento); categorias ainda
+        sem estatísticas caem na consulta das últimas 20 transações.
         """
         try:
-            db = get_db()
-
-            # Pega as ultimas 20 transacoes da mesma categoria
-            docs = (
-                db.collection("transactions")
-                .where("user_id", "==", user_id)
-                .where("category_id", "==", category_id)
-                .order_by("date", direction=firestore.Query.DESCENDING)
-                .limit(20)
-                .stream()
-            )
+            stats = category_stats.get_stats(user_id, category_id)
+            if stats is None:
+                stats = self._stats_from_history(user_id, category_id)
 
-            amounts = []
-            for doc in docs:
-                data = doc.to_dict()
-                val = float(data.get("amount", 0))
-                amounts.append(val)
+            count, mean, stdev = stats
 
             # Precisa de histórico minimo
-            if len(amounts) < 5:
+            if count < 5:
                 return None
 
-            mean = statistics.mean(amounts)
             if mean == 0:
                 return None
 
-            try:
-                stdev = statistics.stdev(amounts)
-            except statistics.StatisticsError:
-                stdev = 0
-
             # Limiar: Se desvio for muito pequeno (< 10% da media ou < 5 reais),
             # usa um teto fixo de 2x a média para evitar alertas chatos em valores baixos
             if stdev < 5:
@@ -67,6 +53,30 @@ class AnalysisService:
             logger.error("Analysis Erro: %s", e)
             return None
 
+    def _stats_from_history(self, user_id: str, category_id: str):
+        db = get_db()
+
+        # Pega as ultimas 20 transacoes da mesma categoria
+        docs = (
+            db.collection("transactions")
+            .where("user_id", "==", user_id)
+            .where("category_id", "==", category_id)
+            .order_by("date", direction=firestore.Query.DESCENDING)
+            .limit(20)
+            .stream()
+        )
+
+        amounts = [float(doc.to_dict().get("amount", 0)) for doc in docs]
+        if not amounts:
+            return 0, 0.0, 0.0
+
+        try:
+            stdev = statistics.stdev(amounts)
+        except statistics.StatisticsError:
+            stdev = 0
+
+        return len(amounts), statistics.mean(amounts), stdev
+
     def detect_subscriptions(self, user_id: str) -> list[dict]:
         """
         Analisa o histórico em busca de assinaturas não cadastradas.
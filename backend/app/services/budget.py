@@ -4,8 +4,9 @@ from typing import Optional
 from app.core.database import get_db
 from app.core.date_utils import get_month_range
 from app.schemas.budget import Budget, BudgetCreate
-from app.schemas.category import Category, CategoryType
+from app.schemas.category import CategoryType
 from app.services import category as category_service
+from app.services import monthly_rollup
 from fastapi import HTTPException
 from google.cloud.firestore_v1 import FieldFilter
 
@@ -41,60 +42,11 @@ def list_budgets(user_id: str) -> list[dict]:
     return [{**doc.to_dict(), "id": doc.id} for doc in budget_docs]
 
 
-def list_budgets_with_progress(
-    user_id: str, month: Optional[int] = None, year: Optional[int] = None
-) -> list[dict]:
-    db = get_db()
-
-    # 0. Buscar todas as categorias para montar mapa de hierarquia
-    cat_docs = (
-        db.collection("categories")
-        .where(filter=FieldFilter("user_id", "==", user_id))
-        .stream()
-    )
-    # Mapa: parent_id -> [child_id, child_id, ...]
-    children_map = {}
-    all_categories_map = {}  # id -> obj
-
-    for doc in cat_docs:
-        d = doc.to_dict()
-        cid = doc.id
-        all_categories_map[cid] = d
-        pid = d.get("parent_id")
-
-        if pid:
-            if pid not in children_map:
-                children_map[pid] = []
-            children_map[pid].append(cid)
-
-    def get_descendants(root_id):
-        """Retorna lista contendo root_id e todos os IDs dos descendentes (recursivo)"""
-        result = []
-        stack = [root_id]
-        visited = set()
-
-        while stack:
-            curr = stack.pop()
-            if curr in visited:
-                continue
-            visited.add(curr)
-            result.append(curr)
-
-            children = children_map.get(curr, [])
-            for child in children:
-                if child not in visited:
-                    stack.append(child)
-        return result
-
-    # 1. Pegar metas DO USUÁRIO
-    budget_docs = (
-        db.collection(COLLECTION_NAME)
-        .where(filter=FieldFilter("user_id", "==", user_id))
-        .stream()
-    )
-    budgets = []
-
-    # 2. Pegar todas as transações DO USUÁRIO e filtrar no BANCO se possível
+def _spending_from_transactions(
+    db, user_id: str, month: Optional[int], year: Optional[int]
+) -> dict:
+    """Soma as despesas por categoria varrendo as transações do período."""
+    # Pegar todas as transações DO USUÁRIO e filtrar no BANCO se possível
     # Otimização: Filtro por data e tipo 'expense' direto no Firestore
     transactions_query = (
         db.collection("transactions")
@@ -168,34 +120,47 @@ def list_budgets_with_progress(
         else:
             spending_map[cat_id] = amount
 
+    return spending_map
+
+
+def list_budgets_with_progress(
+    user_id: str, month: Optional[int] = None, year: Optional[int] = None
+) -> list[dict]:
+    db = get_db()
+
+    # 0. Árvore de categorias (cache entre requisições, com fecho de
+    # descendentes já calculado)
+    category_tree = category_service.get_category_tree(user_id)
+
+    # 1. Pegar metas DO USUÁRIO
+    budget_docs = (
+        db.collection(COLLECTION_NAME)
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .stream()
+    )
+    budgets = []
+
+    # 2. Gasto por categoria: agregado mensal (1 leitura) ou varredura das transações
+    spending_map = None
+    if month and year:
+        rollups = monthly_rollup.get_rollups(user_id, [f"{year:04d}-{month:02d}"])
+        if rollups is not None:
+            spending_map = monthly_rollup.category_totals(
+                rollups[f"{year:04d}-{month:02d}"], "expense"
+            )
+
+    if spending_map is None:
+        spending_map = _spending_from_transactions(db, user_id, month, year)
+
     for doc in budget_docs:
         data = doc.to_dict()
         cat_id = data.get("category_id")
 
-        # cat_obj = category_service.get_category(cat_id) # Evitar N queries
-        # Usar mapa carregado previamente
-        cat_data = all_categories_map.get(cat_id)
-        # Recriar objeto Category básico se necessário ou passar dict. O frontend espera objeto com nome.
-        # O `get_category` retorna um objeto Pydantic. Vamos manter simples por enquanto.
-        # Mas para compatibilidade, ideal é chamar o service ou simular o objeto.
-        # Como estamos retornando dict aqui, podemos apenas passar o dict da categoria.
-
-        # Se o frontend espera 'name', 'color', etc.
-        cat_obj = None
-        if cat_data:
-            # Create Category object for compatibility with tests and frontend expectations
-            cat_obj = Category(
-                id=cat_id,
-                name=cat_data.get("name", "Unknown"),
-                icon=cat_data.get("icon", "pi pi-circle"),
-                color=cat_data.get("color", "#000000"),
-                type=cat_data.get("type", "expense"),
-                user_id=cat_data.get("user_id", user_id),
-                is_custom=cat_data.get("is_custom", True),
-            )
+        # Usar mapa carregado previamente (evita N queries)
+        cat_obj = category_tree.flat.get(cat_id)
 
         # CÁLCULO DE GASTO AGREGADO (Meta da Categoria + Subcategorias)
-        target_ids = get_descendants(cat_id)
+        target_ids = category_tree.descendants_of(cat_id)
         spent = sum(spending_map.get(cid, 0.0) for cid in target_ids)
 
         limit = data.get("amount", 0.0)
@@ -1,11 +1,141 @@
-from typing import Any, Dict, List, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
 
+from app.core import request_cache
 from app.core.database import get_db
 from app.schemas.category import Category, CategoryCreate, CategoryType
 from fastapi import HTTPException
+from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 
 COLLECTION_NAME = "categories"
+META_COLLECTION_NAME = "category_meta"
+
+# Quantidade de árvores (usuários) mantidas em memória por processo
+TREE_CACHE_MAX_USERS = 512
+
+
+class CategoryTree:
+    """
+    Árvore de categorias de um usuário, montada uma vez e reutilizada entre
+    requisições enquanto `category_meta/{user_id}.version` não mudar.
+    Os objetos são compartilhados: trate-os como somente leitura.
+    """
+
+    def __init__(self, version: Optional[int], categories: List[Category]):
+        self.version = version
+        self.flat: Dict[str, Category] = {c.id: c for c in categories}
+
+        children: Dict[str, List[str]] = {}
+        for c in categories:
+            if c.parent_id:
+                children.setdefault(c.parent_id, []).append(c.id)
+
+        # child_id -> categoria pai
+        self.parent_map: Dict[str, Category] = {
+            c.id: self.flat[c.parent_id] for c in categories if c.parent_id in self.flat
+        }
+
+        # id -> (id, descendentes...) pré-computado
+        self.descendants: Dict[str, tuple] = {}
+        for cid in self.flat:
+            closure = []
+            stack = [cid]
+            visited = set()
+            while stack:
+                curr = stack.pop()
+                if curr in visited:
+                    continue
+                visited.add(curr)
+                closure.append(curr)
+                stack.extend(children.get(curr, []))
+            self.descendants[cid] = tuple(closure)
+
+    def descendants_of(self, category_id: str) -> tuple:
+        """A própria categoria e todos os descendentes (recursivo)."""
+        return self.descendants.get(category_id, (category_id,))
+
+
+_tree_cache: "OrderedDict[str, CategoryTree]" = OrderedDict()
+_tree_cache_lock = threading.Lock()
+
+
+def _categories_version(db, user_id: str) -> Optional[int]:
+    """Versão atual das categorias do usuário (None = desconhecida, não cacheia)."""
+    snap = db.collection(META_COLLECTION_NAME).document(user_id).get()
+    if not snap.exists:
+        return 0
+    version = snap.to_dict().get("version", 0)
+    return version if isinstance(version, int) else None
+
+
+def _bump_categories_version(db, user_id: str):
+    """
+    Chamado após qualquer escrita em categorias: outros workers veem a versão
+    nova na próxima leitura e descartam a árvore que têm em memória.
+    """
+    db.collection(META_COLLECTION_NAME).document(user_id).set(
+        {"version": firestore.Increment(1)}, merge=True
+    )
+    with _tree_cache_lock:
+        _tree_cache.pop(user_id, None)
+    request_cache.invalidate("categories")
+
+
+def clear_category_tree_cache():
+    with _tree_cache_lock:
+        _tree_cache.clear()
+
+
+def _load_categories(db, user_id: str) -> List[Category]:
+    docs = (
+        db.collection(COLLECTION_NAME)
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .stream()
+    )
+
+    categories: List[Category] = []
+    for doc in docs:
+        try:
+            data = doc.to_dict()
+            data["id"] = doc.id
+            data.pop("subcategories", None)
+            categories.append(Category(**data))
+        except Exception:
+            continue  # Skip malformed categories
+
+    return categories
+
+
+@request_cache.memoize("categories")
+def get_category_tree(user_id: str) -> CategoryTree:
+    """
+    Árvore de categorias do usuário via LRU em memória. Custa uma leitura
+    (documento de versão) quando está em cache; senão relê as categorias.
+    """
+    db = get_db()
+    # A versão é lida ANTES das categorias: se uma escrita acontecer no meio,
+    # a árvore fica associada à versão antiga e é recarregada na próxima vez.
+    version = _categories_version(db, user_id)
+
+    if version is not None:
+        with _tree_cache_lock:
+            cached = _tree_cache.get(user_id)
+            if cached is not None and cached.version == version:
+                _tree_cache.move_to_end(user_id)
+                return cached
+
+    tree = CategoryTree(version, _load_categories(db, user_id))
+
+    if version is not None:
+        with _tree_cache_lock:
+            _tree_cache[user_id] = tree
+            _tree_cache.move_to_end(user_id)
+            while len(_tree_cache) > TREE_CACHE_MAX_USERS:
+                _tree_cache.popitem(last=False)
+
+    return tree
 
 
 def create_category(category_in: CategoryCreate, user_id: str) -> Category:
@@ -14,6 +144,7 @@ def create_category(category_in: CategoryCreate, user_id: str) -> Category:
     data["user_id"] = user_id  # Marca o dono
 
     update_time, doc_ref = db.collection(COLLECTION_NAME).add(data)
+    _bump_categories_version(db, user_id)
     return Category(id=doc_ref.id, **data)
 
 
@@ -383,6 +514,7 @@ def ensure_default_categories(user_id: str):
 
     # Batch para criação eficiente
     batch = db.batch()
+    created = 0
     # Se não tiver NENHUMA categoria, cria todas
     # Se tiver algumas, verifica especificamente Fatura Cartão
 
@@ -401,6 +533,7 @@ def ensure_default_categories(user_id: str):
         ).model_dump()
         fat_cat["user_id"] = user_id
         batch.set(ref, fat_cat)
+        created += 1
 
     # 2. Verifica cada categoria padrão e cria se não existir
     for cat_data in defaults:
@@ -423,6 +556,7 @@ def ensure_default_categories(user_id: str):
             ).model_dump()
             parent_payload["user_id"] = user_id
             batch.set(parent_ref, parent_payload)
+            created += 1
 
             # Cria Filhos (se houver)
             if "subcategories" in cat_data:
@@ -440,44 +574,37 @@ def ensure_default_categories(user_id: str):
                     batch.set(sub_ref, sub_payload)
 
     batch.commit()
+    if created:
+        _bump_categories_version(db, user_id)
     return {"status": "setup_completed"}
 
 
-def list_categories(
-    user_id: str, cat_type: Optional[CategoryType] = None
-) -> List[Category]:
-    db = get_db()
-    # Filtra apenas categorias do usuário
-    query = db.collection(COLLECTION_NAME).where(
-        filter=FieldFilter("user_id", "==", user_id)
-    )
+def _assemble_tree(categories: Iterable[Category]) -> List[Category]:
+    """Monta a hierarquia (raízes com subcategories) sem tocar nos objetos do cache."""
+    nodes = {c.id: c.model_copy(update={"subcategories": []}) for c in categories}
 
-    if cat_type:
-        query = query.where(filter=FieldFilter("type", "==", cat_type.value))
+    roots = []
+    for node in nodes.values():
+        pid = node.parent_id
+        # Check if parent exists in the current filtered set
+        if pid and pid in nodes:
+            nodes[pid].subcategories.append(node)
+        else:
+            # If no parent or parent not found in this set (e.g. type filter mismatch), treat as root
+            roots.append(node)
 
-    docs = query.stream()
+    return roots
 
-    all_cats: List[Dict[str, Any]] = []
-    for doc in docs:
-        data = doc.to_dict()
-        data["id"] = doc.id
-        data["subcategories"] = []
-        all_cats.append(data)
 
-    # Create a map for easy access
-    cat_map = {c["id"]: c for c in all_cats}
+def list_categories(
+    user_id: str, cat_type: Optional[CategoryType] = None
+) -> List[Category]:
+    categories = get_category_tree(user_id).flat.values()
 
-    roots = []
-    for cat in all_cats:
-        pid = cat.get("parent_id")
-        # Check if parent exists in the current filtered set
-        if pid and pid in cat_map:
-            cat_map[pid]["subcategories"].append(cat)
-        else:
-            # If no parent or parent not found in this query (e.g. type filter mismatch), treat as root
-            roots.append(cat)
+    if cat_type:
+        categories = [c for c in categories if c.type == cat_type]
 
-    return [Category(**c) for c in roots]
+    return _assemble_tree(categories)
 
 
 def list_all_categories_flat(user_id: str) -> List[Category]:
@@ -485,23 +612,7 @@ def list_all_categories_flat(user_id: str) -> List[Category]:
     Retorna TODAS as categorias do usuário em lista plana (sem hierarquia).
     Otimizado para batch preloading / lookup por ID no list_transactions.
     """
-    db = get_db()
-    docs = (
-        db.collection(COLLECTION_NAME)
-        .where(filter=FieldFilter("user_id", "==", user_id))
-        .stream()
-    )
-
-    categories: List[Category] = []
-    for doc in docs:
-        try:
-            data = doc.to_dict()
-            data["id"] = doc.id
-            categories.append(Category(**data))
-        except Exception:
-            continue  # Skip malformed categories
-
-    return categories
+    return list(get_category_tree(user_id).flat.values())
 
 
 def update_category(
@@ -518,6 +629,7 @@ def update_category(
     data = category_in.model_dump()
     data["user_id"] = user_id  # Garante que não perde o dono
     doc_ref.update(data)
+    _bump_categories_version(db, user_id)
 
     return Category(id=category_id, **data)
 
@@ -546,10 +658,12 @@ def delete_category(category_id: str, user_id: str):
         )
 
     doc_ref.delete()
+    _bump_categories_version(db, user_id)
     return {"status": "success"}
 
 
 # Helper interno (sem filtro de user_id rigoroso aqui pois é usado pelo get internal)
+@request_cache.memoize("categories")
 def get_category(category_id: str, user_id: str = None):
     if not category_id:
         return None
@@ -590,4 +704,5 @@ def delete_all_custom_categories(user_id: str):
         batch.commit()
         deleted_count += count
 
+    _bump_categories_version(db, user_id)
     return deleted_count
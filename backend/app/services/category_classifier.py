@@ -0,0 +1,366 @@
+"""
+Classificador local de categorias, treinado no histórico do próprio usuário.
+
+Fica na frente do LLM: a maioria das descrições de extrato ("UBER *TRIP",
+"IFOOD", "NETFLIX.COM") mapeia sempre para a mesma categoria que o usuário já
+usou. Dois sinais, do mais forte para o mais fraco:
+
+1. Tabela de comerciantes normalizados (chave = primeiros tokens da descrição).
+2. Naive Bayes multinomial sobre unigramas e bigramas de tokens.
+
+O modelo de cada usuário é um documento em `category_classifiers/{user_id}`,
+atualizado com `Increment` sempre que uma transação é categorizada, e fica em
+memória (LRU com TTL) para que a predição não custe leituras. O LLM só é
+chamado quando a confiança fica abaixo de CONFIDENCE_THRESHOLD.
+
+O vocabulário é limitado (MAX_MERCHANTS / MAX_TOKENS) para o documento não
+chegar ao limite de 1 MiB do Firestore: ao passar do limite, `compact_model`
+remove as chaves zeradas e as menos usadas, mantendo PRUNE_TO do limite.
+"""
+
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.database import get_db
+from app.core.logger import get_logger
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter
+
+logger = get_logger(__name__)
+
+COLLECTION_NAME = "category_classifiers"
+
+# Abaixo disso a predição local é descartada e o LLM decide
+CONFIDENCE_THRESHOLD = 0.8
+
+# Quantos tokens formam a chave de comerciante ("uber_trip")
+MERCHANT_KEY_TOKENS = 3
+
+# Tamanho máximo do vocabulário por usuário e fração mantida na compactação
+MAX_MERCHANTS = 2000
+MAX_TOKENS = 5000
+PRUNE_TO = 0.8
+
+MODEL_CACHE_MAX_USERS = 512
+MODEL_CACHE_TTL_SECONDS = 300
+
+# Palavras de extrato que não identificam o comerciante
+_NOISE_TOKENS = {
+    "compra",
+    "compras",
+    "pag",
+    "pagto",
+    "pagamento",
+    "pix",
+    "ted",
+    "doc",
+    "debito",
+    "credito",
+    "cartao",
+    "parc",
+    "parcela",
+    "transf",
+    "transferencia",
+    "enviado",
+    "recebido",
+    "de",
+    "da",
+    "do",
+    "em",
+    "com",
+    "www",
+    "http",
+    "https",
+    "ltda",
+    "sa",
+    "me",
+    "eireli",
+}
+
+
+def tokenize(description: str) -> List[str]:
+    """Normaliza (sem acento, minúsculas, sem dígitos/pontuação) e remove ruído."""
+    if not description:
+        return []
+    text = unicodedata.normalize("NFKD", description)
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    text = re.sub(r"\.(com|net|org)\b", " ", text)
+    return [
+        t for t in re.findall(r"[a-z]+", text) if len(t) > 1 and t not in _NOISE_TOKENS
+    ]
+
+
+def merchant_key(tokens: List[str]) -> Optional[str]:
+    return "_".join(tokens[:MERCHANT_KEY_TOKENS]) or None
+
+
+def _features(tokens: List[str]) -> List[str]:
+    """Unigramas + bigramas."""
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:], strict=False)]
+
+
+def _empty_model() -> dict:
+    return {"merchants": {}, "tokens": {}, "token_totals": {}, "category_counts": {}}
+
+
+def _deltas(description: str, category_id: str, sign: int = 1) -> dict:
+    """Contagens que uma transação categorizada soma (ou subtrai) no modelo."""
+    tokens = tokenize(description)
+    key = merchant_key(tokens)
+    if not key or not category_id:
+        return {}
+
+    feats = _features(tokens)
+    return {
+        "merchants": {key: {category_id: sign}},
+        "tokens": {f: {category_id: sign} for f in feats},
+        "token_totals": {category_id: sign * len(feats)},
+        "category_counts": {category_id: sign},
+    }
+
+
+def _merge(model: dict, deltas: dict):
+    for section in ("merchants", "tokens"):
+        for key, cats in deltas.get(section, {}).items():
+            bucket = model[section].setdefault(key, {})
+            for cat_id, n in cats.items():
+                bucket[cat_id] = bucket.get(cat_id, 0) + n
+    for section in ("token_totals", "category_counts"):
+        for cat_id, n in deltas.get(section, {}).items():
+            model[section][cat_id] = model[section].get(cat_id, 0) + n
+
+
+def _to_increments(deltas: dict) -> dict:
+    def convert(value):
+        if isinstance(value, dict):
+            return {k: convert(v) for k, v in value.items()}
+        return firestore.Increment(value)
+
+    return convert(deltas)
+
+
+# --- Cache em memória (LRU + TTL) ---
+_models: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_models_lock = threading.Lock()
+
+
+def clear_model_cache():
+    with _models_lock:
+        _models.clear()
+
+
+def _positive(counts: Dict[str, float]) -> Dict[str, float]:
+    return {cat_id: n for cat_id, n in counts.items() if n > 0}
+
+
+def _over_limit(model: dict) -> bool:
+    return len(model["merchants"]) > MAX_MERCHANTS or len(model["tokens"]) > MAX_TOKENS
+
+
+def _pruned(buckets: dict, limit: int) -> dict:
+    """Chaves com contagem positiva, só as `limit` mais usadas."""
+    live = {}
+    for key, counts in buckets.items():
+        counts = _positive(counts) if isinstance(counts, dict) else {}
+        if counts:
+            live[key] = counts
+    keep = sorted(live, key=lambda k: sum(live[k].values()), reverse=True)
+    return {k: live[k] for k in keep[:limit]}
+
+
+@firestore.transactional
+def _compact_in_transaction(transaction, ref) -> Optional[dict]:
+    snap = ref.get(transaction=transaction)
+    if not snap.exists:
+        return None
+    data = snap.to_dict() or {}
+    compacted = {
+        "merchants": _pruned(
+            data.get("merchants") or {}, int(MAX_MERCHANTS * PRUNE_TO)
+        ),
+        "tokens": _pruned(data.get("tokens") or {}, int(MAX_TOKENS * PRUNE_TO)),
+    }
+    # Substitui os mapas inteiros; Increments concorrentes refazem a transação
+    transaction.update(ref, compacted)
+    model = _empty_model()
+    for section in ("token_totals", "category_counts"):
+        if isinstance(data.get(section), dict):
+            model[section] = data[section]
+    model.update(compacted)
+    return model
+
+
+def compact_model(user_id: str) -> Optional[dict]:
+    """
+    Remove do modelo as chaves zeradas (recategorizações) e, acima do limite,
+    as menos usadas. Retorna o modelo compactado (None se não existe).
+    """
+    db = get_db()
+    ref = db.collection(COLLECTION_NAME).document(user_id)
+    model = _compact_in_transaction(db.transaction(), ref)
+    logger.info("category_classifiers compactado (User: %s)", user_id)
+    return model
+
+
+def _cache_model(user_id: str, now: float, model: dict):
+    with _models_lock:
+        _models[user_id] = (now, model)
+        _models.move_to_end(user_id)
+        while len(_models) > MODEL_CACHE_MAX_USERS:
+            _models.popitem(last=False)
+
+
+def _get_model(user_id: str) -> dict:
+    now = time.monotonic()
+    with _models_lock:
+        entry = _models.get(user_id)
+        if entry and now - entry[0] < MODEL_CACHE_TTL_SECONDS:
+            _models.move_to_end(user_id)
+            return entry[1]
+
+    db = get_db()
+    snap = db.collection(COLLECTION_NAME).document(user_id).get()
+    model = _empty_model()
+    if snap.exists:
+        data = snap.to_dict() or {}
+        for section in model:
+            if isinstance(data.get(section), dict):
+                model[section] = data[section]
+
+    if _over_limit(model):
+        try:
+            model = compact_model(user_id) or model
+        except Exception as e:
+            logger.warning(
+                "Falha ao compactar category_classifiers (User: %s): %s", user_id, e
+            )
+
+    _cache_model(user_id, now, model)
+    return model
+
+
+def learn(db, user_id: str, items: Iterable[Tuple[str, str]], sign: int = 1):
+    """
+    Atualiza o modelo com transações categorizadas [(descrição, category_id)]
+    (sign=-1 desfaz, ex: recategorização). Uma escrita para todos os itens.
+    Falhas são logadas e não interrompem a escrita da transação em si.
+    """
+    deltas = _empty_model()
+    for description, category_id in items:
+        _merge(deltas, _deltas(description, category_id, sign))
+
+    if not deltas["category_counts"]:
+        return
+
+    try:
+        # Carrega (ou compacta) o modelo antes: o vocabulário não passa do limite
+        model = _get_model(user_id)
+        db.collection(COLLECTION_NAME).document(user_id).set(
+            {**_to_increments(deltas), "user_id": user_id}, merge=True
+        )
+    except Exception as e:
+        logger.warning(
+            "Falha ao atualizar category_classifiers (User: %s): %s", user_id, e
+        )
+        return
+
+    with _models_lock:
+        _merge(model, deltas)
+        over_limit = _over_limit(model)
+
+    if over_limit:
+        try:
+            _cache_model(user_id, time.monotonic(), compact_model(user_id) or model)
+        except Exception as e:
+            logger.warning(
+                "Falha ao compactar category_classifiers (User: %s): %s", user_id, e
+            )
+
+
+def predict(
+    user_id: str, description: str, valid_ids: Optional[set] = None
+) -> Tuple[Optional[str], float]:
+    """
+    (category_id, confiança 0..1) para a descrição; (None, 0.0) sem sinal.
+    `valid_ids` descarta categorias que não existem mais.
+    """
+    tokens = tokenize(description)
+    key = merchant_key(tokens)
+    if not key:
+        return None, 0.0
+
+    model = _get_model(user_id)
+
+    def allowed(counts):
+        counts = _positive(counts)
+        if valid_ids is not None:
+            counts = {c: n for c, n in counts.items() if c in valid_ids}
+        return counts
+
+    # 1. Comerciante já visto: confiança = acertos / (total + 1)
+    merchant_counts = allowed(model["merchants"].get(key, {}))
+    if merchant_counts:
+        best = max(merchant_counts, key=merchant_counts.get)
+        confidence = merchant_counts[best] / (sum(merchant_counts.values()) + 1)
+        if confidence >= CONFIDENCE_THRESHOLD:
+            return best, confidence
+
+    # 2. Naive Bayes (Laplace) sobre as features conhecidas
+    category_counts = allowed(model["category_counts"])
+    feats = [f for f in _features(tokens) if f in model["tokens"]]
+    if not category_counts or not feats:
+        return None, 0.0
+
+    vocab = len(model["tokens"])
+    total_docs = sum(category_counts.values())
+    scores = {}
+    for cat_id, n_docs in category_counts.items():
+        token_total = max(model["token_totals"].get(cat_id, 0), 0)
+        score = math.log((n_docs + 1) / (total_docs + len(category_counts)))
+        for f in feats:
+            count = max(model["tokens"][f].get(cat_id, 0), 0)
+            score += math.log((count + 1) / (token_total + vocab))
+        scores[cat_id] = score
+
+    best = max(scores, key=scores.get)
+    top = scores[best]
+    norm = sum(math.exp(s - top) for s in scores.values())
+    return best, 1.0 / norm
+
+
+def rebuild_user_model(user_id: str) -> Tuple[int, int]:
+    """
+    Treina do zero o modelo do usuário a partir das transações categorizadas.
+    Retorna (transações usadas, comerciantes distintos).
+    """
+    db = get_db()
+    docs = (
+        db.collection("transactions")
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .stream()
+    )
+
+    model = _empty_model()
+    tx_count = 0
+    for doc in docs:
+        data = doc.to_dict()
+        deltas = _deltas(data.get("title") or "", data.get("category_id"))
+        if deltas:
+            _merge(model, deltas)
+            tx_count += 1
+
+    model["merchants"] = _pruned(model["merchants"], MAX_MERCHANTS)
+    model["tokens"] = _pruned(model["tokens"], MAX_TOKENS)
+    db.collection(COLLECTION_NAME).document(user_id).set(
+        {**model, "user_id": user_id, "updated_at": firestore.SERVER_TIMESTAMP}
+    )
+
+    with _models_lock:
+        _models.pop(user_id, None)
+
+    return tx_count, len(model["merchants"])
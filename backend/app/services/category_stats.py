@@ -0,0 +1,258 @@
+"""
+Estatísticas móveis de despesas por usuário × categoria (detecção de anomalia).
+
+Cada documento em `category_stats` guarda as últimas WINDOW_SIZE despesas da
+categoria e a média/variância correspondentes, mantidas pelo algoritmo de
+Welford (inclusão do valor novo e remoção do mais antigo em O(1)). A análise
+de anomalia passa a ler um único documento em vez de consultar e recalcular
+as últimas transações a cada despesa criada.
+
+Os documentos são atualizados em transação do Firestore logo após a gravação
+das despesas. Categorias sem documento são semeadas a partir do histórico na
+primeira despesa; `scripts/backfill_category_stats.py` faz o mesmo em lote.
+Edições e exclusões de despesas regravam a janela das categorias afetadas a
+partir do histórico (`refresh_categories`).
+"""
+
+import math
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core import request_cache
+from app.core.database import get_db
+from app.core.logger import get_logger
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter
+
+logger = get_logger(__name__)
+
+COLLECTION_NAME = "category_stats"
+
+# Mesma janela da análise original (últimas 20 transações da categoria)
+WINDOW_SIZE = 20
+
+
+def stats_doc_id(user_id: str, category_id: str) -> str:
+    return f"{user_id}_{category_id}"
+
+
+def _welford_add(count: int, mean: float, m2: float, value: float):
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return count, mean, m2
+
+
+def _welford_remove(count: int, mean: float, m2: float, value: float):
+    if count <= 1:
+        return 0, 0.0, 0.0
+    count -= 1
+    delta = value - mean
+    mean -= delta / count
+    m2 -= delta * (value - mean)
+    return count, mean, max(m2, 0.0)
+
+
+def _payload(user_id: str, category_id: str, window: List[float]) -> dict:
+    count, mean, m2 = 0, 0.0, 0.0
+    for value in window:
+        count, mean, m2 = _welford_add(count, mean, m2, value)
+    return {
+        "user_id": user_id,
+        "category_id": category_id,
+        "window": window,
+        "count": count,
+        "mean": mean,
+        "m2": m2,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def _push(data: dict, amounts: Iterable[float]) -> dict:
+    """Inclui os valores novos na janela, removendo os mais antigos (Welford)."""
+    window = list(data.get("window", []))
+    count = data.get("count", 0)
+    mean = data.get("mean", 0.0)
+    m2 = data.get("m2", 0.0)
+
+    for value in amounts:
+        window.append(value)
+        count, mean, m2 = _welford_add(count, mean, m2, value)
+        if len(window) > WINDOW_SIZE:
+            count, mean, m2 = _welford_remove(count, mean, m2, window.pop(0))
+
+    return {
+        **data,
+        "window": window,
+        "count": count,
+        "mean": mean,
+        "m2": m2,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def _date_key(value) -> datetime:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return datetime.min.replace(tzinfo=timezone.utc)
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _history_window(db, user_id: str, category_id: str) -> List[float]:
+    """Últimas WINDOW_SIZE despesas da categoria, da mais antiga para a mais recente."""
+    docs = (
+        db.collection("transactions")
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .where(filter=FieldFilter("category_id", "==", category_id))
+        .order_by("date", direction=firestore.Query.DESCENDING)
+        .limit(WINDOW_SIZE)
+        .stream()
+    )
+    amounts = [float(doc.to_dict().get("amount", 0)) for doc in docs]
+    amounts.reverse()
+    return amounts
+
+
+@firestore.transactional
+def _push_in_transaction(transaction, ref, amounts: List[float]) -> bool:
+    snap = ref.get(transaction=transaction)
+    if not snap.exists:
+        return False
+    transaction.set(ref, _push(snap.to_dict(), amounts))
+    return True
+
+
+def record_expenses(db, user_id: str, items: Iterable[Tuple[str, float]]):
+    """
+    Atualiza as estatísticas com despesas recém-gravadas [(category_id, amount)].
+    Categoria sem documento é semeada do histórico (que já inclui as novas).
+    Falhas são logadas e não interrompem a escrita da transação em si.
+    """
+    by_category: Dict[str, List[float]] = {}
+    for category_id, amount in items:
+        if category_id:
+            by_category.setdefault(category_id, []).append(float(amount or 0))
+
+    for category_id, amounts in by_category.items():
+        try:
+            ref = db.collection(COLLECTION_NAME).document(
+                stats_doc_id(user_id, category_id)
+            )
+            if not _push_in_transaction(db.transaction(), ref, amounts):
+                ref.set(
+                    _payload(
+                        user_id, category_id, _history_window(db, user_id, category_id)
+                    )
+                )
+        except Exception as e:
+            logger.warning(
+                "Falha ao atualizar category_stats (User: %s, Cat: %s): %s",
+                user_id,
+                category_id,
+                e,
+            )
+
+    request_cache.invalidate("category_stats")
+
+
+def refresh_categories(db, user_id: str, category_ids: Iterable[str]):
+    """
+    Regrava as estatísticas das categorias a partir do histórico, após editar
+    ou apagar despesas. A janela guarda só valores, então um valor editado não
+    pode ser retirado no lugar (nem a despesa anterior à janela reposta).
+    Falhas são logadas e não interrompem a escrita da transação em si.
+    """
+    for category_id in {c for c in category_ids if c}:
+        try:
+            ref = db.collection(COLLECTION_NAME).document(
+                stats_doc_id(user_id, category_id)
+            )
+            ref.set(
+                _payload(
+                    user_id, category_id, _history_window(db, user_id, category_id)
+                )
+            )
+        except Exception as e:
+            logger.warning(
+                "Falha ao recalcular category_stats (User: %s, Cat: %s): %s",
+                user_id,
+                category_id,
+                e,
+            )
+
+    request_cache.invalidate("category_stats")
+
+
+@request_cache.memoize("category_stats")
+def get_stats(user_id: str, category_id: str) -> Optional[Tuple[int, float, float]]:
+    """
+    (count, média, desvio padrão amostral) da janela, ou None se a categoria
+    ainda não tem estatísticas. Uma leitura, memoizada por requisição.
+    """
+    db = get_db()
+    snap = (
+        db.collection(COLLECTION_NAME)
+        .document(stats_doc_id(user_id, category_id))
+        .get()
+    )
+    if not snap.exists:
+        return None
+
+    data = snap.to_dict()
+    count = data.get("count", 0)
+    mean = data.get("mean", 0.0)
+    m2 = data.get("m2", 0.0)
+    stdev = math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+    return count, mean, stdev
+
+
+def rebuild_user_stats(user_id: str) -> Tuple[int, int]:
+    """
+    Recalcula do zero as estatísticas de todas as categorias do usuário a partir
+    das despesas brutas. Retorna (despesas lidas, categorias gravadas).
+    """
+    db = get_db()
+    docs = (
+        db.collection("transactions")
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .where(filter=FieldFilter("type", "==", "expense"))
+        .stream()
+    )
+
+    history: Dict[str, List[Tuple[datetime, float]]] = {}
+    tx_count = 0
+    for doc in docs:
+        data = doc.to_dict()
+        category_id = data.get("category_id")
+        if not category_id:
+            continue
+        history.setdefault(category_id, []).append(
+            (_date_key(data.get("date")), float(data.get("amount", 0)))
+        )
+        tx_count += 1
+
+    batch = db.batch()
+    count = 0
+    for category_id, rows in history.items():
+        rows.sort(key=lambda r: r[0])
+        window = [amount for _, amount in rows[-WINDOW_SIZE:]]
+        ref = db.collection(COLLECTION_NAME).document(
+            stats_doc_id(user_id, category_id)
+        )
+        batch.set(ref, _payload(user_id, category_id, window))
+        count += 1
+
+        if count >= 400:
+            batch.commit()
+            batch = db.batch()
+            count = 0
+
+    if count > 0:
+        batch.commit()
+
+    return tx_count, len(history)
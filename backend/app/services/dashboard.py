@@ -1,13 +1,155 @@
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional
 
-from app.core.database import get_db
 from app.core.date_utils import get_month_range
 from app.schemas.dashboard import CategoryTotal, DashboardSummary, MonthlyEvolution
+from app.services import account as account_service
 from app.services import budget as budget_service
 from app.services import category as category_service
+from app.services import monthly_rollup
 from app.services import transaction as transaction_service
-from google.cloud.firestore_v1.base_query import FieldFilter
+
+
+def _display_category_id(cat_id: Optional[str], parent_map: dict) -> str:
+    """Subcategorias são agrupadas sob a categoria pai no gráfico do dashboard."""
+    if not cat_id:
+        return "unknown"
+    if cat_id in parent_map:
+        return parent_map[cat_id].id
+    return cat_id
+
+
+def _aggregate_from_rollups(rollups, months_to_fetch, invoice_category_id, parent_map):
+    """Monta totais do mês, categorias e evolução a partir dos agregados mensais."""
+    excluded = [invoice_category_id] if invoice_category_id else []
+
+    evolution_data = []
+    for m, y in months_to_fetch:
+        rollup = rollups[f"{y:04d}-{m:02d}"]
+        evolution_data.append(
+            MonthlyEvolution(
+                month=f"{m:02d}/{str(y)[-2:]}",
+                income=monthly_rollup.type_total(rollup, "income", excluded),
+                expense=monthly_rollup.type_total(rollup, "expense", excluded),
+            )
+        )
+
+    m, y = months_to_fetch[-1]
+    current = rollups[f"{y:04d}-{m:02d}"]
+
+    display_category_map = {}
+    for cat_id, total in monthly_rollup.category_totals(
+        current, "expense", excluded
+    ).items():
+        if cat_id == monthly_rollup.UNKNOWN_CATEGORY:
+            cat_id = None
+        target_cat_id = _display_category_id(cat_id, parent_map)
+        display_category_map[target_cat_id] = (
+            display_category_map.get(target_cat_id, 0) + total
+        )
+
+    income = monthly_rollup.type_total(current, "income", excluded)
+    expense = monthly_rollup.type_total(current, "expense", excluded)
+    return income, expense, display_category_map, evolution_data
+
+
+def _parse_date(value) -> Optional[datetime]:
+    """Converte a data crua do Firestore (Timestamp ou ISO string) em datetime UTC aware."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    # Dados antigos sem timezone: assumir UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    # Com offset: normaliza para UTC, como `monthly_rollup.month_key`
+    return value.astimezone(timezone.utc)
+
+
+def _aggregate_from_transactions(
+    user_id,
+    query_start,
+    current_start,
+    current_end,
+    months_to_fetch,
+    invoice_category_id,
+    parent_map,
+    accounts,
+    payment_methods,
+):
+    """
+    Fallback: calcula os mesmos dados varrendo as transações do período.
+
+    Passagem única sobre os dicts crus do Firestore: cada data é convertida uma
+    vez e a linha vai direto para o bucket do mês (evolução) e, se couber no
+    período selecionado, para os totais e categorias do mês atual.
+    """
+    rows = transaction_service.list_raw_transactions(
+        user_id,
+        start_date=query_start,
+        end_date=current_end,
+        limit=2000,  # 6 months * ~300 tx/mo = 1800. Safe cap.
+    )
+
+    account_filter = set(accounts) if accounts else None
+    payment_filter = set(payment_methods) if payment_methods else None
+
+    evolution_totals = {(m, y): [0.0, 0.0] for m, y in months_to_fetch}
+
+    income = 0.0
+    expense = 0.0
+    # Map to store totals by "display" category (either the cat itself or its parent)
+    display_category_map = {}  # cat_id -> total
+
+    for data in rows:
+        if account_filter and data.get("account_id") not in account_filter:
+            continue
+        if payment_filter and data.get("payment_method") not in payment_filter:
+            continue
+
+        cat_id = data.get("category_id")
+        # EXCLUSÃO: Ignorar Fatura Cartão
+        if invoice_category_id and cat_id == invoice_category_id:
+            continue
+
+        t_type = data.get("type")
+        if t_type not in ("income", "expense"):
+            continue
+
+        t_date = _parse_date(data.get("date"))
+        if not t_date:
+            continue
+
+        amount = abs(float(data.get("amount", 0)))
+        is_income = t_type == "income"
+
+        bucket = evolution_totals.get((t_date.month, t_date.year))
+        if bucket is not None:
+            bucket[0 if is_income else 1] += amount
+
+        if current_start <= t_date <= current_end:
+            if is_income:
+                income += amount
+            else:
+                expense += amount
+                target_cat_id = _display_category_id(cat_id, parent_map)
+                display_category_map[target_cat_id] = (
+                    display_category_map.get(target_cat_id, 0) + amount
+                )
+
+    evolution_data = [
+        MonthlyEvolution(
+            month=f"{m:02d}/{str(y)[-2:]}",  # ex: 11/25
+            income=evolution_totals[(m, y)][0],
+            expense=evolution_totals[(m, y)][1],
+        )
+        for m, y in months_to_fetch
+    ]
+
+    return income, expense, display_category_map, evolution_data
 
 
 def get_dashboard_data(
@@ -19,13 +161,8 @@ def get_dashboard_data(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
 ) -> DashboardSummary:
-    db = get_db()
-
     # 1. Saldo Total (Apenas contas do usuário) - Não é afetado pelos filtros
-    all_user_accounts = (
-        db.collection("accounts").where("user_id", "==", user_id).stream()
-    )
-    total_balance = sum(acc.to_dict().get("balance", 0) for acc in all_user_accounts)
+    total_balance = sum(acc.balance for acc in account_service.list_accounts(user_id))
 
     # --- DADOS DO MÊS ATUAL (PRINCIPAL) ---
 
@@ -60,144 +197,56 @@ def get_dashboard_data(
     if current_end.tzinfo is None:
         current_end = current_end.replace(tzinfo=timezone.utc)
 
-    query_start = min(current_start, evolution_start)
-    query_end = current_end
-
-    # Ensure optimized query
-    # Using transaction_service to leverage the logic we just fixed
-    # list_transactions returns Pydantic models. We convert to dicts to maintain compatibility with below logic.
-
-    pydantic_txs = transaction_service.list_transactions(
-        user_id=user_id,
-        start_date=query_start,
-        end_date=query_end,
-        limit=2000,  # 6 months * ~300 tx/mo = 1800. Safe cap.
-    )
-
-    all_transactions_data = [t.model_dump() for t in pydantic_txs]
-
-    # Fetch Invoice Category ID once
-    invoice_category_id = None
-    # We must search for it. It's better to cache this or query once per request.
-    # Since this is "dashboard", one extra query is fine.
-    # Note: Using stream() on query object, not db
-    inv_query = (
-        db.collection("categories")
-        .where("user_id", "==", user_id)
-        .where(filter=FieldFilter("name", "==", "Fatura Cartão"))
-        .limit(1)
-        .stream()
-    )
-    for doc in inv_query:
-        invoice_category_id = doc.id
-        break
-
-    # Filtrar para o Dashboard Principal (Mês Selecionado)
-    # Helper para comparar datas naive/aware de forma segura
-    def is_in_range(date_val, start, end):
-        if not date_val:
-            return False
-        # Se date_val tem tz e start/end não (ou vice versa), crash.
-        # Vamos normalizar tudo para UTC se possível ou remover TZ.
-        # Melhor abordagem: Firestore retorna Aware (UTC). Nossas Ranges são Aware (UTC).
-        # Se date_val for Naive (ex: dados antigos bugados), assumir UTC.
-        d = date_val
-        if isinstance(d, str):
-            try:
-                d = datetime.fromisoformat(d.replace("Z", "+00:00"))
-            except ValueError:
-                return False
-
-        if d.tzinfo is None:
-            d = d.replace(tzinfo=timezone.utc)
-
-        # start/end devem ser aware pois get_month_range retorna aware.
-        # Se start_date/end_date args vierem naive, precisamos tratar.
-        s, e = start, end
-        if s.tzinfo is None:
-            s = s.replace(tzinfo=timezone.utc)
-        if e.tzinfo is None:
-            e = e.replace(tzinfo=timezone.utc)
-
-        return s <= d <= e
-
-    current_transactions = [
-        t
-        for t in all_transactions_data
-        if is_in_range(t.get("date"), current_start, current_end)
-    ]
-
-    # Filtro por contas (Principal)
-    if accounts:
-        current_transactions = [
-            t for t in current_transactions if t.get("account_id") in accounts
-        ]
+    # Meses da evolução (últimos 6, em ordem cronológica; o último é o mês de referência)
+    months_to_fetch = []
+    curr = ref_date
+    for _ in range(6):
+        months_to_fetch.append((curr.month, curr.year))
+        # Voltar um mês
+        first = curr.replace(day=1)
+        prev_month = first - timedelta(days=1)
+        curr = prev_month
 
-    # Filtro por forma de pagamento (Principal)
-    if payment_methods:
-        current_transactions = [
-            t
-            for t in current_transactions
-            if t.get("payment_method") in payment_methods
-        ]
+    months_to_fetch.reverse()  # Ordem cronológica
 
     # --- Pre-fetch categories to optimize and handle orphans ---
-    # Fetch all user categories (hierarchy)
-    all_user_cats = category_service.list_categories(user_id)
-
-    flat_cat_map = {}
-    parent_map = {}  # child_id -> parent_obj
-
-    def process_cats(cats, parent=None):
-        for c in cats:
-            flat_cat_map[c.id] = c
-            if parent:
-                parent_map[c.id] = parent
-            if c.subcategories:
-                process_cats(c.subcategories, c)
-
-    process_cats(all_user_cats)
-
-    income = 0.0
-    expense = 0.0
-    # Map to store totals by "display" category (either the cat itself or its parent)
-    display_category_map = {}  # cat_id -> total
-
-    for data in current_transactions:
-        # Check exclusion for Invoice
-        if invoice_category_id and data.get("category_id") == invoice_category_id:
-            continue
+    # Árvore do usuário (cache em memória validado por categories_version)
+    category_tree = category_service.get_category_tree(user_id)
+    flat_cat_map = category_tree.flat
+    parent_map = category_tree.parent_map  # child_id -> parent_obj
+
+    # Categoria de sistema "Fatura Cartão" (excluída dos totais)
+    invoice_category_id = next(
+        (cid for cid, c in flat_cat_map.items() if c.name == "Fatura Cartão"), None
+    )
 
-        amount = abs(float(data.get("amount", 0)))
-        t_type = data.get("type")
-        cat_id = data.get("category_id")
+    # Agregados mensais só servem quando o recorte é o mês cheio e sem filtros
+    rollups = None
+    if not accounts and not payment_methods and not (start_date and end_date):
+        rollups = monthly_rollup.get_rollups(
+            user_id, [f"{y:04d}-{m:02d}" for m, y in months_to_fetch]
+        )
 
-        # Fallback if category_id is missing but category object is present (robustness)
-        if not cat_id and data.get("category"):
-            # If it's a model, it might be an object or a dict from previous dumps
-            cat_obj_data = data.get("category")
-            if isinstance(cat_obj_data, dict):
-                cat_id = cat_obj_data.get("id")
-            elif hasattr(cat_obj_data, "id"):
-                cat_id = cat_obj_data.id
-
-        if t_type == "income":
-            income += amount
-        elif t_type == "expense":
-            expense += amount
-
-            # Resolution logic: Group by parent if exists
-            target_cat_id = "unknown"
-            if cat_id:
-                # If it's a subcategory, use its parent for the dashboard chart grouping
-                if cat_id in parent_map:
-                    target_cat_id = parent_map[cat_id].id
-                else:
-                    target_cat_id = cat_id
-
-            display_category_map[target_cat_id] = (
-                display_category_map.get(target_cat_id, 0) + amount
+    if rollups is not None:
+        income, expense, display_category_map, evolution_data = (
+            _aggregate_from_rollups(
+                rollups, months_to_fetch, invoice_category_id, parent_map
+            )
+        )
+    else:
+        income, expense, display_category_map, evolution_data = (
+            _aggregate_from_transactions(
+                user_id,
+                min(current_start, evolution_start),
+                current_start,
+                current_end,
+                months_to_fetch,
+                invoice_category_id,
+                parent_map,
+                accounts,
+                payment_methods,
             )
+        )
 
     categories_list = []
 
@@ -231,64 +280,6 @@ def get_dashboard_data(
     # 3. Orçamentos (Budgets)
     budgets_with_spent = budget_service.list_budgets_with_progress(user_id, month, year)
 
-    # --- 4. EVOLUÇÃO MENSAL (ÚLTIMOS 6 MESES) ---
-
-    evolution_data = []
-
-    # Gerar lista de datas para os últimos 6 meses
-    months_to_fetch = []
-    curr = ref_date
-    for _ in range(6):
-        months_to_fetch.append((curr.month, curr.year))
-        # Voltar um mês
-        first = curr.replace(day=1)
-        prev_month = first - timedelta(days=1)
-        curr = prev_month
-
-    months_to_fetch.reverse()  # Ordem cronológica
-
-    for m, y in months_to_fetch:
-        m_start, m_end = get_month_range(m, y)
-        label = f"{m:02d}/{str(y)[-2:]}"  # ex: 11/25
-
-        m_income = 0.0
-        m_expense = 0.0
-
-        for t in all_transactions_data:
-            # Filtros Globais
-            if accounts and t.get("account_id") not in accounts:
-                continue
-            if payment_methods and t.get("payment_method") not in payment_methods:
-                continue
-
-            if is_in_range(t.get("date"), m_start, m_end):
-                # EXCLUSÃO: Ignorar Fatura Cartão
-                # Precisamos pegar o nome da categoria. Como não temos o objeto categoria aqui fácil (só ID),
-                # vamos assumir que a Fatura Cartão tem um ID específico ou precisamos buscar.
-                # Mas fazer get_category n vezes é lento.
-                # Melhora: A Fatura Cartão é criada pelo sistema.
-                # O ideal é filtrar tudo que tiver "Fatura Cartão" no nome da Categoria SE tivermos o nome aqui.
-                # No `all_transactions_data` (linha 46), temos o dict do firestore.
-                # O firestore NÃO traz o nome da categoria junto, só o ID.
-                # Mas no começo do `dashboard.py` podemos pegar o ID da Fatura Cartão.
-
-                # Para performance, vamos pegar o ID da Fatura Cartão uma vez só fora do loop.
-                # (Vou inserir essa busca antes dos loops)
-
-                if t.get("category_id") == invoice_category_id:
-                    continue
-
-                val = abs(float(t.get("amount", 0)))
-                tp = t.get("type")
-                if tp == "income":
-                    m_income += val
-                elif tp == "expense":
-                    m_expense += val
-
-        evolution_data.append(
-            MonthlyEvolution(month=label, income=m_income, expense=m_expense)
-        )
-
     return DashboardSummary(
         total_balance=total_balance,
         income_month=income,
@@ -13,7 +13,7 @@ from app.schemas.debt import (
     PaymentStep,
 )
 from app.services.debt_calculator_service import DebtCalculatorService
-from app.services.user_preference import get_preferences
+from app.services.user_preference import get_subscription_tier
 from dateutil.relativedelta import relativedelta
 from fastapi import HTTPException
 from google.cloud.firestore_v1 import FieldFilter
@@ -27,13 +27,13 @@ def check_tier_eligibility(user_id: str):
     For now, we enforce this at the service level for plan generation or creating debts beyond a limit?
     Plan says: Free = No access. PRO = Manual. Premium = AI.
     """
-    pref = get_preferences(user_id)
-    if pref.subscription_tier == "free":
+    tier = get_subscription_tier(user_id)
+    if tier == "free":
         raise HTTPException(
             status_code=403,
             detail="Debt Planner is available for PRO and PREMIUM users.",
         )
-    return pref.subscription_tier
+    return tier
 
 
 def create_debt(user_id: str, debt_in: DebtCreate) -> Debt:
@@ -5,7 +5,7 @@ from typing import Any, Dict
 
 from app.core.logger import get_logger
 from app.services.ai_service import _call_with_retry
-from app.services.user_preference import get_preferences
+from app.services.user_preference import get_subscription_tier
 from google import genai
 
 logger = get_logger(__name__)
@@ -29,8 +29,7 @@ class DocumentAnalysisService:
         Restricted to PREMIUM users (checked by caller or here).
         """
         # (Optional) Double check tier here if not done in API
-        pref = get_preferences(user_id)
-        if pref.subscription_tier != "premium":
+        if get_subscription_tier(user_id) != "premium":
             # Return error that frontend can parse
             return {"error": "Recurso disponível apenas para usuários Premium."}
 
@@ -1,12 +1,185 @@
+import asyncio
 import os
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr, formatdate, make_msgid
 from pathlib import Path
 
+import aiosmtplib
 from app.core.logger import get_logger
 from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 logger = get_logger(__name__)
 
+# Envio em massa: conexões SMTP simultâneas, mensagens por conexão antes de
+# renovar a sessão e teto de envios por segundo (limite do provedor).
+MAIL_BULK_CONNECTIONS = int(os.getenv("MAIL_BULK_CONNECTIONS", "4"))
+MAIL_MESSAGES_PER_CONNECTION = int(os.getenv("MAIL_MESSAGES_PER_CONNECTION", "100"))
+MAIL_MAX_PER_SECOND = float(os.getenv("MAIL_MAX_PER_SECOND", "5"))
+
+# Falhas da conexão (e não da mensagem): reconecta e tenta de novo uma vez.
+# Inclui falhas ao (re)abrir a sessão (SMTPConnectError é ConnectionError);
+# erro de autenticação não entra, repetir não resolve.
+_RECONNECT_ERRORS = (
+    aiosmtplib.SMTPServerDisconnected,
+    aiosmtplib.SMTPTimeoutError,
+    ConnectionError,
+)
+
+
+def _smtp_client(conf: ConnectionConfig) -> aiosmtplib.SMTP:
+    """Cliente SMTP com as mesmas opções que o FastMail usa a cada envio."""
+    return aiosmtplib.SMTP(
+        hostname=conf.MAIL_SERVER,
+        port=conf.MAIL_PORT,
+        timeout=conf.TIMEOUT,
+        use_tls=conf.MAIL_SSL_TLS,
+        start_tls=conf.MAIL_STARTTLS,
+        validate_certs=conf.VALIDATE_CERTS,
+        local_hostname=conf.LOCAL_HOSTNAME,
+        cert_bundle=conf.CERT_BUNDLE,
+    )
+
+
+class _SMTPSession:
+    """
+    Conexão SMTP autenticada reaproveitada por vários envios. Se a conexão cai
+    e a reconexão também falha, só a mensagem em curso falha; a próxima abre
+    uma sessão nova.
+    """
+
+    def __init__(self, conf: ConnectionConfig, max_messages: int):
+        self.conf = conf
+        self.max_messages = max(1, max_messages)
+        self.client = None
+        self.sent = 0
+
+    async def _open(self):
+        client = _smtp_client(self.conf)
+        if not self.conf.SUPPRESS_SEND:
+            await client.connect()
+            try:
+                if self.conf.USE_CREDENTIALS:
+                    await client.login(
+                        self.conf.MAIL_USERNAME,
+                        self.conf.MAIL_PASSWORD.get_secret_value(),
+                    )
+            except Exception:
+                client.close()
+                raise
+        self.client = client
+        self.sent = 0
+
+    async def close(self):
+        client, self.client = self.client, None
+        if client is None or self.conf.SUPPRESS_SEND:
+            return
+        try:
+            await client.quit()
+        except Exception as e:
+            logger.debug("Falha ao encerrar sessão SMTP: %s", e)
+            client.close()
+
+    async def send(self, message):
+        if self.client is not None and self.sent >= self.max_messages:
+            await self.close()
+
+        for attempt in range(2):
+            try:
+                if self.client is None:
+                    await self._open()
+                if not self.conf.SUPPRESS_SEND:
+                    await self.client.send_message(message)
+                self.sent += 1
+                return
+            except _RECONNECT_ERRORS as e:
+                await self.close()
+                if attempt:
+                    raise
+                logger.warning("Sessão SMTP caiu (%s), reconectando...", e)
+
+
+class _RatePacer:
+    """Espaça os envios para no máximo `per_second` por segundo."""
+
+    def __init__(self, per_second: float):
+        self.interval = 1 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class BulkMailer:
+    """
+    Envio em massa: até `connections` sessões SMTP abertas (uma por worker
+    ativo), cada uma renovada a cada `max_messages` envios ou quando cai, com
+    os envios espaçados pelo limite do provedor. Use com `async with`.
+    """
+
+    def __init__(
+        self,
+        service: "EmailService",
+        connections: int = MAIL_BULK_CONNECTIONS,
+        max_messages: int = MAIL_MESSAGES_PER_CONNECTION,
+        per_second: float = MAIL_MAX_PER_SECOND,
+    ):
+        self.service = service
+        self._sessions = [
+            _SMTPSession(service.conf, max_messages) for _ in range(max(1, connections))
+        ]
+        self._idle = asyncio.Queue()
+        for session in self._sessions:
+            self._idle.put_nowait(session)
+        self._pacer = _RatePacer(per_second)
+
+    async def __aenter__(self) -> "BulkMailer":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        for session in self._sessions:
+            await session.close()
+
+    async def send_email(
+        self,
+        subject: str,
+        recipients: list[str],
+        body: str,
+        subtype: MessageType = MessageType.html,
+    ):
+        if not self.service.enabled or not self.service.conf:
+            logger.info(
+                "Email skipped (service disabled): %s -> %s", subject, recipients
+            )
+            return
+
+        message = await self.service.build_message(subject, recipients, body, subtype)
+        session = await self._idle.get()
+        try:
+            await self._pacer.wait()
+            await session.send(message)
+            logger.info("Email sent successfully to %s: %s", recipients, subject)
+        except Exception as e:
+            logger.error(
+                "Failed to send email to %s: %s. Error: %s", recipients, subject, e
+            )
+            raise
+        finally:
+            self._idle.put_nowait(session)
+
 
 # Configurações do Email
 class EmailService:
@@ -44,7 +217,15 @@ class EmailService:
         self.env = Environment(
             loader=FileSystemLoader(str(template_dir)),
             autoescape=select_autoescape(["html", "xml"]),
+            auto_reload=False,
         )
+        # Templates compilados uma vez na inicialização
+        self.templates = {}
+        for name in self.env.list_templates(extensions=["html"]):
+            try:
+                self.templates[name] = self.env.get_template(name)
+            except Exception as e:
+                logger.error("Failed to compile email template %s: %s", name, e)
 
     async def send_email(
         self,
@@ -72,15 +253,51 @@ class EmailService:
             # Re-raise or handle based on needs, but here we just log as it might be in background tasks
             raise e
 
+    async def build_message(
+        self,
+        subject: str,
+        recipients: list[str],
+        body: str,
+        subtype: MessageType = MessageType.html,
+    ):
+        """
+        Mensagem MIME pronta para `SMTP.send_message`, no mesmo formato do
+        FastMail (multipart/mixed com o corpo em utf-8), montada com a stdlib.
+        """
+        message = MIMEMultipart("mixed")
+        message.set_charset("utf-8")
+        message.attach(
+            MIMEText(body, _subtype=MessageType(subtype).value, _charset="utf-8")
+        )
+        message["Date"] = formatdate(time.time(), localtime=True)
+        message["Message-ID"] = make_msgid()
+        message["To"] = ", ".join(recipients)
+        message["From"] = formataddr((self.conf.MAIL_FROM_NAME, self.conf.MAIL_FROM))
+        message["Subject"] = subject
+        return message
+
+    def bulk(self, **options) -> BulkMailer:
+        """Envio em massa por conexões SMTP reaproveitadas (ver BulkMailer)."""
+        return BulkMailer(self, **options)
+
     def render_template(self, template_name: str, context: dict) -> str:
-        template = self.env.get_template(template_name)
+        template = self.templates.get(template_name)
+        if template is None:
+            template = self.templates[template_name] = self.env.get_template(
+                template_name
+            )
         return template.render(context)
 
     async def send_weekly_report(
-        self, recipient_email: str, recipient_name: str, report_data: dict
+        self,
+        recipient_email: str,
+        recipient_name: str,
+        report_data: dict,
+        mailer: BulkMailer = None,
     ):
         """
-        Envia o relatório semanal para o usuário.
+        Envia o relatório semanal para o usuário. Com `mailer`, usa as
+        conexões do envio em massa em vez de abrir uma por mensagem.
         """
         html_content = self.render_template(
             "weekly_report.html",
@@ -91,7 +308,7 @@ class EmailService:
             },
         )
 
-        await self.send_email(
+        await (mailer or self).send_email(
             subject="📊 Seu Resumo Financeiro Semanal - MonFinTrack",
             recipients=[recipient_email],
             body=html_content,
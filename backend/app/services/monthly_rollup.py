@@ -0,0 +1,326 @@
+"""
+Agregados mensais materializados (usuário × mês × categoria × tipo).
+
+Cada documento em `monthly_rollups` guarda os totais de um mês de um usuário,
+mantidos incrementalmente (firestore.Increment) a cada escrita de transação.
+Dashboard, orçamentos e relatórios leem poucos documentos pequenos em vez de
+varrer milhares de transações.
+
+Os incrementos entram no mesmo batch que grava a transação (parâmetro
+`batch`), então transação e agregados nunca divergem por uma queda entre as
+duas escritas.
+
+Como transações antigas não geraram agregados, os leitores só confiam nos
+rollups depois que `rebuild_user_rollups` rodou para o usuário (marcador em
+`monthly_rollups_meta/{user_id}`); antes disso, e durante um rebuild, caem no
+cálculo sobre as transações brutas.
+"""
+
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.database import get_db
+from app.core.logger import get_logger
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter
+
+logger = get_logger(__name__)
+
+COLLECTION_NAME = "monthly_rollups"
+META_COLLECTION_NAME = "monthly_rollups_meta"
+
+UNKNOWN_CATEGORY = "unknown"
+
+
+def month_key(value) -> Optional[str]:
+    """Converte a data de uma transação (datetime, date ou ISO string) em 'YYYY-MM' (UTC)."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            value = value.astimezone(timezone.utc)
+        return f"{value.year:04d}-{value.month:02d}"
+
+    if isinstance(value, date):
+        return f"{value.year:04d}-{value.month:02d}"
+
+    return None
+
+
+def rollup_doc_id(user_id: str, key: str) -> str:
+    return f"{user_id}_{key}"
+
+
+def _type_value(t_type) -> Optional[str]:
+    return getattr(t_type, "value", t_type)
+
+
+def _accumulate(acc: dict, data: dict, sign: int = 1):
+    """
+    Soma (ou subtrai, com sign=-1) a transação `data` no acumulador
+    {month_key: {"count": n, "categories": {cat_id: {type: total}}}}.
+    """
+    key = month_key(data.get("date"))
+    t_type = _type_value(data.get("type"))
+    if not key or not t_type:
+        return
+
+    amount = abs(float(data.get("amount") or 0))
+    cat_id = data.get("category_id") or UNKNOWN_CATEGORY
+
+    bucket = acc.setdefault(key, {"count": 0, "categories": {}})
+    bucket["count"] += sign
+    cat_bucket = bucket["categories"].setdefault(cat_id, {})
+    cat_bucket[t_type] = cat_bucket.get(t_type, 0.0) + sign * amount
+
+
+def _write_deltas(db, user_id: str, deltas: dict, batch=None):
+    if not deltas:
+        return
+
+    own_batch = batch is None
+    if own_batch:
+        batch = db.batch()
+    for key, bucket in deltas.items():
+        year, month = (int(p) for p in key.split("-"))
+        payload = {
+            "user_id": user_id,
+            "month_key": key,
+            "year": year,
+            "month": month,
+            "count": firestore.Increment(bucket["count"]),
+            "categories": {
+                cat_id: {
+                    t_type: firestore.Increment(value)
+                    for t_type, value in types.items()
+                }
+                for cat_id, types in bucket["categories"].items()
+            },
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+        ref = db.collection(COLLECTION_NAME).document(rollup_doc_id(user_id, key))
+        batch.set(ref, payload, merge=True)
+    if own_batch:
+        batch.commit()
+
+
+def apply_transactions(
+    db, user_id: str, items: Iterable[dict], sign: int = 1, batch=None
+):
+    """
+    Aplica (sign=1) ou estorna (sign=-1) várias transações. Com `batch`, os
+    incrementos entram no batch do chamador (gravados junto com as transações,
+    um documento por mês). Sem ele, vão num batch próprio e falhas são logadas
+    sem interromper a escrita da transação em si.
+    """
+    deltas = {}
+    for data in items:
+        _accumulate(deltas, data, sign)
+    if batch is not None:
+        _write_deltas(db, user_id, deltas, batch)
+        return
+    try:
+        _write_deltas(db, user_id, deltas)
+    except Exception as e:
+        logger.warning("Falha ao atualizar monthly_rollups (User: %s): %s", user_id, e)
+
+
+def apply_transaction(db, user_id: str, data: dict, sign: int = 1, batch=None):
+    apply_transactions(db, user_id, [data], sign, batch)
+
+
+def touched_months(*items: dict) -> set:
+    """Meses (documentos de rollup) que as transações podem alterar."""
+    return {month_key(data.get("date")) for data in items}
+
+
+def _signature(data: dict) -> tuple:
+    return (
+        month_key(data.get("date")),
+        _type_value(data.get("type")),
+        data.get("category_id") or UNKNOWN_CATEGORY,
+        abs(float(data.get("amount") or 0)),
+    )
+
+
+def apply_changes(db, user_id: str, pairs: Iterable[Tuple[dict, dict]], batch=None):
+    """
+    Move a contribuição de cada transação do estado antigo para o novo,
+    gravando todas as diferenças num único batch (o do chamador, se houver).
+    """
+    deltas = {}
+    for old_data, new_data in pairs:
+        if _signature(old_data) == _signature(new_data):
+            continue
+        _accumulate(deltas, old_data, -1)
+        _accumulate(deltas, new_data, 1)
+    if batch is not None:
+        _write_deltas(db, user_id, deltas, batch)
+        return
+    try:
+        _write_deltas(db, user_id, deltas)
+    except Exception as e:
+        logger.warning("Falha ao atualizar monthly_rollups (User: %s): %s", user_id, e)
+
+
+def apply_change(db, user_id: str, old_data: dict, new_data: dict, batch=None):
+    apply_changes(db, user_id, [(old_data, new_data)], batch)
+
+
+def get_rollups(user_id: str, keys: List[str]) -> Optional[Dict[str, dict]]:
+    """
+    Retorna {month_key: rollup} para os meses pedidos (meses sem documento vêm
+    vazios), ou None se os agregados do usuário ainda não foram reconstruídos.
+    Faz uma única ida ao Firestore (get_all).
+    """
+    db = get_db()
+    meta_ref = db.collection(META_COLLECTION_NAME).document(user_id)
+    refs = [
+        db.collection(COLLECTION_NAME).document(rollup_doc_id(user_id, k)) for k in keys
+    ]
+
+    try:
+        snapshots = {snap.reference.id: snap for snap in db.get_all([meta_ref, *refs])}
+    except Exception as e:
+        logger.warning("Falha ao ler monthly_rollups (User: %s): %s", user_id, e)
+        return None
+
+    meta = snapshots.get(user_id)
+    if not meta or not meta.exists or not meta.to_dict().get("ready"):
+        return None
+
+    result = {}
+    for key in keys:
+        snap = snapshots.get(rollup_doc_id(user_id, key))
+        data = snap.to_dict() if snap and snap.exists else {}
+        result[key] = {
+            "count": data.get("count", 0),
+            "categories": data.get("categories", {}),
+        }
+    return result
+
+
+def category_totals(
+    rollup: dict, t_type: str, exclude: Iterable[str] = ()
+) -> Dict[str, float]:
+    """Totais {category_id: valor} de um tipo ('income', 'expense', ...) no mês."""
+    excluded = set(exclude)
+    return {
+        cat_id: types.get(t_type, 0.0)
+        for cat_id, types in rollup.get("categories", {}).items()
+        if cat_id not in excluded and types.get(t_type)
+    }
+
+
+def type_total(rollup: dict, t_type: str, exclude: Iterable[str] = ()) -> float:
+    return sum(category_totals(rollup, t_type, exclude).values())
+
+
+def _delete_user_docs(db, user_id: str) -> int:
+    docs = (
+        db.collection(COLLECTION_NAME)
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .stream()
+    )
+
+    batch = db.batch()
+    count = 0
+    deleted_count = 0
+
+    for doc in docs:
+        batch.delete(doc.reference)
+        count += 1
+
+        if count >= 400:
+            batch.commit()
+            batch = db.batch()
+            deleted_count += count
+            count = 0
+
+    if count > 0:
+        batch.commit()
+        deleted_count += count
+
+    return deleted_count
+
+
+def _mark_ready(db, user_id: str):
+    db.collection(META_COLLECTION_NAME).document(user_id).set(
+        {"ready": True, "rebuilt_at": datetime.now(timezone.utc)}
+    )
+
+
+def _mark_rebuilding(db, user_id: str):
+    """Tira o marcador antes de apagar/regravar: leitores usam as transações."""
+    db.collection(META_COLLECTION_NAME).document(user_id).set(
+        {"ready": False, "rebuild_started_at": datetime.now(timezone.utc)}
+    )
+
+
+def reset_user_rollups(user_id: str):
+    """Zera os agregados (ex: após apagar todas as transações do usuário)."""
+    db = get_db()
+    _mark_rebuilding(db, user_id)
+    _delete_user_docs(db, user_id)
+    _mark_ready(db, user_id)
+
+
+def rebuild_user_rollups(user_id: str) -> Tuple[int, int]:
+    """
+    Recalcula do zero os agregados do usuário a partir das transações brutas.
+    Retorna (transações lidas, meses gravados).
+
+    O marcador `ready` sai antes e volta só no fim: enquanto os documentos são
+    apagados e regravados, dashboard e orçamentos usam as transações brutas.
+    Incrementos de escritas feitas durante o rebuild podem se perder (os
+    totais são regravados com `set`); rode em manutenção ou de novo depois.
+    """
+    db = get_db()
+    _mark_rebuilding(db, user_id)
+    docs = (
+        db.collection("transactions")
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .stream()
+    )
+
+    acc = {}
+    tx_count = 0
+    for doc in docs:
+        _accumulate(acc, doc.to_dict())
+        tx_count += 1
+
+    _delete_user_docs(db, user_id)
+
+    batch = db.batch()
+    count = 0
+    for key, bucket in acc.items():
+        year, month = (int(p) for p in key.split("-"))
+        ref = db.collection(COLLECTION_NAME).document(rollup_doc_id(user_id, key))
+        batch.set(
+            ref,
+            {
+                "user_id": user_id,
+                "month_key": key,
+                "year": year,
+                "month": month,
+                "count": bucket["count"],
+                "categories": bucket["categories"],
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+        count += 1
+
+        if count >= 400:
+            batch.commit()
+            batch = db.batch()
+            count = 0
+
+    if count > 0:
+        batch.commit()
+
+    _mark_ready(db, user_id)
+    return tx_count, len(acc)
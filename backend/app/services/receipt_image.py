@@ -0,0 +1,69 @@
+"""
+Pré-processamento de comprovantes antes do envio ao modelo e ao storage.
+
+Fotos de celular chegam com 3–8 MB; para ler um cupom o modelo não precisa
+de mais que ~1600 px no lado maior nem de cor. A imagem é rotacionada pelo
+EXIF, convertida para tons de cinza, reduzida e recomprimida em JPEG.
+
+O resultado é idempotente: uma imagem que já está no formato final (JPEG em
+tons de cinza dentro do limite) volta com os mesmos bytes, então o hash de
+conteúdo de um anexo reenviado via `file_url` bate com o do upload original.
+PDFs seguem inalterados (o Gemini lê PDF nativamente).
+"""
+
+import hashlib
+import io
+from typing import Tuple
+
+from app.core.logger import get_logger
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = get_logger(__name__)
+
+MAX_DIMENSION = 1600
+JPEG_QUALITY = 80
+OUTPUT_MIME_TYPE = "image/jpeg"
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def prepare_receipt(content: bytes, mime_type: str) -> Tuple[bytes, str]:
+    """
+    (bytes, mime_type) prontos para o modelo. Em caso de falha ao decodificar
+    a imagem, devolve o conteúdo original.
+    """
+    if not content or not (mime_type or "").startswith("image/"):
+        return content, mime_type
+
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            if (
+                img.format == "JPEG"
+                and img.mode == "L"
+                and max(img.size) <= MAX_DIMENSION
+                and not img.getexif().get(0x0112)  # Orientation
+            ):
+                return content, OUTPUT_MIME_TYPE
+
+            # JPEG: decodifica já em escala reduzida (bem mais rápido)
+            img.draft("L", (MAX_DIMENSION, MAX_DIMENSION))
+            out = ImageOps.exif_transpose(img).convert("L")
+            out.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+
+            buffer = io.BytesIO()
+            out.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning("Receipt preprocessing skipped (%s): %s", mime_type, e)
+        return content, mime_type
+
+    processed = buffer.getvalue()
+    logger.debug(
+        "Receipt preprocessed: %d -> %d bytes (%dx%d)",
+        len(content),
+        len(processed),
+        out.width,
+        out.height,
+    )
+    return processed, OUTPUT_MIME_TYPE
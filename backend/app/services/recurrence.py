@@ -1,7 +1,10 @@
-from datetime import datetime, timezone
+import calendar
+import hashlib
+from datetime import date, datetime, timezone
 from typing import List, Optional
 
 from app.core.database import get_db
+from app.core.date_utils import calculate_next_due_date
 from app.core.logger import get_logger
 from app.schemas.recurrence import Recurrence, RecurrenceCreate, RecurrenceUpdate
 from fastapi import HTTPException
@@ -11,12 +14,83 @@ logger = get_logger(__name__)
 
 COLLECTION_NAME = "recurrences"
 
+# Fatias do worker: `shard_bucket` (hash do usuário) deixa a fatia ser filtrada
+# na própria consulta. 30 é o máximo de valores de um filtro `in`.
+SHARD_BUCKETS = 30
+
+
+def shard_bucket(user_id: str) -> int:
+    digest = hashlib.sha1(user_id.encode(), usedforsecurity=False).hexdigest()
+    return int(digest, 16) % SHARD_BUCKETS
+
+
+def _as_naive_utc(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _on_due_day(dt: datetime, due_day: int) -> datetime:
+    """Mesmo mês, no `due_day` (limitado ao último dia do mês)."""
+    last_day = calendar.monthrange(dt.year, dt.month)[1]
+    return dt.replace(day=min(due_day, last_day))
+
+
+def occurrence_id(recurrence_id: str, due: datetime) -> str:
+    """ID determinístico da transação gerada para um vencimento."""
+    return f"rec_{recurrence_id}_{due.strftime('%Y%m%d')}"
+
+
+def compute_next_due_at(data: dict, today: datetime = None) -> Optional[datetime]:
+    """
+    Próximo vencimento ainda não gerado (campo `next_due_at`, consultado pelo
+    worker), ou None se a recorrência está inativa.
+
+    Depois de `last_processed_at` vem o período seguinte no `due_day`; sem
+    nenhuma ocorrência gerada, o `due_day` do mês corrente.
+    """
+    if not data.get("active", True):
+        return None
+
+    periodicity = data.get("periodicity")
+    due_day = data.get("due_day") or 1
+    last_processed = _as_naive_utc(data.get("last_processed_at"))
+
+    if last_processed:
+        next_due = calculate_next_due_date(last_processed, periodicity)
+        if next_due == last_processed:
+            logger.warning("Periodicidade desconhecida na recorrência: %s", periodicity)
+            return None
+        if periodicity not in ("weekly", "semanal"):
+            next_due = _on_due_day(next_due, due_day)
+    else:
+        today = today or datetime.now(timezone.utc).replace(tzinfo=None)
+        next_due = _on_due_day(today, due_day)
+        if periodicity == "yearly" and data.get("due_month"):
+            # Mês de vencimento já passou neste ano: primeira ocorrência no próximo
+            year = today.year + int(data["due_month"] < today.month)
+            next_due = _on_due_day(
+                today.replace(day=1, month=data["due_month"], year=year), due_day
+            )
+
+    return next_due.replace(hour=0, minute=0, second=0, microsecond=0)
+
 
 def create_recurrence(recurrence_in: RecurrenceCreate, user_id: str) -> Recurrence:
     db = get_db()
 
     data = recurrence_in.model_dump()
     data["user_id"] = user_id
+    data["shard_bucket"] = shard_bucket(user_id)
     data["created_at"] = datetime.now(timezone.utc)
     data["last_processed_at"] = None
     data["cancellation_date"] = None
@@ -38,6 +112,8 @@ def create_recurrence(recurrence_in: RecurrenceCreate, user_id: str) -> Recurren
             else data["start_date"]
         )
 
+    data["next_due_at"] = compute_next_due_at(data)
+
     update_time, recurrence_ref = db.collection(COLLECTION_NAME).add(data)
 
     return Recurrence(id=recurrence_ref.id, **data)
@@ -95,7 +171,13 @@ def update_recurrence(
     if scope == "future":
         # 1. Cancel current recurrence
         now = datetime.now(timezone.utc)
-        doc_ref.update({"active": False, "cancellation_date": now.date().isoformat()})
+        doc_ref.update(
+            {
+                "active": False,
+                "cancellation_date": now.date().isoformat(),
+                "next_due_at": None,
+            }
+        )
 
         # 2. Create new recurrence with updated data
         new_data = current_data.copy()
@@ -121,6 +203,8 @@ def update_recurrence(
         # Set new creation date and ensure active
         new_data["created_at"] = now
         new_data["active"] = True
+        new_data["shard_bucket"] = shard_bucket(user_id)
+        new_data["next_due_at"] = compute_next_due_at(new_data)
 
         # Create the new document
         _, new_ref = db.collection(COLLECTION_NAME).add(new_data)
@@ -147,9 +231,13 @@ def update_recurrence(
             else data["start_date"]
         )
 
+    data["shard_bucket"] = shard_bucket(user_id)
+    current_data.update(data)
+    data["next_due_at"] = current_data["next_due_at"] = compute_next_due_at(
+        current_data
+    )
     doc_ref.update(data)
 
-    current_data.update(data)
     return Recurrence(id=recurrence_id, **current_data)
 
 
@@ -168,6 +256,7 @@ def cancel_recurrence(recurrence_id: str, user_id: str) -> Recurrence:
     cancel_data = {
         "active": False,
         "cancellation_date": datetime.now(timezone.utc).date().isoformat(),
+        "next_due_at": None,
     }
     doc_ref.update(cancel_data)
 
@@ -175,6 +264,47 @@ def cancel_recurrence(recurrence_id: str, user_id: str) -> Recurrence:
     return Recurrence(id=recurrence_id, **current_data)
 
 
+def backfill_next_due_at() -> int:
+    """
+    Preenche `next_due_at` e `shard_bucket` nas recorrências ativas criadas
+    antes desses campos existirem (o worker só enxerga recorrências com
+    `next_due_at` e, quando fatiado, com `shard_bucket`).
+    """
+    db = get_db()
+    docs = (
+        db.collection(COLLECTION_NAME)
+        .where(filter=FieldFilter("active", "==", True))
+        .stream()
+    )
+
+    batch = db.batch()
+    count = 0
+    updated = 0
+
+    for doc in docs:
+        data = doc.to_dict()
+        missing = {}
+        if data.get("next_due_at") is None:
+            missing["next_due_at"] = compute_next_due_at(data)
+        if data.get("shard_bucket") is None and data.get("user_id"):
+            missing["shard_bucket"] = shard_bucket(data["user_id"])
+        if not missing:
+            continue
+        batch.update(doc.reference, missing)
+        count += 1
+        updated += 1
+
+        if count >= 400:
+            batch.commit()
+            batch = db.batch()
+            count = 0
+
+    if count > 0:
+        batch.commit()
+
+    return updated
+
+
 def delete_all_recurrences(user_id: str):
     db = get_db()
     docs = (
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 
@@ -300,6 +301,7 @@ class StripeService:
                                 {"subscription_tier": tier, "version": current_version + 1},
                                 merge=True,
                             )
+                        await self._propagate_tier(user_id, tier)
                         logger.info(
                             f"Tier atualizado via fallback de metadados para {user_id}: {tier}"
                         )
@@ -382,6 +384,7 @@ class StripeService:
                     },
                     merge=True,
                 )
+            await self._propagate_tier(user_id, effective_tier)
 
             logger.info(
                 f"Assinatura atualizada para o usuário {user_id}: nível={effective_tier}, status={status}"
@@ -416,9 +419,21 @@ class StripeService:
                     {"subscription_tier": "free", "version": current_version + 1},
                     merge=True,
                 )
+            await self._propagate_tier(user_id, "free")
 
             logger.info(f"Assinatura cancelada para o cliente {customer_id}")
 
+    async def _propagate_tier(self, user_id: str, tier: str):
+        """
+        Claim `tier` no Firebase + cache local de tier (ver user_preference).
+        O Firebase Auth é síncrono: roda numa thread para não travar o loop.
+        """
+        from app.services import user_preference as preference_service
+
+        await asyncio.to_thread(
+            preference_service.set_subscription_tier, user_id, tier
+        )
+
     def cancel_all_subscriptions(self, user_id: str):
         """Cancela todas as assinaturas ativas de um usuário antes de deletar a conta."""
         user_ref = self.db.collection("users").document(user_id)
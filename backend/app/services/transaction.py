@@ -1,7 +1,10 @@
+import base64
+import json
 import uuid
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
+from app.core import request_cache
 from app.core.database import get_db
 from app.core.date_utils import get_month_range
 from app.core.logger import get_logger
@@ -17,10 +20,14 @@ from app.schemas.transaction import (
 )
 from app.services import account as account_service
 from app.services import category as category_service
+from app.services import category_classifier
+from app.services import category_stats
+from app.services import monthly_rollup
 from app.services import recurrence as recurrence_service
 from app.services.analysis_service import analysis_service
 from dateutil.relativedelta import relativedelta
 from fastapi import HTTPException
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from google.cloud import firestore
 from google.cloud.firestore_v1 import FieldFilter
 
@@ -28,6 +35,92 @@ logger = get_logger(__name__)
 COLLECTION_NAME = "transactions"
 
 
+def _balance_deltas(
+    account_id: str,
+    amount: float,
+    type: str,
+    revert: bool = False,
+    destination_account_id: str = None,
+) -> dict:
+    """Calcula o efeito de uma transação no saldo de cada conta: {account_id: delta}."""
+    sign = -1 if revert else 1
+    deltas = {}
+
+    # SOURCE ACCOUNT: receita soma; despesa e transferência saem da origem
+    if type == "income":
+        deltas[account_id] = sign * amount
+    elif type in ("expense", "transfer"):
+        deltas[account_id] = -sign * amount
+
+    # DESTINATION ACCOUNT (Only for Transfers with explicit destination)
+    if type == "transfer" and destination_account_id:
+        deltas[destination_account_id] = (
+            deltas.get(destination_account_id, 0.0) + sign * amount
+        )
+
+    return deltas
+
+
+def _merge_deltas(target: dict, deltas: dict) -> dict:
+    for acc_id, delta in deltas.items():
+        if acc_id:
+            target[acc_id] = target.get(acc_id, 0.0) + delta
+    return target
+
+
+def _apply_balance_deltas(
+    db,
+    deltas: dict,
+    user_id: str,
+    owned_account_ids=None,
+    batch=None,
+):
+    """
+    Aplica os deltas de saldo com firestore.Increment (sem ler o saldo atual).
+
+    `owned_account_ids` são contas já carregadas e sabidamente do usuário; as
+    demais têm a posse conferida com um único get_all. Com `batch`, as escritas
+    entram no batch do chamador (que faz o commit), senão são gravadas juntas
+    num batch próprio, de forma atômica (origem e destino de transferências).
+    """
+    deltas = {acc_id: d for acc_id, d in deltas.items() if acc_id and d}
+    if not deltas:
+        return
+
+    owned = set(owned_account_ids or ())
+    unknown = [acc_id for acc_id in deltas if acc_id not in owned]
+    if unknown:
+        refs = [db.collection("accounts").document(acc_id) for acc_id in unknown]
+        for snap in db.get_all(refs):
+            if snap.exists and snap.to_dict().get("user_id") == user_id:
+                owned.add(snap.id)
+
+    own_batch = batch is None
+    if own_batch:
+        batch = db.batch()
+
+    writes = 0
+    for acc_id, delta in deltas.items():
+        if acc_id not in owned:
+            logger.warning(
+                "Acesso negado ou conta inexistente para update de saldo. User: %s, Acc: %s",
+                user_id,
+                acc_id,
+            )
+            continue
+        batch.update(
+            db.collection("accounts").document(acc_id),
+            {"balance": firestore.Increment(delta)},
+        )
+        writes += 1
+
+    if own_batch and writes:
+        batch.commit()
+
+    # Saldos mudaram: contas memoizadas nesta requisição ficaram velhas
+    request_cache.invalidate("accounts")
+
+
 # Função Auxiliar Blindada
 def _update_account_balance(
     db,
@@ -37,68 +130,97 @@ def _update_account_balance(
     user_id: str,
     revert: bool = False,
     destination_account_id: str = None,
+    owned_account_ids=None,
+    batch=None,
 ):
     if not account_id:
         return
 
-    # SOURCE ACCOUNT
-    acc_ref = db.collection("accounts").document(account_id)
-    acc_doc = acc_ref.get()
+    _apply_balance_deltas(
+        db,
+        _balance_deltas(account_id, amount, type, revert, destination_account_id),
+        user_id,
+        owned_account_ids=owned_account_ids,
+        batch=batch,
+    )
 
-    if acc_doc.exists and acc_doc.to_dict().get("user_id") == user_id:
-        current_balance = acc_doc.to_dict().get("balance", 0.0)
 
-        # LOGIC FOR SOURCE ACCOUNT
-        if type == "expense":
-            if revert:
-                current_balance += amount
-            else:
-                current_balance -= amount
-        elif type == "income":
-            if revert:
-                current_balance -= amount
-            else:
-                current_balance += amount
-        elif type == "transfer":
-            # Transfers always decrement source, unless reverting
-            if revert:
-                current_balance += amount
-            else:
-                current_balance -= amount
+def _normalize_tz(value: datetime, reference: datetime) -> datetime:
+    """Alinha o tzinfo de `value` ao de `reference` para permitir comparação."""
+    if value.tzinfo and not reference.tzinfo:
+        return value.replace(tzinfo=None)
+    if not value.tzinfo and reference.tzinfo:
+        return value.replace(tzinfo=reference.tzinfo)
+    return value
 
-        acc_ref.update({"balance": current_balance})
-    else:
-        logger.warning(
-            "Acesso negado ou conta inexistente para update de saldo. User: %s, Acc: %s",
-            user_id,
-            account_id,
-        )
 
-    # DESTINATION ACCOUNT (Only for Transfers with explicit destination)
-    if type == "transfer" and destination_account_id:
-        dest_ref = db.collection("accounts").document(destination_account_id)
-        dest_doc = dest_ref.get()
+def _date_in_range(
+    t_date: datetime,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+) -> bool:
+    if start_date and _normalize_tz(t_date, start_date) < start_date:
+        return False
+    if end_date and _normalize_tz(t_date, end_date) > end_date:
+        return False
+    return True
 
-        if dest_doc.exists and dest_doc.to_dict().get("user_id") == user_id:
-            dest_balance = dest_doc.to_dict().get("balance", 0.0)
 
-            if revert:
-                dest_balance -= amount  # Reverting transfer: Remove from dest
-            else:
-                dest_balance += amount  # Applying transfer: Add to dest
+def _plan_transactions_query(
+    db,
+    user_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: Optional[int] = None,
+):
+    """
+    Monta a query de transações empurrando filtros, ordenação e limite para o Firestore.
 
-            dest_ref.update({"balance": dest_balance})
-        else:
-            logger.warning(
-                "Acesso negado ou conta destino inexistente. User: %s, DestAcc: %s",
-                user_id,
-                destination_account_id,
-            )
+    Todas as combinações (sem range, só início, só fim, range completo) usam o
+    índice composto user_id ASC + date DESC, então nunca é preciso ler o
+    histórico inteiro para devolver as N transações mais recentes.
+    """
+    query = db.collection(COLLECTION_NAME).where(
+        filter=FieldFilter("user_id", "==", user_id)
+    )
+    if start_date:
+        query = query.where(filter=FieldFilter("date", ">=", start_date))
+    if end_date:
+        query = query.where(filter=FieldFilter("date", "<=", end_date))
 
+    query = query.order_by("date", direction=firestore.Query.DESCENDING)
 
-def create_transaction(transaction_in: TransactionCreate, user_id: str) -> Transaction:
-    db = get_db()
+    if limit:
+        query = query.limit(limit)
+
+    return query
 
+
+def _stream_planned_query(
+    db,
+    user_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> list:
+    """
+    Executa a query planejada. Só cai para o scan completo do usuário (filtrado
+    em memória pelo chamador) quando o Firestore acusa índice ausente.
+    """
+    query = _plan_transactions_query(db, user_id, start_date, end_date, limit)
+    try:
+        # stream() é lazy: o erro de índice só aparece ao iterar
+        return list(query.stream())
+    except FailedPrecondition as e:
+        logger.warning("Índice ausente para list_transactions, usando fallback: %s", e)
+        query = db.collection(COLLECTION_NAME).where(
+            filter=FieldFilter("user_id", "==", user_id)
+        )
+        return list(query.stream())
+
+
+def _prepare_transaction(db, transaction_in: TransactionCreate, user_id: str):
+    """Valida categoria/contas e roda a análise de anomalia antes de gravar."""
     category = category_service.get_category(transaction_in.category_id, user_id)
     # Aqui também seria ideal verificar se a categoria é do usuário
     if not category:
@@ -112,11 +234,71 @@ def create_transaction(transaction_in: TransactionCreate, user_id: str) -> Trans
             transaction_in.destination_account_id, user_id
         )
 
-    # Atualiza Saldo (Passando user_id para segurança) - APENAS SE PAGO E NÃO FOR CARTÃO DE CRÉDITO
-    if (
+    # --- ANOMALY DETECTION (PRO) ---
+    if transaction_in.type == TransactionType.EXPENSE and not transaction_in.warning:
+        warning = analysis_service.analyze_transaction(
+            user_id, transaction_in.amount, transaction_in.category_id
+        )
+        if warning:
+            transaction_in.warning = warning
+    # -------------------------------
+
+    return category, account, destination_account
+
+
+def _changes_balance(transaction_in: TransactionCreate) -> bool:
+    # APENAS SE PAGO E NÃO FOR CARTÃO DE CRÉDITO
+    return (
         transaction_in.status == TransactionStatus.PAID
         and not transaction_in.credit_card_id
-    ):
+    )
+
+
+def _after_create(db, user_id: str, transaction_in: TransactionCreate, data: dict):
+    category_classifier.learn(
+        db, user_id, [(data.get("title"), data.get("category_id"))]
+    )
+    if transaction_in.type == TransactionType.EXPENSE:
+        category_stats.record_expenses(
+            db, user_id, [(transaction_in.category_id, transaction_in.amount)]
+        )
+
+
+def _stale_stats_categories(pairs: Iterable[Tuple[dict, Optional[dict]]]) -> set:
+    """
+    Categorias cuja janela de category_stats muda com as edições (antigo, novo);
+    novo None = exclusão. Só despesas entram na janela; a data define a ordem.
+    """
+    categories = set()
+    for old_data, new_data in pairs:
+        if new_data is not None and all(
+            old_data.get(f) == new_data.get(f)
+            for f in ("amount", "category_id", "type", "date")
+        ):
+            continue
+        for data in (old_data, new_data or {}):
+            if data.get("type") == TransactionType.EXPENSE:
+                categories.add(data.get("category_id"))
+    return categories
+
+
+def create_transaction(transaction_in: TransactionCreate, user_id: str) -> Transaction:
+    db = get_db()
+
+    category, account, destination_account = _prepare_transaction(
+        db, transaction_in, user_id
+    )
+
+    data = transaction_in.model_dump()
+    data["user_id"] = user_id  # MARCA DONO
+
+    # Documento, saldo e agregado mensal gravados juntos
+    batch = db.batch()
+    transaction_ref = db.collection(COLLECTION_NAME).document()
+    batch.set(transaction_ref, data)
+
+    # Atualiza Saldo (Passando user_id para segurança)
+    if _changes_balance(transaction_in):
         _update_account_balance(
             db,
             transaction_in.account_id,
@@ -125,24 +307,73 @@ def create_transaction(transaction_in: TransactionCreate, user_id: str) -> Trans
             user_id,
             revert=False,
             destination_account_id=transaction_in.destination_account_id,
+            # Posse já conferida por get_account: dispensa nova leitura
+            owned_account_ids={a.id for a in (account, destination_account) if a},
+            batch=batch,
         )
 
-    # --- ANOMALY DETECTION (PRO) ---
-    if transaction_in.type == TransactionType.EXPENSE and not transaction_in.warning:
-        warning = analysis_service.analyze_transaction(
-            user_id, transaction_in.amount, transaction_in.category_id
-        )
-        if warning:
-            transaction_in.warning = warning
-    # -------------------------------
+    monthly_rollup.apply_transaction(db, user_id, data, batch=batch)
+    batch.commit()
+    _after_create(db, user_id, transaction_in, data)
+
+    return Transaction(
+        id=transaction_ref.id,
+        category=category,
+        account=account,
+        destination_account=destination_account,
+        **data,
+    )
+
+
+def create_transaction_once(
+    transaction_in: TransactionCreate,
+    user_id: str,
+    transaction_id: str,
+    extra_updates: Iterable[Tuple[Any, dict]] = (),
+) -> Optional[Transaction]:
+    """
+    Cria a transação com um ID determinístico (ex: ocorrência de recorrência).
+    Documento, saldo, agregado mensal e `extra_updates` ((ref, campos) de
+    outros documentos) vão num único batch; se o ID já existe nada é gravado
+    e retorna None, o que torna retentativas e execuções paralelas seguras.
+    """
+    db = get_db()
+
+    category, account, destination_account = _prepare_transaction(
+        db, transaction_in, user_id
+    )
 
     data = transaction_in.model_dump()
     data["user_id"] = user_id  # MARCA DONO
 
-    update_time, transaction_ref = db.collection(COLLECTION_NAME).add(data)
+    batch = db.batch()
+    batch.create(db.collection(COLLECTION_NAME).document(transaction_id), data)
+    for ref, fields in extra_updates:
+        batch.update(ref, fields)
+    if _changes_balance(transaction_in):
+        _update_account_balance(
+            db,
+            transaction_in.account_id,
+            transaction_in.amount,
+            transaction_in.type,
+            user_id,
+            revert=False,
+            destination_account_id=transaction_in.destination_account_id,
+            owned_account_ids={a.id for a in (account, destination_account) if a},
+            batch=batch,
+        )
+    monthly_rollup.apply_transaction(db, user_id, data, batch=batch)
+
+    try:
+        batch.commit()
+    except AlreadyExists:
+        logger.info("Transação %s já existe; nada a gravar.", transaction_id)
+        return None
+
+    _after_create(db, user_id, transaction_in, data)
 
     return Transaction(
-        id=transaction_ref.id,
+        id=transaction_id,
         category=category,
         account=account,
         destination_account=destination_account,
@@ -150,6 +381,117 @@ def create_transaction(transaction_in: TransactionCreate, user_id: str) -> Trans
     )
 
 
+def create_transactions_bulk(
+    transactions_in: List[TransactionCreate], user_id: str
+) -> List[Transaction]:
+    """
+    Cria várias transações que compartilham categoria e contas (ex: parcelas).
+    Valida categoria/contas e roda a análise de anomalia uma única vez, grava
+    todos os documentos num WriteBatch e aplica um ajuste de saldo combinado.
+    """
+    if not transactions_in:
+        return []
+
+    db = get_db()
+    first = transactions_in[0]
+
+    category = category_service.get_category(first.category_id, user_id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+
+    account = account_service.get_account(first.account_id, user_id)
+
+    destination_account = None
+    if first.destination_account_id:
+        destination_account = account_service.get_account(
+            first.destination_account_id, user_id
+        )
+
+    # --- ANOMALY DETECTION (PRO) --- (mesmo valor/categoria: basta uma análise)
+    warning = None
+    if first.type == TransactionType.EXPENSE and not first.warning:
+        warning = analysis_service.analyze_transaction(
+            user_id, first.amount, first.category_id
+        )
+
+    balance_deltas = {}
+    written = []
+    created = []
+    batch = db.batch()
+    chunk = []
+    months = set()
+
+    for transaction_in in transactions_in:
+        if warning and transaction_in.type == TransactionType.EXPENSE:
+            transaction_in.warning = transaction_in.warning or warning
+
+        if (
+            transaction_in.status == TransactionStatus.PAID
+            and not transaction_in.credit_card_id
+        ):
+            _merge_deltas(
+                balance_deltas,
+                _balance_deltas(
+                    transaction_in.account_id,
+                    transaction_in.amount,
+                    transaction_in.type,
+                    revert=False,
+                    destination_account_id=transaction_in.destination_account_id,
+                ),
+            )
+
+        data = transaction_in.model_dump()
+        data["user_id"] = user_id  # MARCA DONO
+
+        doc_ref = db.collection(COLLECTION_NAME).document()
+        batch.set(doc_ref, data)
+        written.append(data)
+        created.append(
+            Transaction(
+                id=doc_ref.id,
+                category=category,
+                account=account,
+                destination_account=destination_account,
+                **data,
+            )
+        )
+        chunk.append(data)
+        months |= monthly_rollup.touched_months(data)
+
+        # Cada commit leva os agregados dos seus próprios documentos
+        if len(chunk) + len(months) >= 400:
+            monthly_rollup.apply_transactions(db, user_id, chunk, batch=batch)
+            batch.commit()
+            batch = db.batch()
+            chunk = []
+            months = set()
+
+    # Documentos restantes + agregados + saldo combinado no mesmo commit
+    monthly_rollup.apply_transactions(db, user_id, chunk, batch=batch)
+    _apply_balance_deltas(
+        db,
+        balance_deltas,
+        user_id,
+        owned_account_ids={a.id for a in (account, destination_account) if a},
+        batch=batch,
+    )
+    batch.commit()
+
+    # Parcelas repetem título/categoria: o classificador aprende uma vez
+    category_classifier.learn(db, user_id, [(first.title, first.category_id)])
+    category_stats.record_expenses(
+        db,
+        user_id,
+        [
+            (d.get("category_id"), d.get("amount"))
+            for d in written
+            if d.get("type") == TransactionType.EXPENSE
+        ],
+    )
+
+    return created
+
+
 def create_unified_transaction(
     transaction_in: TransactionCreate, user_id: str
 ) -> List[Transaction]:
@@ -162,6 +504,7 @@ def create_unified_transaction(
     # Lógica de Parcelamento (Cenário A)
     if transaction_in.total_installments and transaction_in.total_installments > 1:
         group_id = str(uuid.uuid4())
+        installments = []
 
         base_date = transaction_in.date
         # Ensure base_date is datetime
@@ -211,10 +554,9 @@ def create_unified_transaction(
                 f"{original_title} ({i+1}/{transaction_in.total_installments})"
             )
 
-            t_create = TransactionCreate(**t_data)
-            created_transactions.append(create_transaction(t_create, user_id))
+            installments.append(TransactionCreate(**t_data))
 
-        return created_transactions
+        return create_transactions_bulk(installments, user_id)
 
     # CENÁRIO B: Recorrência (Sem parcelas)
     if transaction_in.recurrence_periodicity:
@@ -257,47 +599,11 @@ def create_unified_transaction(
     return [create_transaction(transaction_in, user_id)]
 
 
-def list_transactions(
-    user_id: str,
-    month: Optional[int] = None,
-    year: Optional[int] = None,
-    limit: Optional[int] = None,
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-) -> list[Transaction]:
-    db = get_db()
-    # FILTRO DO USUÁRIO
-    query = db.collection(COLLECTION_NAME).where(filter=FieldFilter("user_id", "==", user_id))
-
-    transactions = []
-
-    # Se não vieram datas específicas, mas veio mês/ano, calcula o range
-    if not start_date and not end_date and month and year:
-        start_date, end_date = get_month_range(month, year)
-
-    # OTIMIZAÇÃO: Filtro no Banco de Dados (Requer Índice Composto user_id + date)
-    if start_date and end_date:
-        if start_date.tzinfo is None:
-            pass
-
-        query = query.where(
-            filter=FieldFilter("date", ">=", start_date)
-        ).where(filter=FieldFilter("date", "<=", end_date))
-        # OTIMIZAÇÃO EXTRA: Ordenação e Limite no DB
-        # Isso requer índice: user_id ASC, date DESC
-        query = query.order_by("date", direction=firestore.Query.DESCENDING)
-
-        if limit:
-            query = query.limit(limit)
-
-    try:
-        all_transactions = query.stream()
-    except Exception as e:
-        logger.warning("Erro ao consultar DB (Provavelmente falta índice): %s", e)
-        # Fallback: Busca tudo e filtra na memória (Comportamento antigo, lento mas funcional)
-        query = db.collection(COLLECTION_NAME).where(filter=FieldFilter("user_id", "==", user_id))
-        all_transactions = query.stream()
-
+def _make_hydrator(user_id: str):
+    """
+    Pré-carrega categorias e contas do usuário e devolve uma função que converte
+    (doc_id, data) do Firestore em Transaction com lookups O(1).
+    """
     # ==========================================
     # N+1 FIX: Batch preload de Categories e Accounts
     # Em vez de fazer 1 query por transação (N+1), fazemos 2 queries totais.
@@ -329,29 +635,7 @@ def list_transactions(
         user_id=user_id,
     )
 
-    for t in all_transactions:
-        data = t.to_dict()
-
-        # Double Check Date (Caso o fallback tenha sido ativado ou para garantir ranges precisos)
-        if start_date and end_date:
-            t_date = data.get("date")
-            if t_date:
-                if isinstance(t_date, str):
-                    try:
-                        t_date = datetime.fromisoformat(t_date.replace("Z", "+00:00"))
-                    except (ValueError, TypeError):
-                        continue
-
-                # Normalize for comparison
-                if isinstance(t_date, datetime):
-                    if t_date.tzinfo and not start_date.tzinfo:
-                        t_date = t_date.replace(tzinfo=None)
-                    elif not t_date.tzinfo and start_date.tzinfo:
-                        t_date = t_date.replace(tzinfo=start_date.tzinfo)
-
-                    if not (start_date <= t_date <= end_date):
-                        continue
-
+    def hydrate(doc_id: str, data: dict) -> Transaction:
         # O(1) lookup em vez de query individual ao Firestore
         cat_id = data.get("category_id")
         category = cat_map.get(cat_id, deleted_category) if cat_id else deleted_category
@@ -369,16 +653,58 @@ def list_transactions(
         if data.get("is_auto_pay") is None:
             data["is_auto_pay"] = False
 
-        transactions.append(
-            Transaction(
-                id=t.id,
-                category=category,
-                account=account,
-                destination_account=destination_account,
-                **data,
-            )
+        return Transaction(
+            id=doc_id,
+            category=category,
+            account=account,
+            destination_account=destination_account,
+            **data,
         )
 
+    return hydrate
+
+
+def list_transactions(
+    user_id: str,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> list[Transaction]:
+    db = get_db()
+    transactions = []
+
+    # Se não vieram datas específicas, mas veio mês/ano, calcula o range
+    if not start_date and not end_date and month and year:
+        start_date, end_date = get_month_range(month, year)
+
+    all_transactions = _stream_planned_query(
+        db, user_id, start_date=start_date, end_date=end_date, limit=limit
+    )
+
+    hydrate = _make_hydrator(user_id)
+
+    for t in all_transactions:
+        data = t.to_dict()
+
+        # Double Check Date (Caso o fallback tenha sido ativado ou para garantir ranges precisos)
+        if start_date or end_date:
+            t_date = data.get("date")
+            if t_date:
+                if isinstance(t_date, str):
+                    try:
+                        t_date = datetime.fromisoformat(t_date.replace("Z", "+00:00"))
+                    except (ValueError, TypeError):
+                        continue
+
+                if isinstance(t_date, datetime) and not _date_in_range(
+                    t_date, start_date, end_date
+                ):
+                    continue
+
+        transactions.append(hydrate(t.id, data))
+
     # Sort by date desc
     transactions.sort(key=lambda x: x.date, reverse=True)
 
@@ -388,6 +714,134 @@ def list_transactions(
     return transactions
 
 
+def encode_cursor(doc_id: str, date_value) -> str:
+    """Cursor opaco com a posição (date, __name__) do último item da página."""
+    if isinstance(date_value, datetime):
+        payload = {"id": doc_id, "d": date_value.isoformat(), "t": "ts"}
+    else:
+        payload = {"id": doc_id, "d": date_value, "t": "str"}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Converte o cursor opaco nos valores para start_after. ValueError se inválido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        date_value = payload["d"]
+        if payload.get("t") == "ts":
+            date_value = datetime.fromisoformat(date_value)
+        return {"date": date_value, "__name__": payload["id"]}
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _fetch_page(
+    db,
+    user_id: str,
+    page_size: int,
+    cursor: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+):
+    """
+    Lê uma página ordenada por (date desc, __name__ desc) a partir do cursor.
+    Usa o índice user_id ASC + date DESC + __name__ DESC.
+    Retorna (docs, next_cursor); next_cursor é None na última página.
+    """
+    query = db.collection(COLLECTION_NAME).where(
+        filter=FieldFilter("user_id", "==", user_id)
+    )
+    if start_date:
+        query = query.where(filter=FieldFilter("date", ">=", start_date))
+    if end_date:
+        query = query.where(filter=FieldFilter("date", "<=", end_date))
+
+    query = query.order_by("date", direction=firestore.Query.DESCENDING).order_by(
+        "__name__", direction=firestore.Query.DESCENDING
+    )
+
+    if cursor:
+        query = query.start_after(decode_cursor(cursor))
+
+    docs = list(query.limit(page_size).stream())
+
+    next_cursor = None
+    if len(docs) == page_size:
+        last = docs[-1]
+        next_cursor = encode_cursor(last.id, last.to_dict().get("date"))
+
+    return docs, next_cursor
+
+
+def list_transactions_page(
+    user_id: str,
+    cursor: Optional[str] = None,
+    page_size: int = 50,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+):
+    """
+    Paginação por cursor: custo O(página) em leituras e memória.
+    Retorna (transactions, next_cursor).
+    """
+    db = get_db()
+
+    if not start_date and not end_date and month and year:
+        start_date, end_date = get_month_range(month, year)
+
+    docs, next_cursor = _fetch_page(
+        db, user_id, page_size, cursor, start_date=start_date, end_date=end_date
+    )
+
+    hydrate = _make_hydrator(user_id)
+    return [hydrate(doc.id, doc.to_dict()) for doc in docs], next_cursor
+
+
+def iter_transactions(
+    user_id: str,
+    page_size: int = 200,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> Iterator[Transaction]:
+    """
+    Percorre o histórico inteiro (mais recentes primeiro) página a página,
+    mantendo em memória apenas uma página por vez. Útil para exportações.
+    """
+    db = get_db()
+    hydrate = _make_hydrator(user_id)
+
+    cursor = None
+    while True:
+        docs, cursor = _fetch_page(
+            db, user_id, page_size, cursor, start_date=start_date, end_date=end_date
+        )
+        for doc in docs:
+            yield hydrate(doc.id, doc.to_dict())
+        if not cursor:
+            return
+
+
+def list_raw_transactions(
+    user_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> list[dict]:
+    """
+    Versão leve de list_transactions para agregações: devolve os dicts do
+    Firestore (com "id") sem montar Category/Account nem modelos Pydantic.
+    """
+    db = get_db()
+    docs = _stream_planned_query(
+        db, user_id, start_date=start_date, end_date=end_date, limit=limit
+    )
+    return [{**doc.to_dict(), "id": doc.id} for doc in docs]
+
+
 def update_transaction(
     transaction_id: str, transaction_in: TransactionUpdate, user_id: str
 ) -> Transaction:
@@ -401,6 +855,11 @@ def update_transaction(
     old_data = doc_snapshot.to_dict()
     # Serialize Enums/Datetimes to JSON-compatible format for Firestore
     update_data = transaction_in.model_dump(exclude_unset=True, mode="json")
+    # Datas continuam Timestamp (não string ISO): consultas por intervalo de
+    # data, como a dos pagamentos automáticos do worker, não casam com string
+    for field in ("date", "payment_date"):
+        if update_data.get(field) is not None:
+            update_data[field] = getattr(transaction_in, field)
 
     # Merge for logic check (simulating what the new state will be)
     new_full_data = {**old_data, **update_data}
@@ -420,38 +879,7 @@ def update_transaction(
         old_data.get(f) != new_full_data.get(f) for f in fields_affecting_balance
     )
 
-    if changed:
-        # 1. Revert Old (If it impacted balance)
-        if old_status == TransactionStatus.PAID and not old_data.get("credit_card_id"):
-            _update_account_balance(
-                db,
-                old_data.get("account_id"),
-                old_data.get("amount", 0),
-                old_data.get("type"),
-                user_id,
-                revert=True,
-                destination_account_id=old_data.get("destination_account_id"),
-            )
-
-        # 2. Apply New (If it impacts balance)
-        if new_status == TransactionStatus.PAID and not new_full_data.get(
-            "credit_card_id"
-        ):
-            _update_account_balance(
-                db,
-                new_full_data.get("account_id"),
-                new_full_data.get("amount", 0),
-                new_full_data.get("type"),
-                user_id,
-                revert=False,
-                destination_account_id=new_full_data.get("destination_account_id"),
-            )
-
-    # Apply Update (Using JSON compatible data)
-    if update_data:
-        doc_ref.update(update_data)
-
-    # Construct Response
+    # Contas do estado novo (usadas na resposta e como prova de posse para o saldo)
     category_id = new_full_data.get("category_id")
     account_id = new_full_data.get("account_id")
 
@@ -467,7 +895,8 @@ def update_transaction(
             user_id=user_id,
         )
 
-    account = account_service.get_account(account_id, user_id)
+    loaded_account = account_service.get_account(account_id, user_id)
+    account = loaded_account
     if not account:
         account = Account(
             id="deleted",
@@ -484,6 +913,69 @@ def update_transaction(
     if dest_acc_id:
         destination_account = account_service.get_account(dest_acc_id, user_id)
 
+    # Saldo, documento e agregado mensal no mesmo commit
+    batch = db.batch()
+    if changed:
+        deltas = {}
+        # 1. Revert Old (If it impacted balance)
+        if old_status == TransactionStatus.PAID and not old_data.get("credit_card_id"):
+            _merge_deltas(
+                deltas,
+                _balance_deltas(
+                    old_data.get("account_id"),
+                    old_data.get("amount", 0),
+                    old_data.get("type"),
+                    revert=True,
+                    destination_account_id=old_data.get("destination_account_id"),
+                ),
+            )
+
+        # 2. Apply New (If it impacts balance)
+        if new_status == TransactionStatus.PAID and not new_full_data.get(
+            "credit_card_id"
+        ):
+            _merge_deltas(
+                deltas,
+                _balance_deltas(
+                    new_full_data.get("account_id"),
+                    new_full_data.get("amount", 0),
+                    new_full_data.get("type"),
+                    revert=False,
+                    destination_account_id=new_full_data.get("destination_account_id"),
+                ),
+            )
+
+        # Estorno + aplicação viram um único Increment líquido por conta
+        _apply_balance_deltas(
+            db,
+            deltas,
+            user_id,
+            owned_account_ids={
+                a.id for a in (loaded_account, destination_account) if a
+            },
+            batch=batch,
+        )
+
+    # Apply Update (Using JSON compatible data)
+    if update_data:
+        batch.update(doc_ref, update_data)
+        monthly_rollup.apply_change(
+            db, user_id, old_data, new_full_data, batch=batch
+        )
+    batch.commit()
+
+    if update_data:
+        category_stats.refresh_categories(
+            db, user_id, _stale_stats_categories([(old_data, new_full_data)])
+        )
+
+        # Recategorização (ou título novo) corrige o classificador local
+        old_pair = (old_data.get("title"), old_data.get("category_id"))
+        new_pair = (new_full_data.get("title"), new_full_data.get("category_id"))
+        if old_pair != new_pair:
+            category_classifier.learn(db, user_id, [old_pair], sign=-1)
+            category_classifier.learn(db, user_id, [new_pair])
+
     # Sanitize boolean fields for Pydantic (TransactionBase expects bool, not None)
     if new_full_data.get("is_auto_pay") is None:
         new_full_data["is_auto_pay"] = False
@@ -526,6 +1018,11 @@ def delete_transaction(transaction_id: str, user_id: str, scope: str = "all"):
         )
 
         deleted_count = 0
+        deleted_items = []
+        months = set()
+        stale_categories = set()
+        balance_deltas = {}
+        batch = db.batch()
         for t in group_query:
             t_data = t.to_dict()
             t_installment_number = t_data.get("installment_number", 1)
@@ -547,19 +1044,42 @@ def delete_transaction(transaction_id: str, user_id: str, scope: str = "all"):
                 and t_status == TransactionStatus.PAID
                 and not t_credit_card_id
             ):
-                _update_account_balance(
-                    db,
-                    t_account_id,
-                    t_amount,
-                    t_type,
-                    user_id,
-                    revert=True,
-                    destination_account_id=t_data.get("destination_account_id"),
+                _merge_deltas(
+                    balance_deltas,
+                    _balance_deltas(
+                        t_account_id,
+                        t_amount,
+                        t_type,
+                        revert=True,
+                        destination_account_id=t_data.get("destination_account_id"),
+                    ),
                 )
 
-            db.collection(COLLECTION_NAME).document(t_id).delete()
+            batch.delete(db.collection(COLLECTION_NAME).document(t_id))
+            deleted_items.append(t_data)
+            months |= monthly_rollup.touched_months(t_data)
+            stale_categories |= _stale_stats_categories([(t_data, None)])
             deleted_count += 1
 
+            # Cada commit estorna os agregados das suas próprias exclusões
+            if len(deleted_items) + len(months) >= 400:
+                monthly_rollup.apply_transactions(
+                    db, user_id, deleted_items, sign=-1, batch=batch
+                )
+                batch.commit()
+                batch = db.batch()
+                deleted_items = []
+                months = set()
+
+        # Exclusões restantes + agregados + um Increment por conta no mesmo commit
+        monthly_rollup.apply_transactions(
+            db, user_id, deleted_items, sign=-1, batch=batch
+        )
+        _apply_balance_deltas(db, balance_deltas, user_id, batch=batch)
+        batch.commit()
+
+        category_stats.refresh_categories(db, user_id, stale_categories)
+
         return {
             "status": "success",
             "message": f"Deleted {deleted_count} transactions from group",
@@ -572,6 +1092,10 @@ def delete_transaction(transaction_id: str, user_id: str, scope: str = "all"):
     status = data.get("status", TransactionStatus.PAID)
     credit_card_id = data.get("credit_card_id")
 
+    # Exclusão, estorno de saldo e agregado mensal no mesmo commit
+    batch = db.batch()
+    batch.delete(doc_ref)
+
     # Estorna Saldo APENAS SE ESTAVA PAGO E NÃO ERA CARTÃO
     if account_id and status == TransactionStatus.PAID and not credit_card_id:
         _update_account_balance(
@@ -582,9 +1106,15 @@ def delete_transaction(transaction_id: str, user_id: str, scope: str = "all"):
             user_id,
             revert=True,
             destination_account_id=data.get("destination_account_id"),
+            batch=batch,
         )
 
-    doc_ref.delete()
+    monthly_rollup.apply_transaction(db, user_id, data, sign=-1, batch=batch)
+    batch.commit()
+
+    category_stats.refresh_categories(
+        db, user_id, _stale_stats_categories([(data, None)])
+    )
 
     return {"status": "success", "message": "Transaction deleted"}
 
@@ -642,6 +1172,11 @@ def update_installment_group(
     )
 
     updated_transactions = [updated_main]
+    rollup_changes = []
+    months = set()
+    stale_categories = set()
+    balance_deltas = {}
+    batch = db.batch()
 
     for t in group_query:
         t_id = t.id
@@ -678,31 +1213,51 @@ def update_installment_group(
 
             # Reverte saldo antigo se pago e sem cartão
             if old_status == TransactionStatus.PAID and not old_credit_card:
-                _update_account_balance(
-                    db,
-                    t_data.get("account_id"),
-                    t_data.get("amount", 0),
-                    t_data.get("type"),
-                    user_id,
-                    revert=True,
-                    destination_account_id=t_data.get("destination_account_id"),
+                _merge_deltas(
+                    balance_deltas,
+                    _balance_deltas(
+                        t_data.get("account_id"),
+                        t_data.get("amount", 0),
+                        t_data.get("type"),
+                        revert=True,
+                        destination_account_id=t_data.get("destination_account_id"),
+                    ),
                 )
 
             # Aplica novo saldo
             new_data = {**t_data, **patch}
             new_credit_card = new_data.get("credit_card_id")
             if old_status == TransactionStatus.PAID and not new_credit_card:
-                _update_account_balance(
-                    db,
-                    new_data.get("account_id"),
-                    new_data.get("amount", 0),
-                    new_data.get("type"),
-                    user_id,
-                    revert=False,
-                    destination_account_id=new_data.get("destination_account_id"),
+                _merge_deltas(
+                    balance_deltas,
+                    _balance_deltas(
+                        new_data.get("account_id"),
+                        new_data.get("amount", 0),
+                        new_data.get("type"),
+                        revert=False,
+                        destination_account_id=new_data.get("destination_account_id"),
+                    ),
                 )
 
-        db.collection(COLLECTION_NAME).document(t_id).update(patch)
+        batch.update(db.collection(COLLECTION_NAME).document(t_id), patch)
+        rollup_changes.append((t_data, {**t_data, **patch}))
+        stale_categories |= _stale_stats_categories(rollup_changes[-1:])
+        months |= monthly_rollup.touched_months(t_data, {**t_data, **patch})
+
+        # Cada commit leva os agregados das suas próprias parcelas
+        if len(rollup_changes) + len(months) >= 400:
+            monthly_rollup.apply_changes(db, user_id, rollup_changes, batch=batch)
+            batch.commit()
+            batch = db.batch()
+            rollup_changes = []
+            months = set()
+
+    # Parcelas restantes + agregados + Increment líquido por conta num só commit
+    monthly_rollup.apply_changes(db, user_id, rollup_changes, batch=batch)
+    _apply_balance_deltas(db, balance_deltas, user_id, batch=batch)
+    batch.commit()
+
+    category_stats.refresh_categories(db, user_id, stale_categories)
 
     return updated_transactions
 
@@ -806,6 +1361,8 @@ def delete_all_transactions(user_id: str):
         batch.commit()
         deleted_count += count
 
+    monthly_rollup.reset_user_rollups(user_id)
+
     return deleted_count
 
 
@@ -986,3 +1543,98 @@ def batch_pay_tithes(user_id: str) -> dict:
         "message": f"{total_batched} dízimo(s) marcado(s) como pago.",
         "updated_count": total_batched,
     }
+
+
+def _commit_payments(db, user_id: str, snapshots: list, paid_at: datetime):
+    batch = db.batch()
+    deltas = {}
+    for snap in snapshots:
+        data = snap.to_dict()
+        # Só grava se a transação não mudou desde a leitura (ex: paga pelo usuário)
+        batch.update(
+            snap.reference,
+            {"status": TransactionStatus.PAID.value, "payment_date": paid_at},
+            option=db.write_option(last_update_time=snap.update_time),
+        )
+        if not data.get("credit_card_id"):
+            _merge_deltas(
+                deltas,
+                _balance_deltas(
+                    data.get("account_id"),
+                    data.get("amount", 0),
+                    data.get("type"),
+                    destination_account_id=data.get("destination_account_id"),
+                ),
+            )
+    # Um Increment por conta, no mesmo commit dos status
+    _apply_balance_deltas(db, deltas, user_id, batch=batch)
+    batch.commit()
+
+
+def pay_transactions(user_id: str, snapshots: list) -> int:
+    """
+    Marca como PAID transações pendentes já lidas (snapshots do usuário) em
+    batches de até 400, com o saldo agregado por conta. Se alguma mudou desde
+    a leitura o batch falha inteiro e as transações dele são pagas uma a uma,
+    pulando as alteradas. Retorna quantas foram pagas.
+    """
+    db = get_db()
+    paid_at = datetime.now(timezone.utc)
+    paid = 0
+
+    for start in range(0, len(snapshots), 400):
+        chunk = snapshots[start : start + 400]
+        try:
+            _commit_payments(db, user_id, chunk, paid_at)
+            paid += len(chunk)
+            continue
+        except FailedPrecondition:
+            logger.info("Conflito no pagamento em lote (User: %s)", user_id)
+
+        for snap in chunk:
+            try:
+                _commit_payments(db, user_id, [snap], paid_at)
+                paid += 1
+            except FailedPrecondition:
+                logger.info("Transação %s mudou desde a leitura; ignorada", snap.id)
+
+    return paid
+
+
+def backfill_string_dates() -> int:
+    """
+    Converte em Timestamp os `date`/`payment_date` gravados como string ISO
+    por versões anteriores de `update_transaction`. Retorna quantos campos
+    foram corrigidos.
+    """
+    db = get_db()
+    batch = db.batch()
+    count = 0
+    updated = 0
+
+    for field in ("date", "payment_date"):
+        # Strings ordenam depois de Timestamps: `>= ""` traz só as strings
+        docs = (
+            db.collection(COLLECTION_NAME)
+            .where(filter=FieldFilter(field, ">=", ""))
+            .stream()
+        )
+        for doc in docs:
+            value = doc.to_dict().get(field)
+            try:
+                parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            except (AttributeError, ValueError):
+                logger.warning("Data inválida em %s.%s: %r", doc.id, field, value)
+                continue
+            batch.update(doc.reference, {field: parsed})
+            count += 1
+            updated += 1
+
+            if count >= 400:
+                batch.commit()
+                batch = db.batch()
+                count = 0
+
+    if count > 0:
+        batch.commit()
+    return updated
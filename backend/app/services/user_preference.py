@@ -1,6 +1,10 @@
 import os
+import threading
+import time
 from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
 
+from app.core import request_cache, security
 from app.core.database import get_db
 from app.core.logger import get_logger
 from app.schemas.user_preference import UserPreference, UserPreferenceCreate
@@ -20,7 +24,23 @@ logger = get_logger(__name__)
 COLLECTION_NAME = "user_preferences"
 stripe_service = StripeService()
 
+# --- Plano de assinatura (tier) ---
+# O tier vai numa custom claim do Firebase (`tier`), gravada pelo webhook do
+# Stripe, e chega já verificado no token. Sem a claim (ou com token anterior
+# a uma mudança de plano vista nesta instância) vale um cache local curto,
+# atualizado pelo próprio webhook; só então o Firestore é lido.
+TIER_CLAIM = "tier"
+TIERS = ("free", "pro", "premium")
+TIER_CACHE_TTL_SECONDS = int(os.getenv("TIER_CACHE_TTL_SECONDS", "60"))
+TIER_CACHE_MAX_ENTRIES = 10_000
 
+_tier_lock = threading.Lock()
+_tier_cache: Dict[str, Tuple[str, float]] = {}
+# uid -> instante da última mudança de plano; claims emitidas antes são velhas
+_tier_changed_at: Dict[str, int] = {}
+
+
+@request_cache.memoize("preferences")
 def get_preferences(user_id: str) -> UserPreference:
     db = get_db()
     doc_ref = db.collection(COLLECTION_NAME).document(user_id)
@@ -46,6 +66,66 @@ def get_preferences(user_id: str) -> UserPreference:
     return default_pref
 
 
+def _read_subscription_tier(user_id: str) -> str:
+    doc = get_db().collection(COLLECTION_NAME).document(user_id).get()
+    data = (doc.to_dict() or {}) if doc.exists else {}
+    tier = data.get("subscription_tier")
+    return tier if tier in TIERS else "free"
+
+
+def get_subscription_tier(user_id: str, claims: Optional[dict] = None) -> str:
+    """
+    Plano do usuário (free, pro, premium). `claims` é o token verificado
+    (current_user); quando traz a claim `tier` atualizada, não há leitura.
+    """
+    now = time.monotonic()
+    with _tier_lock:
+        entry = _tier_cache.get(user_id)
+        changed_at = _tier_changed_at.get(user_id, 0)
+    if entry and entry[1] > now:
+        return entry[0]
+
+    tier = (claims or {}).get(TIER_CLAIM)
+    if tier in TIERS and (claims.get("iat") or 0) >= changed_at:
+        return tier
+
+    tier = _read_subscription_tier(user_id)
+    with _tier_lock:
+        if len(_tier_cache) >= TIER_CACHE_MAX_ENTRIES:
+            for uid in [u for u, (_, exp) in _tier_cache.items() if exp <= now]:
+                del _tier_cache[uid]
+        _tier_cache[user_id] = (tier, now + TIER_CACHE_TTL_SECONDS)
+    return tier
+
+
+def set_subscription_tier(user_id: str, tier: str):
+    """
+    Propaga uma mudança de plano (webhook do Stripe, depois do Firestore):
+    atualiza o cache local e a custom claim `tier`, preservando as demais.
+    O cliente recebe a claim nova ao renovar o token.
+    """
+    with _tier_lock:
+        _tier_cache[user_id] = (tier, time.monotonic() + TIER_CACHE_TTL_SECONDS)
+        _tier_changed_at[user_id] = int(time.time())
+        stale = int(time.time()) - security.TOKEN_MAX_LIFETIME_SECONDS
+        for uid in [u for u, at in _tier_changed_at.items() if at < stale]:
+            del _tier_changed_at[uid]
+
+    try:
+        claims = dict(auth.get_user(user_id).custom_claims or {})
+        if claims.get(TIER_CLAIM) != tier:
+            claims[TIER_CLAIM] = tier
+            auth.set_custom_user_claims(user_id, claims)
+    except Exception as e:
+        logger.warning("Falha ao gravar a claim de tier (User: %s): %s", user_id, e)
+
+
+def clear_tier_cache():
+    with _tier_lock:
+        _tier_cache.clear()
+        _tier_changed_at.clear()
+
+
 def update_preferences(user_id: str, data: UserPreferenceCreate) -> UserPreference:
     db = get_db()
     doc_ref = db.collection(COLLECTION_NAME).document(user_id)
@@ -63,6 +143,7 @@ def update_preferences(user_id: str, data: UserPreferenceCreate) -> UserPreferen
     update_data["user_id"] = user_id
 
     doc_ref.set(update_data, merge=True)
+    request_cache.invalidate("preferences")
 
     # Fetch full updated doc to return
     return UserPreference(**doc_ref.get().to_dict())
@@ -136,6 +217,7 @@ def delete_account_completely(user_id: str):
     # 3. Delete Preferences document
     db = get_db()
     db.collection(COLLECTION_NAME).document(user_id).delete()
+    request_cache.invalidate("preferences")
 
     # 4. Delete User reports
     reports_ref = db.collection("users").document(user_id).collection("reports")
@@ -147,7 +229,8 @@ def delete_account_completely(user_id: str):
     # Note: These are hashed, so they don't contain PII, but we use user_id in hash.
     # To be fully compliant, we'd list and delete, but hashed data is technically pseudo-anonymized.
 
-    # 6. Delete Firebase Auth User
+    # 6. Delete Firebase Auth User (and drop its cached tokens)
+    security.revoke_user_tokens(user_id)
     try:
         auth.delete_user(user_id)
         logger.info("Deleted Firebase Auth user: %s", user_id)
@@ -0,0 +1,454 @@
+"""
+Relatório semanal por e-mail e push, processado como um job retomável.
+
+Cada execução tem um checkpoint em `weekly_report_runs/{run_id}` (por padrão
+a semana ISO, ex: "2026-W42"), então disparar o cron de novo na mesma semana
+continua a execução em vez de recomeçar. Os usuários são lidos em páginas de
+USERS_PAGE_SIZE ordenadas por ID (`start_after` no cursor salvo), e cada
+página é processada com no máximo WEEKLY_REPORT_CONCURRENCY usuários ao
+mesmo tempo. Ao fim de cada página o cursor, os contadores e o tempo gasto em
+cada etapa são gravados no checkpoint.
+
+O usuário atendido recebe `last_weekly_report_run = run_id`: se a execução
+cair no meio de uma página, a retomada pula quem já recebeu o relatório.
+
+Uma execução `running` pertence a quem a assumiu (`owner`) enquanto o
+checkpoint for atualizado nos últimos RUN_LEASE_SECONDS. Durante o
+processamento um heartbeat renova `updated_at` a cada RUN_HEARTBEAT_SECONDS,
+mesmo no meio de uma página lenta (IA com retentativas, SMTP com ritmo
+limitado). Sem heartbeat (processo morto ou congelado), outro disparo assume
+com um novo `owner`; o processo antigo, se voltar, percebe na renovação
+seguinte e para antes de enviar mais relatórios.
+
+O processamento roda depois da resposta 202, então no Cloud Run o serviço
+precisa de CPU sempre alocada (`--no-cpu-throttling`); com CPU só durante
+requests ele é estrangulado ou encerrado. Em qualquer caso, o cron
+(`.github/workflows/weekly_cron.yml`) consulta o checkpoint e dispara de novo
+até `status == completed`, o que retoma uma execução interrompida.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app.core.database import get_db
+from app.core.logger import get_logger
+from app.services import ai_service
+from app.services import transaction as transaction_service
+from app.services.email_service import email_service
+from app.services.notification_service import notification_service
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter
+
+logger = get_logger(__name__)
+
+RUNS_COLLECTION = "weekly_report_runs"
+WEEKLY_REPORT_CONCURRENCY = int(os.getenv("WEEKLY_REPORT_CONCURRENCY", "8"))
+USERS_PAGE_SIZE = 200
+RUN_LEASE_SECONDS = 300
+RUN_HEARTBEAT_SECONDS = 60
+
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+
+DEFAULT_INSIGHT = (
+    "Continue focado em seus objetivos financeiros! "
+    "A consistência é o segredo do sucesso."
+)
+
+
+def current_run_id(now: Optional[datetime] = None) -> str:
+    """Semana ISO da execução, ex: '2026-W42'."""
+    year, week, _ = (now or datetime.now(timezone.utc)).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _brl(value: float) -> str:
+    return f"{value:.2f}".replace(".", ",")
+
+
+class _StageTimer:
+    """Soma o tempo gasto em cada etapa (segundos) entre dois checkpoints."""
+
+    def __init__(self):
+        self.totals = Counter()
+
+    def stage(self, name: str):
+        return _Stage(self.totals, name)
+
+    def take(self) -> Counter:
+        totals, self.totals = self.totals, Counter()
+        return totals
+
+
+class _Stage:
+    def __init__(self, totals: Counter, name: str):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.totals[self.name] += time.perf_counter() - self.started
+
+
+@firestore.transactional
+def _claim_in_transaction(transaction, ref, run_id: str, now: datetime):
+    """
+    Assume a execução `run_id`. Retorna (assumiu?, dados do checkpoint).
+    Não assume se já terminou ou se outro processo a atualizou há pouco.
+    """
+    snap = ref.get(transaction=transaction)
+    data = snap.to_dict() if snap.exists else None
+
+    if data:
+        if data.get("status") == STATUS_COMPLETED:
+            return False, data
+        updated_at = data.get("updated_at")
+        lease_cutoff = now - timedelta(seconds=RUN_LEASE_SECONDS)
+        if updated_at and updated_at > lease_cutoff:
+            return False, data
+        owner = uuid.uuid4().hex
+        transaction.update(ref, {"updated_at": now, "owner": owner})
+        return True, {**data, "updated_at": now, "owner": owner}
+
+    data = {
+        "run_id": run_id,
+        "status": STATUS_RUNNING,
+        "owner": uuid.uuid4().hex,
+        "cursor": None,
+        "pages": 0,
+        "sent": 0,
+        "skipped": 0,
+        "failed": 0,
+        "stage_seconds": {},
+        "started_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+    transaction.set(ref, data)
+    return True, data
+
+
+def claim_run(run_id: str):
+    """(assumiu?, checkpoint) da execução, criando o checkpoint se preciso."""
+    db = get_db()
+    ref = db.collection(RUNS_COLLECTION).document(run_id)
+    return _claim_in_transaction(
+        db.transaction(), ref, run_id, datetime.now(timezone.utc)
+    )
+
+
+@firestore.transactional
+def _renew_in_transaction(transaction, ref, owner: str, now: datetime) -> bool:
+    """Renova a concessão; False se outro processo assumiu a execução."""
+    snap = ref.get(transaction=transaction)
+    data = (snap.to_dict() if snap.exists else None) or {}
+    if data.get("owner") != owner or data.get("status") != STATUS_RUNNING:
+        return False
+    transaction.update(ref, {"updated_at": now})
+    return True
+
+
+def renew_run(ref, owner: str) -> bool:
+    return _renew_in_transaction(
+        get_db().transaction(), ref, owner, datetime.now(timezone.utc)
+    )
+
+
+async def _heartbeat(ref, owner: str, lost: asyncio.Event):
+    """Renova a concessão periodicamente até perdê-la (ou ser cancelado)."""
+    while True:
+        await asyncio.sleep(RUN_HEARTBEAT_SECONDS)
+        try:
+            renewed = await asyncio.to_thread(renew_run, ref, owner)
+        except Exception as e:
+            # Falha transitória: tenta de novo no próximo ciclo; a concessão
+            # só expira depois de RUN_LEASE_SECONDS
+            logger.warning("Falha ao renovar relatório semanal: %s", e)
+            continue
+        if not renewed:
+            logger.warning("Relatório semanal assumido por outro processo.")
+            lost.set()
+            return
+
+
+def get_run(run_id: str) -> Optional[dict]:
+    snap = get_db().collection(RUNS_COLLECTION).document(run_id).get()
+    return snap.to_dict() if snap.exists else None
+
+
+def _users_page(db, cursor: Optional[str], page_size: int) -> list:
+    query = db.collection("users").order_by("__name__").limit(page_size)
+    if cursor:
+        query = query.start_after({"__name__": cursor})
+    return list(query.stream())
+
+
+def _week_summary(user_id: str, start_date: datetime, end_date: datetime):
+    transactions = transaction_service.list_transactions(
+        user_id=user_id, start_date=start_date, end_date=end_date, limit=100
+    )
+
+    income = 0.0
+    expense = 0.0
+    top_expenses = []
+    category_totals = {}
+    for t in transactions:
+        if t.type == "expense":
+            expense += t.amount
+            top_expenses.append(t)
+            cat_name = t.category.name if t.category else "Outros"
+            category_totals[cat_name] = category_totals.get(cat_name, 0) + t.amount
+        elif t.type == "income":
+            income += t.amount
+
+    top_expenses.sort(key=lambda x: x.amount, reverse=True)
+    sorted_categories = sorted(
+        category_totals.items(), key=lambda x: x[1], reverse=True
+    )
+    return income, expense, top_expenses[:5], sorted_categories
+
+
+def _total_balance(db, user_id: str) -> float:
+    accounts = (
+        db.collection("accounts")
+        .where(filter=FieldFilter("user_id", "==", user_id))
+        .stream()
+    )
+    return sum(acc.to_dict().get("balance", 0) for acc in accounts)
+
+
+async def send_user_report(
+    db,
+    user_id: str,
+    user_data: dict,
+    start_date: datetime,
+    end_date: datetime,
+    timer: _StageTimer,
+    mailer=None,
+) -> bool:
+    """Monta e envia o relatório de um usuário; False se não houve movimentação."""
+    email = user_data.get("email")
+    name = user_data.get("name", "Usuário")
+
+    # 1. Transações da semana, totais e categorias
+    with timer.stage("transactions"):
+        income, expense, top_expenses, sorted_categories = await asyncio.to_thread(
+            _week_summary, user_id, start_date, end_date
+        )
+    if not (income > 0 or expense > 0):  # Só envia se teve movimentação
+        return False
+
+    # 2. Saldo atual (total)
+    with timer.stage("accounts"):
+        total_balance = await asyncio.to_thread(_total_balance, db, user_id)
+
+    # 3. Insights de IA
+    period_str = f"{start_date.strftime('%d %b')} - {end_date.strftime('%d %b')}"
+    insight_data = {
+        "income": income,
+        "expense": expense,
+        "balance": total_balance,
+        "top_categories": [
+            {"name": cat, "amount": amt} for cat, amt in sorted_categories[:3]
+        ],
+        "period": period_str,
+    }
+    with timer.stage("insight"):
+        try:
+            ai_insight = await ai_service.generate_weekly_insights_async(
+                user_id, insight_data
+            )
+        except Exception as e:
+            logger.error("Weekly Insights Error for user %s: %s", user_id, e)
+            ai_insight = DEFAULT_INSIGHT
+
+    report_data = {
+        "period": period_str,
+        "income_total": _brl(income),
+        "expense_total": _brl(expense),
+        "balance": _brl(total_balance),
+        "top_expenses": [
+            {"description": t.description, "amount": _brl(t.amount)}
+            for t in top_expenses
+        ],
+        "category_breakdown": [
+            {"name": cat, "amount": _brl(amt)} for cat, amt in sorted_categories[:5]
+        ],
+        "ai_insight": ai_insight,
+        "alerts": [],
+    }
+    if expense > income:
+        report_data["alerts"].append(
+            "⚠️ Seus gastos superaram seus ganhos esta semana."
+        )
+    if total_balance < 0:
+        report_data["alerts"].append("⚠️ Sua conta está no vermelho.")
+
+    # 4. E-mail
+    with timer.stage("email"):
+        await email_service.send_weekly_report(email, name, report_data, mailer=mailer)
+
+    # 5. Push
+    fcm_tokens = user_data.get("fcm_tokens", [])
+    if fcm_tokens and isinstance(fcm_tokens, list):
+        with timer.stage("push"):
+            await asyncio.to_thread(
+                notification_service.send_multicast,
+                tokens=fcm_tokens,
+                title="📊 Resumo Semanal Pronto",
+                body=f"Seu saldo da semana é R$ {report_data['balance']}. Toque para ver detalhes.",
+                data={"url": "/dashboard"},
+            )
+    return True
+
+
+async def _process_page(
+    db,
+    run_id: str,
+    users: list,
+    start_date,
+    end_date,
+    timer,
+    mailer,
+    concurrency,
+    lost: asyncio.Event,
+) -> Counter:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(user_doc) -> str:
+        user_data = user_doc.to_dict() or {}
+        if not user_data.get("email"):
+            return "skipped"
+        if user_data.get("last_weekly_report_run") == run_id:
+            return "skipped"  # já atendido antes de uma retomada
+
+        async with semaphore:
+            if lost.is_set():
+                return "aborted"  # outro processo assumiu a página
+            try:
+                sent = await send_user_report(
+                    db, user_doc.id, user_data, start_date, end_date, timer, mailer
+                )
+            except Exception as e:
+                logger.error(
+                    "Erro ao processar relatório para %s: %s", user_data["email"], e
+                )
+                return "failed"
+
+            user_ref = db.collection("users").document(user_doc.id)
+            await asyncio.to_thread(user_ref.update, {"last_weekly_report_run": run_id})
+            return "sent" if sent else "skipped"
+
+    return Counter(await asyncio.gather(*(run(user_doc) for user_doc in users)))
+
+
+def _checkpoint(ref, cursor: Optional[str], outcome: Counter, stage_seconds: Counter):
+    update = {
+        "cursor": cursor,
+        "pages": firestore.Increment(1),
+        "updated_at": datetime.now(timezone.utc),
+    }
+    for key in ("sent", "skipped", "failed"):
+        if outcome.get(key):
+            update[key] = firestore.Increment(outcome[key])
+    for stage, seconds in stage_seconds.items():
+        update[f"stage_seconds.{stage}"] = firestore.Increment(round(seconds, 3))
+    ref.update(update)
+
+
+async def process_weekly_reports(
+    run_id: Optional[str] = None,
+    checkpoint: Optional[dict] = None,
+    concurrency: int = WEEKLY_REPORT_CONCURRENCY,
+    page_size: int = USERS_PAGE_SIZE,
+) -> Optional[dict]:
+    """
+    Processa (ou retoma) a execução `run_id` até o fim dos usuários. Sem
+    `checkpoint`, assume a execução antes; retorna None se ela já terminou
+    ou está com outro processo. Retorna os contadores desta chamada.
+    """
+    run_id = run_id or current_run_id()
+    if checkpoint is None:
+        claimed, checkpoint = await asyncio.to_thread(claim_run, run_id)
+        if not claimed:
+            logger.info(
+                "Relatório semanal %s já está %s.", run_id, checkpoint.get("status")
+            )
+            return None
+
+    db = get_db()
+    ref = db.collection(RUNS_COLLECTION).document(run_id)
+    cursor = checkpoint.get("cursor")
+    end_date = datetime.now(timezone.utc)
+    start_date = end_date - timedelta(days=7)
+    timer = _StageTimer()
+    totals = Counter()
+    started = time.perf_counter()
+    lost = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(ref, checkpoint.get("owner"), lost))
+
+    logger.info(
+        "Iniciando relatórios semanais %s%s...",
+        run_id,
+        f" a partir de {cursor}" if cursor else "",
+    )
+    try:
+        # Os e-mails da execução saem por poucas conexões SMTP reaproveitadas
+        async with email_service.bulk() as mailer:
+            while not lost.is_set():
+                with timer.stage("users_page"):
+                    users = await asyncio.to_thread(_users_page, db, cursor, page_size)
+                if not users:
+                    break
+
+                outcome = await _process_page(
+                    db,
+                    run_id,
+                    users,
+                    start_date,
+                    end_date,
+                    timer,
+                    mailer,
+                    concurrency,
+                    lost,
+                )
+                if lost.is_set():
+                    break  # checkpoint e cursor agora são do novo dono
+                cursor = users[-1].id
+                await asyncio.to_thread(_checkpoint, ref, cursor, outcome, timer.take())
+                totals.update(outcome)
+
+                if len(users) < page_size:
+                    break
+    finally:
+        heartbeat.cancel()
+
+    if lost.is_set():
+        logger.warning("Relatório semanal %s interrompido: lease perdido.", run_id)
+        return None
+
+    await asyncio.to_thread(
+        ref.update,
+        {
+            "status": STATUS_COMPLETED,
+            "finished_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+        },
+    )
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Relatórios semanais %s: %d enviados, %d ignorados, %d falhas em %.1fs.",
+        run_id,
+        totals["sent"],
+        totals["skipped"],
+        totals["failed"],
+        elapsed,
+    )
+    return dict(totals)
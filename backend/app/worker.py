@@ -1,8 +1,33 @@
+"""
+Worker de recorrências (Cloud Run job, diário).
+
+1. Gera as transações das recorrências vencidas. Só lê as recorrências com
+   `next_due_at <= hoje` (campo mantido por `recurrence_service` e por este
+   worker), agrupadas por usuário e processadas em paralelo, com no máximo
+   RECURRENCE_WORKER_CONCURRENCY usuários ao mesmo tempo. Cada ocorrência é
+   gravada com ID determinístico (recorrência + vencimento) no mesmo batch
+   que avança `last_processed_at`/`next_due_at`: repetir uma execução
+   interrompida, ou rodar fatias em paralelo, não duplica transações.
+2. Efetua os pagamentos automáticos vencidos: consulta só `status=PENDING,
+   is_auto_pay, date <= hoje` (índice composto) e paga por usuário em
+   batches, com um único incremento de saldo por conta.
+
+Com `--shard i/n` (ou CLOUD_RUN_TASK_INDEX/CLOUD_RUN_TASK_COUNT num job com
+várias tasks) cada execução cuida só dos usuários da fatia i de n, com n até
+SHARD_BUCKETS. Cada fatia é um intervalo de `shard_bucket` (hash do usuário,
+gravado nas recorrências), filtrado na consulta: uma task só lê as
+recorrências da sua fatia. Os pagamentos automáticos (poucos documentos por
+dia, sem esse campo nas transações) são filtrados por fatia em memória.
+"""
+
+import argparse
 import asyncio
-from datetime import datetime, timezone
+import os
+import time
+from datetime import date, datetime, timezone
+from typing import Dict, List, Tuple
 
 from app.core.database import get_db
-from app.core.date_utils import calculate_next_due_date
 from app.core.logger import get_logger
 from app.schemas.transaction import (
     PaymentMethod,
@@ -10,234 +35,332 @@ from app.schemas.transaction import (
     TransactionStatus,
     TransactionType,
 )
+from app.services import recurrence as recurrence_service
 from app.services import transaction as transaction_service
+from google.cloud.firestore_v1 import FieldFilter
 
 logger = get_logger(__name__)
 
+RECURRENCE_CONCURRENCY = int(os.getenv("RECURRENCE_WORKER_CONCURRENCY", "8"))
+# Ocorrências atrasadas geradas por recorrência numa execução (worker parado)
+MAX_CATCH_UP = 12
+
 
 # Logger centralizado já importado acima
 def log(msg):
     logger.info(msg)
 
 
-async def process_recurrences():
-    log("🤖 Iniciando o Matador de Preguiça (Recurrence Worker)...")
-    db = get_db()
-
-    # 1. Buscar todas as recorrências ativas
-    recurrences_ref = db.collection("recurrences").where("active", "==", True)
-    active_recurrences = recurrences_ref.stream()
-
-    count = 0
-    processed = 0
-
-    for doc in active_recurrences:
-        count += 1
-        rec_data = doc.to_dict()
-        rec_id = doc.id
-        user_id = rec_data.get("user_id")
-
-        if not user_id:
-            continue
+def parse_shard(value: str) -> Tuple[int, int]:
+    """'i/n' -> (i, n), com 0 <= i < n."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("use o formato i/n (ex: 0/4)") from None
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("esperado 0 <= i < n")
+    if count > recurrence_service.SHARD_BUCKETS:
+        raise argparse.ArgumentTypeError(
+            f"no máximo {recurrence_service.SHARD_BUCKETS} fatias"
+        )
+    return index, count
+
+
+def default_shard() -> Tuple[int, int]:
+    """
+    Fatia do Cloud Run job (uma por task) ou tudo numa execução só. Passa pelas
+    mesmas checagens do --shard: mais tasks que SHARD_BUCKETS deixariam fatias
+    sem bucket (e um filtro `in []` que o Firestore rejeita).
+    """
+    index = os.getenv("CLOUD_RUN_TASK_INDEX", "0")
+    count = os.getenv("CLOUD_RUN_TASK_COUNT", "1")
+    return parse_shard(f"{index}/{count}")
+
+
+def shard_buckets(shard: Tuple[int, int]) -> List[int]:
+    """Valores de `shard_bucket` da fatia i de n (intervalo contíguo)."""
+    index, count = shard
+    total = recurrence_service.SHARD_BUCKETS
+    return [b for b in range(total) if b * count // total == index]
+
+
+def in_shard(user_id: str, shard: Tuple[int, int]) -> bool:
+    if shard[1] <= 1:
+        return True
+    return recurrence_service.shard_bucket(user_id) in shard_buckets(shard)
+
+
+def _is_skipped(rec_data: dict, due_date: date) -> bool:
+    for sd in rec_data.get("skipped_dates", []):
+        if isinstance(sd, str):
+            try:
+                if "T" in sd:
+                    sd_date = datetime.fromisoformat(sd.replace("Z", "+00:00")).date()
+                else:
+                    sd_date = datetime.fromisoformat(sd).date()
+            except ValueError:
+                continue
+        elif isinstance(sd, datetime):
+            sd_date = sd.date()
+        else:
+            sd_date = sd
+
+        if sd_date == due_date:
+            return True
+    return False
+
+
+def _build_transaction(
+    rec_id: str, rec_data: dict, next_due: datetime
+) -> TransactionCreate:
+    # Criar Transação SEMPRE como PENDENTE inicialmente
+    # O processamento de auto-pay será feito na etapa 2
+
+    # Recorrência agora pode ter TYPE (Default: EXPENSE)
+    rec_type = rec_data.get("type", TransactionType.EXPENSE)
+    title = f"{rec_data.get('name')} ({next_due.strftime('%m/%Y')})"
+    description = title
+
+    # Lógica Especial para TRANSFER (Pagamento de Fatura)
+    if rec_type == TransactionType.TRANSFER and rec_data.get("credit_card_id"):
+        cc_id = rec_data.get("credit_card_id")
+        # Gerar Chave de Referência para evitar duplicidade
+        # REF:{card_id}:{month}:{year}
+        # next_due é a data de vencimento da recorrência.
+        # Assumimos que a fatura refere-se ao mês de vencimento OU anterior.
+        # Simplificação: Usar mês/ano do vencimento da recorrência como referência da fatura.
+        ref_key = f"REF:{cc_id}:{next_due.month}:{next_due.year}"
+        description = f"{description} | {ref_key}"
+
+    new_transaction = TransactionCreate(
+        title=title,
+        description=description,
+        amount=rec_data.get("amount"),
+        date=next_due,
+        type=rec_type,
+        payment_method=PaymentMethod.OTHER,
+        category_id=rec_data.get("category_id"),
+        account_id=rec_data.get("account_id"),
+        recurrence_id=rec_id,
+        status=TransactionStatus.PENDING,
+        is_auto_pay=rec_data.get("auto_pay", False),
+    )
 
-        # Calcular Próximo Vencimento
-        last_processed = rec_data.get("last_processed_at")
-        due_day = rec_data.get("due_day", 1)
-        periodicity = rec_data.get("periodicity")
+    if rec_data.get("payment_method_id"):
+        new_transaction.payment_method = rec_data.get("payment_method_id")
 
-        today = datetime.now(timezone.utc).replace(tzinfo=None)
+    if rec_data.get("credit_card_id"):
+        new_transaction.credit_card_id = rec_data.get("credit_card_id")
 
-        # Normalizando datas
-        if last_processed:
-            if isinstance(last_processed, str):
-                last_processed = datetime.fromisoformat(
-                    last_processed.replace("Z", "+00:00")
-                )
-            if last_processed.tzinfo:
-                last_processed = last_processed.replace(tzinfo=None)
+    return new_transaction
 
-            next_due = calculate_next_due_date(last_processed, periodicity)
 
-            try:
-                next_due = next_due.replace(day=due_day)
-            except ValueError:
-                pass
+def _process_recurrence(db, rec_id: str, rec_data: dict, today: datetime) -> int:
+    """Gera as ocorrências vencidas de uma recorrência; retorna quantas gerou."""
+    user_id = rec_data["user_id"]
+    rec_ref = db.collection("recurrences").document(rec_id)
+    next_due = recurrence_service._as_naive_utc(rec_data.get("next_due_at"))
+    generated = 0
 
-        else:
-            # Primeira vez
-            next_due = today.replace(day=due_day)
-            if next_due > today:
-                continue
+    for _ in range(MAX_CATCH_UP):
+        if next_due is None or next_due > today:
+            break
 
-        # VERIFICAÇÃO: Hoje >= Data Próximo Vencimento
-        if today >= next_due:
-            # Check if this date is skipped
-            skipped_dates = rec_data.get("skipped_dates", [])
-            # Convert skipped_dates strings to date objects if needed
-            is_skipped = False
-            next_due_date = next_due.date()
-
-            for sd in skipped_dates:
-                if isinstance(sd, str):
-                    try:
-                        if "T" in sd:
-                            sd_date = datetime.fromisoformat(
-                                sd.replace("Z", "+00:00")
-                            ).date()
-                        else:
-                            sd_date = datetime.fromisoformat(sd).date()
-                    except:
-                        continue
-                else:
-                    sd_date = sd
-
-                if sd_date == next_due_date:
-                    is_skipped = True
-                    break
-
-            if is_skipped:
-                log(
-                    f"⏭️ Pulando ocorrência {rec_data.get('name')} ({next_due.strftime('%d/%m/%Y')}) - Usuário solicitou exclusão."
-                )
-                # Update last_processed_at so it moves to next period
-                db.collection("recurrences").document(rec_id).update(
-                    {"last_processed_at": next_due}
-                )
-                continue
+        due = next_due
+        rec_data["last_processed_at"] = due
+        next_due = recurrence_service.compute_next_due_at(rec_data, today)
+        advance = {"last_processed_at": due, "next_due_at": next_due}
 
+        if _is_skipped(rec_data, due.date()):
             log(
-                f"🔄 Processando recorrência {rec_data.get('name')} para User {user_id}"
+                f"⏭️ Pulando ocorrência {rec_data.get('name')} ({due.strftime('%d/%m/%Y')}) - Usuário solicitou exclusão."
             )
+            rec_ref.update(advance)
+            continue
 
-            # Criar Transação SEMPRE como PENDENTE inicialmente
-            # O processamento de auto-pay será feito na etapa 2
-
-            # Recorrência agora pode ter TYPE (Default: EXPENSE)
-            rec_type = rec_data.get("type", TransactionType.EXPENSE)
-            description = f"{rec_data.get('name')} ({next_due.strftime('%m/%Y')})"
-
-            # Lógica Especial para TRANSFER (Pagamento de Fatura)
-            if rec_type == TransactionType.TRANSFER and rec_data.get("credit_card_id"):
-                cc_id = rec_data.get("credit_card_id")
-                # Gerar Chave de Referência para evitar duplicidade
-                # REF:{card_id}:{month}:{year}
-                # next_due é a data de vencimento da recorrência.
-                # Assumimos que a fatura refere-se ao mês de vencimento OU anterior.
-                # Simplificação: Usar mês/ano do vencimento da recorrência como referência da fatura.
-                ref_key = f"REF:{cc_id}:{next_due.month}:{next_due.year}"
-                description = f"{description} | {ref_key}"
-
-            new_transaction = TransactionCreate(
-                description=description,
-                amount=rec_data.get("amount"),
-                date=next_due,
-                type=rec_type,
-                payment_method=PaymentMethod.OTHER,
-                category_id=rec_data.get("category_id"),
-                account_id=rec_data.get("account_id"),
-                recurrence_id=rec_id,
-                status=TransactionStatus.PENDING,
-                is_auto_pay=rec_data.get("auto_pay", False),
-            )
+        log(f"🔄 Processando recorrência {rec_data.get('name')} para User {user_id}")
+        # Transação e avanço da recorrência no mesmo batch, com ID do vencimento:
+        # uma retentativa (ou outra fatia) não duplica a ocorrência
+        created = transaction_service.create_transaction_once(
+            _build_transaction(rec_id, rec_data, due),
+            user_id,
+            recurrence_service.occurrence_id(rec_id, due),
+            extra_updates=[(rec_ref, advance)],
+        )
+        if created:
+            generated += 1
+        else:
+            # Já gerada numa execução anterior: só falta avançar a recorrência
+            rec_ref.update(advance)
 
-            if rec_data.get("payment_method_id"):
-                new_transaction.payment_method = rec_data.get("payment_method_id")
+    return generated
 
-            if rec_data.get("credit_card_id"):
-                new_transaction.credit_card_id = rec_data.get("credit_card_id")
 
-            try:
-                transaction_service.create_transaction(new_transaction, user_id)
+def _process_user(db, user_id: str, recurrences: List[tuple], today: datetime) -> int:
+    processed = 0
+    for rec_id, rec_data in recurrences:
+        try:
+            processed += _process_recurrence(db, rec_id, rec_data, today)
+        except Exception as e:
+            log(f"❌ Erro ao processar {rec_id}: {e}")
+    return processed
+
+
+def _due_recurrences_by_user(
+    db, today: datetime, shard: Tuple[int, int]
+) -> Dict[str, List[tuple]]:
+    """
+    Recorrências vencidas (next_due_at <= hoje) da fatia, por usuário. Com
+    mais de uma fatia, filtra `shard_bucket in [...]` na consulta (índice
+    composto shard_bucket + next_due_at).
+    """
+    query = db.collection("recurrences")
+    if shard[1] > 1:
+        query = query.where(
+            filter=FieldFilter("shard_bucket", "in", shard_buckets(shard))
+        )
+    query = query.where(filter=FieldFilter("next_due_at", "<=", today))
+
+    by_user: Dict[str, List[tuple]] = {}
+    for doc in query.stream():
+        rec_data = doc.to_dict()
+        user_id = rec_data.get("user_id")
+        if not user_id or not rec_data.get("active", True):
+            continue
+        by_user.setdefault(user_id, []).append((doc.id, rec_data))
+    return by_user
 
-                # Atualizar Recorrência
-                db.collection("recurrences").document(rec_id).update(
-                    {"last_processed_at": datetime.now()}
-                )
-                processed += 1
-            except Exception as e:
-                log(f"❌ Erro ao processar {rec_id}: {e}")
 
-    # 2. Processar Pagamentos Automáticos Pendentes
-    log("🔄 Verificando pagamentos automáticos pendentes...")
+async def _fan_out(by_user: Dict[str, list], work, concurrency: int) -> int:
+    """Roda `work(user_id, itens)` em threads, até `concurrency` usuários por vez."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
 
-    # Query: Status=PENDING, is_auto_pay=True, date <= Today
-    # Nota: Firestore requer índice composto para múltiplas igualdades e desigualdades.
-    # Vamos filtrar por status e auto_pay, e verificar data em memória se o volume for baixo.
-    # Ou melhor: filtrar por status=PENDING e iterar.
+    async def run(user_id, items):
+        async with semaphore:
+            return await asyncio.to_thread(work, user_id, items)
 
-    pending_query = (
-        db.collection("transactions")
-        .where("status", "==", TransactionStatus.PENDING)
-        .where("is_auto_pay", "==", True)
-        .stream()
+    results = await asyncio.gather(
+        *(run(user_id, items) for user_id, items in by_user.items())
     )
+    return sum(results)
 
-    auto_pay_count = 0
-    today_naive = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-
-    for t in pending_query:
-        t_data = t.to_dict()
-        t_id = t.id
-        t_user_id = t_data.get("user_id")
-        t_date = t_data.get("date")
-
-        if not t_user_id:
-            continue
-
-        # Normaliza data da transação
-        if isinstance(t_date, str):
-            try:
-                t_date = datetime.fromisoformat(t_date.replace("Z", "+00:00"))
-            except:
-                continue
 
-        if t_date.tzinfo:
-            t_date = t_date.replace(tzinfo=None)
-
-        # Zera hora para comparar apenas dia
-        t_date = t_date.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        if t_date <= today_naive:
-            log(f"💰 Efetuando pagamento automático: {t_data.get('description')}")
+async def generate_due_recurrences(
+    shard: Tuple[int, int] = (0, 1), concurrency: int = RECURRENCE_CONCURRENCY
+) -> int:
+    db = get_db()
+    today = datetime.now(timezone.utc).replace(tzinfo=None)
 
-            # Atualiza para PAGO
-            # Precisamos usar o service update_transaction para garantir que o saldo seja atualizado!
+    by_user = await asyncio.to_thread(_due_recurrences_by_user, db, today, shard)
+    return await _fan_out(
+        by_user,
+        lambda user_id, recurrences: _process_user(db, user_id, recurrences, today),
+        concurrency,
+    )
 
-            # Recria o objeto TransactionCreate com os dados atuais + status PAGO
-            # Nota: update_transaction espera um TransactionCreate completo ou parcial?
-            # O service update_transaction faz: data = transaction_in.model_dump()... doc_ref.set(data)
-            # Ele faz SET, ou seja, substitui tudo! Precisamos passar todos os dados.
 
-            # Melhor abordagem: Ler, alterar status, chamar update.
+def _due_auto_payments_by_user(
+    db, end_of_day: datetime, shard: Tuple[int, int]
+) -> Dict[str, list]:
+    """
+    Pagamentos automáticos vencidos (status=PENDING, is_auto_pay, date <= hoje)
+    da fatia, por usuário. Usa o índice composto (status, is_auto_pay, date).
+    """
+    pending = (
+        db.collection("transactions")
+        .where(filter=FieldFilter("status", "==", TransactionStatus.PENDING.value))
+        .where(filter=FieldFilter("is_auto_pay", "==", True))
+    )
+    snaps = list(pending.where(filter=FieldFilter("date", "<=", end_of_day)).stream())
+
+    # `date` gravado como string ISO (edições antigas, antes do backfill) não
+    # casa com o intervalo de Timestamp. Strings ordenam depois de Timestamps,
+    # então `>= ""` traz só essas; o vencimento é conferido aqui.
+    for snap in pending.where(filter=FieldFilter("date", ">=", "")).stream():
+        due = recurrence_service._as_naive_utc(snap.to_dict().get("date"))
+        if due is not None and due <= end_of_day:
+            snaps.append(snap)
+
+    by_user: Dict[str, list] = {}
+    for snap in snaps:
+        user_id = snap.to_dict().get("user_id")
+        if user_id and in_shard(user_id, shard):
+            by_user.setdefault(user_id, []).append(snap)
+    return by_user
+
+
+def _pay_user(user_id: str, snapshots: list) -> int:
+    try:
+        paid = transaction_service.pay_transactions(user_id, snapshots)
+    except Exception as e:
+        log(f"❌ Erro ao pagar transações de {user_id}: {e}")
+        return 0
+    log(f"💰 Pagamentos automáticos de {user_id}: {paid}/{len(snapshots)}")
+    return paid
+
+
+async def process_auto_payments(
+    shard: Tuple[int, int] = (0, 1), concurrency: int = RECURRENCE_CONCURRENCY
+) -> int:
+    db = get_db()
+    end_of_day = datetime.now(timezone.utc).replace(
+        hour=23, minute=59, second=59, microsecond=999999, tzinfo=None
+    )
 
-            try:
-                # Constrói objeto de atualização
-                # Precisamos mapear os campos do dict para o schema
-                # Isso pode ser chato se o schema for rigoroso.
-                # Vamos tentar instanciar TransactionCreate com **t_data
+    by_user = await asyncio.to_thread(_due_auto_payments_by_user, db, end_of_day, shard)
+    return await _fan_out(by_user, _pay_user, concurrency)
 
-                t_data["status"] = TransactionStatus.PAID
-                t_data["payment_date"] = datetime.now()
 
-                # Remove campos que não estão no TransactionCreate (ex: id, created_at se houver)
-                t_data.pop("id", None)
-                t_data.pop("user_id", None)  # O service recoloca
+def _throughput(label: str, count: int, elapsed: float) -> str:
+    rate = count / elapsed if elapsed > 0 else 0.0
+    return f"{label}: {count} em {elapsed:.1f}s ({rate:.1f}/s)"
 
-                # Converte strings de enum de volta se necessário, mas Pydantic deve lidar se forem strings válidas.
 
-                update_payload = TransactionCreate(**t_data)
+async def process_recurrences(
+    shard: Tuple[int, int] = (0, 1), concurrency: int = RECURRENCE_CONCURRENCY
+):
+    index, count = shard
+    log(f"🤖 Iniciando o Matador de Preguiça (Recurrence Worker) {index}/{count}...")
+    started = time.perf_counter()
 
-                transaction_service.update_transaction(t_id, update_payload, t_user_id)
-                auto_pay_count += 1
+    # 1. Gerar as ocorrências vencidas
+    processed = await generate_due_recurrences(shard, concurrency)
+    generated_at = time.perf_counter()
+    log(_throughput("🔄 Recorrências geradas", processed, generated_at - started))
 
-            except Exception as e:
-                log(f"❌ Erro ao pagar {t_id}: {e}")
+    # 2. Processar Pagamentos Automáticos Pendentes
+    log("🔄 Verificando pagamentos automáticos pendentes...")
+    auto_pay_count = await process_auto_payments(shard, concurrency)
+    finished = time.perf_counter()
+    elapsed = finished - generated_at
+    log(_throughput("💰 Pagamentos automáticos", auto_pay_count, elapsed))
 
     log(
-        f"✅ Finalizado. Recorrências geradas: {processed}. Pagamentos automáticos: {auto_pay_count}."
+        f"✅ Finalizado em {finished - started:.1f}s. Recorrências geradas: {processed}. Pagamentos automáticos: {auto_pay_count}."
     )
 
 
 if __name__ == "__main__":
-    # Para rodar localmente
-    asyncio.run(process_recurrences())
+    parser = argparse.ArgumentParser(
+        description="Gera as transações das recorrências vencidas e efetua os pagamentos automáticos"
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="i/n: processa só os usuários da fatia i de n (ex: 0/4)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=RECURRENCE_CONCURRENCY,
+        help="Usuários processados em paralelo",
+    )
+    args = parser.parse_args()
+
+    try:
+        shard = args.shard or default_shard()
+    except argparse.ArgumentTypeError as e:
+        parser.error(f"CLOUD_RUN_TASK_INDEX/CLOUD_RUN_TASK_COUNT inválidos: {e}")
+
+    asyncio.run(process_recurrences(shard, args.concurrency))
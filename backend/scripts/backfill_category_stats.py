@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+
+# Ensure we can import app modules - Adding project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+try:
+    from app.core.database import get_db
+    from app.services import category_stats
+except ImportError as e:
+    print(f"Error importing modules: {e}")
+    print(
+        "Please run this script using 'uv run scripts/backfill_category_stats.py' from the backend directory."
+    )
+    sys.exit(1)
+
+
+def backfill(user_ids):
+    print("🚀 Backfilling category stats")
+
+    total_txs = 0
+    total_cats = 0
+
+    for user_id in user_ids:
+        try:
+            tx_count, cat_count = category_stats.rebuild_user_stats(user_id)
+        except Exception as e:
+            print(f"  ❌ {user_id}: {e}")
+            continue
+
+        print(f"  ✅ {user_id}: {tx_count} expenses -> {cat_count} categories")
+        total_txs += tx_count
+        total_cats += cat_count
+
+    print("\n🎉 Backfill Complete!")
+    print(f"Users: {len(user_ids)} | Expenses: {total_txs} | Categories: {total_cats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Seed the category_stats rolling statistics (anomaly detection) from expense history"
+    )
+    parser.add_argument(
+        "uids", nargs="*", help="Firebase UIDs to backfill (default: every user)"
+    )
+
+    args = parser.parse_args()
+
+    uids = args.uids
+    if not uids:
+        uids = [doc.id for doc in get_db().collection("users").stream()]
+
+    backfill(uids)
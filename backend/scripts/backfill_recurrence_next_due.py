@@ -0,0 +1,22 @@
+import os
+import sys
+
+# Ensure we can import app modules - Adding project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+try:
+    from app.services import recurrence as recurrence_service
+except ImportError as e:
+    print(f"Error importing modules: {e}")
+    print(
+        "Please run this script using 'uv run scripts/backfill_recurrence_next_due.py' from the backend directory."
+    )
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    # O worker só consulta recorrências com next_due_at; rodar uma vez após o deploy
+    print("🚀 Backfilling recurrences.next_due_at / shard_bucket")
+    updated = recurrence_service.backfill_next_due_at()
+    print(f"🎉 Backfill Complete! Recurrences updated: {updated}")
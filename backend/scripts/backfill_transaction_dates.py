@@ -0,0 +1,22 @@
+import os
+import sys
+
+# Ensure we can import app modules - Adding project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+try:
+    from app.services import transaction as transaction_service
+except ImportError as e:
+    print(f"Error importing modules: {e}")
+    print(
+        "Please run this script using 'uv run scripts/backfill_transaction_dates.py' from the backend directory."
+    )
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Datas em string ISO ficam fora das consultas por intervalo de data
+    print("🚀 Backfilling transactions.date/payment_date (string -> Timestamp)")
+    updated = transaction_service.backfill_string_dates()
+    print(f"🎉 Backfill Complete! Fields updated: {updated}")
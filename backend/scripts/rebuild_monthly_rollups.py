@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+
+# Ensure we can import app modules - Adding project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+try:
+    from app.core.database import get_db
+    from app.services import monthly_rollup
+except ImportError as e:
+    print(f"Error importing modules: {e}")
+    print(
+        "Please run this script using 'uv run scripts/rebuild_monthly_rollups.py' from the backend directory."
+    )
+    sys.exit(1)
+
+
+def rebuild(user_ids):
+    print("🚀 Rebuilding monthly rollups")
+
+    total_txs = 0
+    total_months = 0
+
+    for user_id in user_ids:
+        try:
+            tx_count, month_count = monthly_rollup.rebuild_user_rollups(user_id)
+        except Exception as e:
+            print(f"  ❌ {user_id}: {e}")
+            continue
+
+        print(f"  ✅ {user_id}: {tx_count} transactions -> {month_count} months")
+        total_txs += tx_count
+        total_months += month_count
+
+    print("\n🎉 Rebuild Complete!")
+    print(f"Users: {len(user_ids)} | Transactions: {total_txs} | Months: {total_months}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild/backfill the monthly_rollups aggregates from raw transactions"
+    )
+    parser.add_argument(
+        "uids", nargs="*", help="Firebase UIDs to rebuild (default: every user)"
+    )
+
+    args = parser.parse_args()
+
+    uids = args.uids
+    if not uids:
+        uids = [doc.id for doc in get_db().collection("users").stream()]
+
+    rebuild(uids)
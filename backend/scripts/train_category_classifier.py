@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+
+# Ensure we can import app modules - Adding project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+try:
+    from app.core.database import get_db
+    from app.services import category_classifier
+except ImportError as e:
+    print(f"Error importing modules: {e}")
+    print(
+        "Please run this script using 'uv run scripts/train_category_classifier.py' from the backend directory."
+    )
+    sys.exit(1)
+
+
+def train(user_ids):
+    print("🚀 Training local category classifiers")
+
+    total_txs = 0
+    total_merchants = 0
+
+    for user_id in user_ids:
+        try:
+            tx_count, merchant_count = category_classifier.rebuild_user_model(user_id)
+        except Exception as e:
+            print(f"  ❌ {user_id}: {e}")
+            continue
+
+        print(f"  ✅ {user_id}: {tx_count} transactions -> {merchant_count} merchants")
+        total_txs += tx_count
+        total_merchants += merchant_count
+
+    print("\n🎉 Training Complete!")
+    print(f"Users: {len(user_ids)} | Transactions: {total_txs} | Merchants: {total_merchants}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train the local category classifier (category_classifiers) from categorized history"
+    )
+    parser.add_argument(
+        "uids", nargs="*", help="Firebase UIDs to train (default: every user)"
+    )
+
+    args = parser.parse_args()
+
+    uids = args.uids
+    if not uids:
+        uids = [doc.id for doc in get_db().collection("users").stream()]
+
+    train(uids)
@@ -0,0 +1,109 @@
+import asyncio
+import importlib
+import json
+from unittest.mock import MagicMock, patch
+
+from app.api.routers import import_transactions
+
+# app.services re-exporta a instância AIService com o mesmo nome do módulo
+ai_service = importlib.import_module("app.services.ai_service")
+
+
+def _snap(doc_id, data=None):
+    snap = MagicMock()
+    snap.id = doc_id
+    snap.exists = data is not None
+    snap.to_dict.return_value = data
+    return snap
+
+
+def test_classify_batch_dedupes_uses_cache_and_single_prompt():
+    db = MagicMock()
+    db.collection.return_value.document.side_effect = lambda h: MagicMock(id=h)
+
+    cached_hash = ai_service._prediction_hash("u1", "padaria")
+    db.get_all.side_effect = lambda refs: [
+        _snap(r.id, {"category_id": "cat_food"} if r.id == cached_hash else None)
+        for r in refs
+    ]
+    batch = db.batch.return_value
+
+    response = MagicMock()
+    response.text = json.dumps(
+        {
+            "items": [
+                {"index": 0, "category_id": "cat_transport"},
+                {"index": 1, "category_id": "invented_id"},
+            ]
+        }
+    )
+
+    with patch.object(ai_service, "client", MagicMock()), patch.object(
+        ai_service, "get_db", return_value=db
+    ), patch.object(
+        ai_service,
+        "_classification_context",
+        return_value=([MagicMock(id="cat_food"), MagicMock(id="cat_transport")], "C:"),
+    ), patch.object(
+        ai_service, "_call_with_retry", return_value=response
+    ) as call_mock, patch.object(
+        ai_service, "_classify_locally", return_value={"netflix.com": "cat_fun"}
+    ):
+        result = ai_service.classify_transactions_batch(
+            ["UBER *TRIP", "uber *trip ", "Padaria", "Loja X", "NETFLIX.COM"], "u1"
+        )
+
+    assert result == {
+        "netflix.com": "cat_fun",
+        "padaria": "cat_food",
+        "uber *trip": "cat_transport",
+    }
+
+    # Uma única ida ao cache e um único prompt com as 2 descrições faltantes
+    db.get_all.assert_called_once()
+    call_mock.assert_called_once()
+    prompt = call_mock.call_args.kwargs["prompt_or_parts"]
+    assert "0:'uber *trip'" in prompt and "1:'loja x'" in prompt
+
+    # Só a previsão válida vai para o cache, num batch
+    assert batch.set.call_count == 1
+    batch.commit.assert_called_once()
+
+
+def test_import_preview_classifies_off_the_event_loop(client):
+    parsed = [
+        {
+            "date": "2025-04-01",
+            "description": "Padaria",
+            "amount": -12.5,
+            "type": "expense",
+            "source": "csv",
+        }
+    ]
+    loops = []
+
+    def classify(descriptions, user_id, tier):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return {"padaria": "cat_food"}
+
+    with patch.object(
+        import_transactions, "parse_csv", return_value=parsed
+    ), patch.object(
+        import_transactions.ai_service,
+        "classify_transactions_batch",
+        side_effect=classify,
+    ), patch(
+        "app.services.user_preference.get_subscription_tier", return_value="pro"
+    ):
+        response = client.post(
+            "/api/import/preview",
+            files={"file": ("extrato.csv", b"data,desc,valor\n", "text/csv")},
+        )
+
+    assert response.status_code == 200
+    assert response.json()[0]["category_id"] == "cat_food"
+    # Rodou numa thread do pool, não no event loop
+    assert loops == [None]
@@ -0,0 +1,273 @@
+import asyncio
+import importlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from app.services import ai_gateway
+from fastapi import HTTPException
+
+# app.services re-exporta a instância AIService com o mesmo nome do módulo
+ai_service = importlib.import_module("app.services.ai_service")
+
+
+def _client(side_effect):
+    client = MagicMock()
+    client.aio.models.generate_content = AsyncMock(side_effect=side_effect)
+    return client
+
+
+def test_generate_retries_with_async_backoff():
+    ok = MagicMock(text="ok")
+    client = _client([Exception("429 RESOURCE_EXHAUSTED"), ok])
+
+    with patch.object(ai_gateway.asyncio, "sleep", AsyncMock()) as sleep_mock:
+        result = asyncio.run(ai_gateway.generate(client, "m", "prompt", tier="pro"))
+
+    assert result is ok
+    assert client.aio.models.generate_content.await_count == 2
+    sleep_mock.assert_awaited_once()
+
+
+def test_generate_does_not_retry_other_errors():
+    client = _client([ValueError("bad request")])
+
+    with pytest.raises(ValueError):
+        asyncio.run(ai_gateway.generate(client, "m", "prompt"))
+
+    assert client.aio.models.generate_content.await_count == 1
+
+
+def test_premium_call_is_not_blocked_by_saturated_free_tier():
+    release = asyncio.Event()
+
+    async def call_model(model, contents, config):
+        if contents == "free":
+            await release.wait()
+        return contents
+
+    client = MagicMock()
+    client.aio.models.generate_content = AsyncMock(side_effect=call_model)
+
+    async def scenario():
+        free_calls = [
+            asyncio.create_task(ai_gateway.generate(client, "m", "free"))
+            for _ in range(20)
+        ]
+        await asyncio.sleep(0)
+        # Free esperando a vaga do tier não ocupa vaga global
+        premium = await asyncio.wait_for(
+            ai_gateway.generate(client, "m", "premium", tier="premium"), timeout=1
+        )
+        release.set()
+        await asyncio.gather(*free_calls)
+        return premium
+
+    with patch.object(ai_gateway, "AI_MAX_CONCURRENCY", 4):
+        assert asyncio.run(scenario()) == "premium"
+
+
+def test_user_slot_rejects_excess_inflight_calls():
+    async def scenario():
+        async with ai_gateway.user_slot("u1"), ai_gateway.user_slot("u1"):
+            with pytest.raises(HTTPException) as exc:
+                async with ai_gateway.user_slot("u1"):
+                    pass
+            assert exc.value.status_code == 429
+
+            # Outros usuários não são afetados
+            async with ai_gateway.user_slot("u2"):
+                pass
+
+        # Vagas liberadas ao sair
+        async with ai_gateway.user_slot("u1"):
+            pass
+
+    with patch.object(ai_gateway, "AI_MAX_INFLIGHT_PER_USER", 2):
+        asyncio.run(scenario())
+
+
+WEEK = {
+    "income": 100.0,
+    "expense": 50.0,
+    "balance": 50.0,
+    "top_categories": [{"name": "Mercado", "amount": 30.0}],
+    "period": "09 Mar - 16 Mar",
+}
+
+
+def test_weekly_insights_sync_and_async_share_flow():
+    response = MagicMock(text=" Boa semana! ")
+    client = _client([response])
+
+    with patch.object(ai_service, "client", client), patch.object(
+        ai_service, "_call_with_retry", return_value=response
+    ) as call_mock:
+        sync_result = ai_service.generate_weekly_insights("u1", WEEK)
+        async_result = asyncio.run(
+            ai_service.generate_weekly_insights_async("u1", WEEK)
+        )
+
+    assert sync_result == async_result == "Boa semana!"
+    call_mock.assert_called_once()
+    client.aio.models.generate_content.assert_awaited_once()
+
+
+def test_async_flow_error_is_handled_inside_flow():
+    client = _client([ValueError("boom")])
+
+    with patch.object(ai_service, "client", client):
+        result = asyncio.run(ai_service.generate_weekly_insights_async("u1", WEEK))
+
+    # A exceção do modelo volta para o try/except do próprio fluxo
+    client.aio.models.generate_content.assert_awaited_once()
+    assert result.startswith("Continue focado")
+
+
+class _CountingFlight(ai_gateway.SingleFlight):
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Semaphore(0)
+
+    def _join(self, key):
+        future, leader = super()._join(key)
+        if not leader:
+            self.waiting.release()
+        return future, leader
+
+
+def test_single_flight_coalesces_threads():
+    flight = _CountingFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return "report"
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        leader = pool.submit(flight.do, "k", slow_call)
+        started.wait(timeout=5)
+        followers = [pool.submit(flight.do, "k", slow_call) for _ in range(2)]
+        for _ in followers:
+            assert flight.waiting.acquire(timeout=5)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == ["report"] * 3
+    assert len(calls) == 1
+    assert flight.in_flight() == 0
+
+
+def test_single_flight_shares_errors_and_forgets_key():
+    flight = ai_gateway.SingleFlight()
+
+    with pytest.raises(ValueError):
+        flight.do("k", MagicMock(side_effect=ValueError("boom")))
+
+    assert flight.do("k", lambda: "ok") == "ok"
+    assert flight.in_flight() == 0
+
+
+def test_generate_coalesces_identical_async_calls():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow(**kwargs):
+            await release.wait()
+            return MagicMock(text="ok")
+
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(side_effect=slow)
+
+        tasks = [
+            asyncio.create_task(ai_gateway.generate(client, "m", "prompt", key="same"))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        return client, results
+
+    client, results = asyncio.run(scenario())
+
+    assert results[0] is results[1] is results[2]
+    assert client.aio.models.generate_content.await_count == 1
+
+
+def _stream_client(chunks, errors=()):
+    """client.aio.models.generate_content_stream: falhas em `errors`, depois chunks."""
+    attempts = list(errors)
+
+    async def open_stream(**kwargs):
+        if attempts:
+            raise attempts.pop(0)
+
+        async def stream():
+            for text in chunks:
+                yield MagicMock(text=text)
+
+        return stream()
+
+    client = MagicMock()
+    client.aio.models.generate_content_stream = AsyncMock(side_effect=open_stream)
+    return client
+
+
+def test_generate_stream_retries_before_first_chunk():
+    client = _stream_client(["Olá", " mundo"], errors=[Exception("503 UNAVAILABLE")])
+
+    async def collect():
+        return [t async for t in ai_gateway.generate_stream(client, "m", "p")]
+
+    with patch.object(ai_gateway.asyncio, "sleep", AsyncMock()):
+        assert asyncio.run(collect()) == ["Olá", " mundo"]
+
+    assert client.aio.models.generate_content_stream.await_count == 2
+
+
+def test_json_string_field_extracts_response_incrementally():
+    raw = '{"response": "Gastou \\"R$ 50\\"\\nno mercado \\u00e9", "action": null}'
+    field = ai_service._JsonStringField()
+
+    pieces = [field.feed(raw[i : i + 4]) for i in range(0, len(raw), 4)]
+
+    assert "".join(pieces) == json.loads(raw)["response"]
+    assert len([p for p in pieces if p]) > 1
+
+
+def test_stream_flow_forwards_chunks_and_finishes_flow():
+    received = []
+
+    def flow():
+        response = yield ai_service.AIRequest("m", "prompt")
+        received.append(response.text)
+        return "final"
+
+    client = _stream_client(['{"response": "Oi', ' tudo bem?"}'])
+
+    async def collect():
+        return [
+            e
+            async for e in ai_service._stream_flow(
+                flow(),
+                ai_service.ai_usage.Usage("chat", "u1", "pro"),
+                extract=ai_service._JsonStringField,
+            )
+        ]
+
+    with patch.object(ai_service, "client", client):
+        events = asyncio.run(collect())
+
+    assert events == [
+        ("start", None),
+        ("chunk", "Oi"),
+        ("chunk", " tudo bem?"),
+        ("done", "final"),
+    ]
+    assert received == ['{"response": "Oi tudo bem?"}']
@@ -0,0 +1,146 @@
+import asyncio
+from datetime import date
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from app.services import ai_gateway, ai_usage
+
+
+@pytest.fixture(autouse=True)
+def clean_pending():
+    ai_usage._take_pending()
+    yield
+    ai_usage._take_pending()
+
+
+def _response(prompt_tokens, output_tokens, thoughts=None):
+    response = MagicMock()
+    response.usage_metadata.prompt_token_count = prompt_tokens
+    response.usage_metadata.candidates_token_count = output_tokens
+    response.usage_metadata.thoughts_token_count = thoughts
+    return response
+
+
+def test_track_records_tokens_latency_retries_and_cost():
+    usage = ai_usage.Usage("chat_finance", "u1", "pro")
+
+    with ai_usage.track(usage, "gemini-2.5-flash-lite") as timer:
+        timer.retries = 2
+        timer.response = _response(1000, 200, thoughts=50)
+
+    calls, latency_max, users, tiers = ai_usage._take_pending()
+    ((key, counters),) = calls.items()
+
+    assert key[1:] == ("chat_finance", "gemini-2.5-flash-lite", "pro")
+    assert counters["calls"] == 1 and counters["errors"] == 0
+    assert counters["retries"] == 2
+    assert counters["prompt_tokens"] == 1000
+    assert counters["output_tokens"] == 250
+    assert counters["cost_usd"] == pytest.approx((1000 * 0.10 + 250 * 0.40) / 1e6)
+    assert key in latency_max
+    assert users[(key[0], "u1")]["calls"] == 1
+    assert tiers[(key[0], "u1")] == "pro"
+
+
+def test_track_records_errors_and_reraises():
+    usage = ai_usage.Usage("parse_receipt", "u1", "premium")
+
+    with pytest.raises(ValueError):
+        with ai_usage.track(usage, "m"):
+            raise ValueError("boom")
+
+    calls, _, _, _ = ai_usage._take_pending()
+    (counters,) = calls.values()
+    assert counters["errors"] == 1 and counters["prompt_tokens"] == 0
+
+
+def test_record_cache_and_untagged_calls():
+    usage = ai_usage.Usage("classify_transaction", "u1", "pro")
+    ai_usage.record_cache(usage, hit=True, count=3)
+    ai_usage.record_cache(usage, hit=False)
+    ai_usage.record_call(None, "m", 10.0)
+
+    calls, _, _, _ = ai_usage._take_pending()
+    (counters,) = calls.values()
+    assert counters == {"cache_hits": 3, "cache_misses": 1}
+
+
+def test_gateway_generate_is_accounted():
+    client = MagicMock()
+    client.aio.models.generate_content = AsyncMock(
+        side_effect=[Exception("429 quota"), _response(10, 5)]
+    )
+    usage = ai_usage.Usage("classify_transaction", "u1", "free")
+
+    with patch.object(ai_gateway.asyncio, "sleep", AsyncMock()):
+        asyncio.run(ai_gateway.generate(client, "m", "p", usage=usage))
+
+    calls, _, _, _ = ai_usage._take_pending()
+    (counters,) = calls.values()
+    assert counters["calls"] == 1 and counters["retries"] == 1
+    assert counters["prompt_tokens"] == 10 and counters["output_tokens"] == 5
+
+
+def test_flush_writes_rollup_and_restores_on_failure():
+    usage = ai_usage.Usage("chat_finance", "u1", "pro")
+    with ai_usage.track(usage, "gemini-2.5-flash") as timer:
+        timer.response = _response(100, 20)
+
+    db = MagicMock()
+    db.batch.return_value.commit.side_effect = [Exception("unavailable"), None]
+
+    with patch.object(ai_usage, "get_db", return_value=db):
+        assert ai_usage.flush() == 0
+        # Agregados voltam para a memória e vão na próxima tentativa
+        assert ai_usage.flush() == 2
+        assert ai_usage.flush() == 0
+
+    day_call, user_call = db.batch.return_value.set.call_args_list[-2:]
+    entries = day_call.args[1]["entries"]
+    assert list(entries) == ["chat_finance|gemini-2.5-flash|pro"]
+    assert user_call.args[1]["user_id"] == "u1"
+    assert user_call.kwargs == {"merge": True}
+
+
+def test_get_usage_summarizes_days():
+    def snap(day, entries):
+        s = MagicMock(id=day, exists=True)
+        s.to_dict.return_value = {"date": day, "entries": entries}
+        return s
+
+    entry = {
+        "caller": "chat_finance",
+        "model": "m",
+        "tier": "pro",
+        "calls": 2,
+        "latency_ms_total": 300.0,
+        "latency_ms_max": 200.0,
+        "cost_usd": 0.5,
+    }
+    cache = {
+        "caller": "chat_finance",
+        "model": "cache",
+        "tier": "pro",
+        "cache_hits": 3,
+        "cache_misses": 1,
+    }
+    db = MagicMock()
+    db.get_all.return_value = [
+        snap("2026-01-02", {"chat_finance|m|pro": {**entry, "latency_ms_max": 250.0}}),
+        snap(
+            "2026-01-01",
+            {"chat_finance|m|pro": entry, "chat_finance|cache|pro": cache},
+        ),
+    ]
+
+    with patch.object(ai_usage, "get_db", return_value=db):
+        result = ai_usage.get_usage(date(2026, 1, 1), date(2026, 1, 3))
+
+    assert len(db.get_all.call_args.args[0]) == 3
+    assert [d["date"] for d in result["days"]] == ["2026-01-01", "2026-01-02"]
+    by_model = {row["model"]: row for row in result["summary"]}
+    assert by_model["m"]["calls"] == 4
+    assert by_model["m"]["latency_ms_avg"] == 150.0
+    assert by_model["m"]["latency_ms_max"] == 250.0
+    assert by_model["cache"]["cache_hit_rate"] == 0.75
+    assert result["total_cost_usd"] == 1.0
@@ -10,170 +10,137 @@ import pytest
 from fastapi import HTTPException
 
 
+def _account_snapshot(acc_id, owner):
+    snap = MagicMock()
+    snap.id = acc_id
+    snap.exists = True
+    snap.to_dict.return_value = {"user_id": owner, "balance": 1000.0}
+    return snap
+
+
+def _increments(mock_db):
+    """Deltas aplicados via batch.update com firestore.Increment."""
+    return [
+        c.args[1]["balance"].value
+        for c in mock_db.batch.return_value.update.call_args_list
+    ]
+
+
 class TestBalanceUpdateSecurity:
     """Tests that _update_account_balance enforces user ownership."""
 
     def test_balance_update_checks_user_ownership(self):
         """Balance update must verify user_id matches account owner."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
-
-            # Account belongs to user_A
-            mock_acc_doc = MagicMock()
-            mock_acc_doc.exists = True
-            mock_acc_doc.to_dict.return_value = {
-                "user_id": "user_A",
-                "balance": 1000.0,
-            }
-            mock_db.collection.return_value.document.return_value.get.return_value = (
-                mock_acc_doc
-            )
+        mock_db = MagicMock()
+        # Account belongs to user_A
+        mock_db.get_all.return_value = [_account_snapshot("acc_123", "user_A")]
 
-            from app.services.transaction import _update_account_balance
+        from app.services.transaction import _update_account_balance
 
-            # user_B tries to update user_A's account
-            _update_account_balance(mock_db, "acc_123", 500.0, "expense", "user_B")
+        # user_B tries to update user_A's account
+        _update_account_balance(mock_db, "acc_123", 500.0, "expense", "user_B")
 
-            # Should NOT update because user_id doesn't match
-            mock_db.collection.return_value.document.return_value.update.assert_not_called()
+        # Should NOT update because user_id doesn't match
+        mock_db.batch.return_value.update.assert_not_called()
+        mock_db.batch.return_value.commit.assert_not_called()
 
     def test_balance_update_works_for_correct_user(self):
         """Balance update should work when user_id matches."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
+        mock_db = MagicMock()
+        mock_db.get_all.return_value = [_account_snapshot("acc_123", "user_A")]
 
-            mock_acc_doc = MagicMock()
-            mock_acc_doc.exists = True
-            mock_acc_doc.to_dict.return_value = {
-                "user_id": "user_A",
-                "balance": 1000.0,
-            }
-            mock_db.collection.return_value.document.return_value.get.return_value = (
-                mock_acc_doc
-            )
+        from app.services.transaction import _update_account_balance
 
-            from app.services.transaction import _update_account_balance
+        _update_account_balance(mock_db, "acc_123", 500.0, "expense", "user_A")
 
-            _update_account_balance(mock_db, "acc_123", 500.0, "expense", "user_A")
+        # Server-side increment, no read of the current balance
+        assert _increments(mock_db) == [-500.0]
+        mock_db.batch.return_value.commit.assert_called_once()
+        mock_db.collection.return_value.document.return_value.get.assert_not_called()
 
-            # Should update: 1000 - 500 = 500
-            mock_db.collection.return_value.document.return_value.update.assert_called_once_with(
-                {"balance": 500.0}
-            )
+    def test_owned_account_ids_skip_ownership_read(self):
+        """Accounts already loaded for the user need no extra read."""
+        mock_db = MagicMock()
 
-    def test_expense_decreases_balance(self):
-        """An expense should subtract from account balance."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
+        from app.services.transaction import _update_account_balance
 
-            mock_acc_doc = MagicMock()
-            mock_acc_doc.exists = True
-            mock_acc_doc.to_dict.return_value = {
-                "user_id": "user_A",
-                "balance": 1000.0,
-            }
-            mock_db.collection.return_value.document.return_value.get.return_value = (
-                mock_acc_doc
-            )
+        _update_account_balance(
+            mock_db,
+            "acc_123",
+            300.0,
+            "expense",
+            "user_A",
+            owned_account_ids={"acc_123"},
+        )
 
-            from app.services.transaction import _update_account_balance
-
-            _update_account_balance(mock_db, "acc_123", 300.0, "expense", "user_A")
-
-            mock_db.collection.return_value.document.return_value.update.assert_called_once_with(
-                {"balance": 700.0}
-            )
+        mock_db.get_all.assert_not_called()
+        assert _increments(mock_db) == [-300.0]
 
     def test_income_increases_balance(self):
         """An income should add to account balance."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
+        mock_db = MagicMock()
 
-            mock_acc_doc = MagicMock()
-            mock_acc_doc.exists = True
-            mock_acc_doc.to_dict.return_value = {
-                "user_id": "user_A",
-                "balance": 1000.0,
-            }
-            mock_db.collection.return_value.document.return_value.get.return_value = (
-                mock_acc_doc
-            )
+        from app.services.transaction import _update_account_balance
 
-            from app.services.transaction import _update_account_balance
+        _update_account_balance(
+            mock_db, "acc_123", 500.0, "income", "user_A", owned_account_ids={"acc_123"}
+        )
 
-            _update_account_balance(mock_db, "acc_123", 500.0, "income", "user_A")
-
-            mock_db.collection.return_value.document.return_value.update.assert_called_once_with(
-                {"balance": 1500.0}
-            )
+        assert _increments(mock_db) == [500.0]
 
     def test_revert_expense_restores_balance(self):
         """Reverting an expense should add amount back."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
-
-            mock_acc_doc = MagicMock()
-            mock_acc_doc.exists = True
-            mock_acc_doc.to_dict.return_value = {
-                "user_id": "user_A",
-                "balance": 700.0,
-            }
-            mock_db.collection.return_value.document.return_value.get.return_value = (
-                mock_acc_doc
-            )
-
-            from app.services.transaction import _update_account_balance
-
-            _update_account_balance(
-                mock_db, "acc_123", 300.0, "expense", "user_A", revert=True
-            )
-
-            mock_db.collection.return_value.document.return_value.update.assert_called_once_with(
-                {"balance": 1000.0}
-            )
-
-    def test_transfer_decreases_source_balance(self):
-        """A transfer should subtract from source account."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
-
-            mock_acc_doc = MagicMock()
-            mock_acc_doc.exists = True
-            mock_acc_doc.to_dict.return_value = {
-                "user_id": "user_A",
-                "balance": 2000.0,
-            }
-            mock_db.collection.return_value.document.return_value.get.return_value = (
-                mock_acc_doc
-            )
-
-            from app.services.transaction import _update_account_balance
-
-            _update_account_balance(mock_db, "acc_src", 750.0, "transfer", "user_A")
-
-            mock_db.collection.return_value.document.return_value.update.assert_called_once_with(
-                {"balance": 1250.0}
-            )
+        mock_db = MagicMock()
+
+        from app.services.transaction import _update_account_balance
+
+        _update_account_balance(
+            mock_db,
+            "acc_123",
+            300.0,
+            "expense",
+            "user_A",
+            revert=True,
+            owned_account_ids={"acc_123"},
+        )
+
+        assert _increments(mock_db) == [300.0]
+
+    def test_transfer_updates_source_and_destination_in_one_batch(self):
+        """A transfer moves money between both accounts in a single commit."""
+        mock_db = MagicMock()
+        mock_db.get_all.return_value = [
+            _account_snapshot("acc_src", "user_A"),
+            _account_snapshot("acc_dst", "user_A"),
+        ]
+
+        from app.services.transaction import _update_account_balance
+
+        _update_account_balance(
+            mock_db,
+            "acc_src",
+            750.0,
+            "transfer",
+            "user_A",
+            destination_account_id="acc_dst",
+        )
+
+        assert sorted(_increments(mock_db)) == [-750.0, 750.0]
+        mock_db.get_all.assert_called_once()
+        mock_db.batch.return_value.commit.assert_called_once()
 
     def test_null_account_id_silently_skips(self):
         """If account_id is None/empty, skip balance update."""
-        with patch("app.services.transaction.get_db") as mock_get_db:
-            mock_db = MagicMock()
-            mock_get_db.return_value = mock_db
+        mock_db = MagicMock()
 
-            from app.services.transaction import _update_account_balance
+        from app.services.transaction import _update_account_balance
 
-            _update_account_balance(mock_db, None, 100.0, "expense", "user_A")
-            _update_account_balance(mock_db, "", 100.0, "expense", "user_A")
+        _update_account_balance(mock_db, None, 100.0, "expense", "user_A")
+        _update_account_balance(mock_db, "", 100.0, "expense", "user_A")
 
-            # DB should not be queried at all
-            mock_db.collection.return_value.document.assert_not_called()
+        # DB should not be queried at all
+        mock_db.collection.return_value.document.assert_not_called()
+        mock_db.get_all.assert_not_called()
 
 
 class TestTransactionDeletion:
@@ -4,6 +4,7 @@ import pytest
 from app.schemas.budget import BudgetCreate
 from app.schemas.category import Category
 from app.services import budget as budget_service
+from app.services.category import CategoryTree
 
 
 @pytest.fixture
@@ -74,21 +75,21 @@ def test_create_budget_invalid_type(mock_db, mock_category_service):
     assert "Budgets can only be created for expense categories" in str(exc.value)
 
 
-def test_list_budgets_with_progress(mock_db):
+def test_list_budgets_with_progress(mock_db, mock_category_service):
     # Setup
     user_id = "test_user_id"
 
     # 1. Mock Categories (Hierarchy)
     # Cat1 (Parent) -> Cat2 (Child)
-    cat1_doc = MagicMock()
-    cat1_doc.id = "cat1"
-    cat1_doc.to_dict.return_value = {"name": "Food", "parent_id": None}
-
-    cat2_doc = MagicMock()
-    cat2_doc.id = "cat2"
-    cat2_doc.to_dict.return_value = {"name": "Groceries", "parent_id": "cat1"}
+    mock_category_service.get_category_tree.return_value = CategoryTree(
+        0,
+        [
+            Category(id="cat1", name="Food", user_id=user_id),
+            Category(id="cat2", name="Groceries", parent_id="cat1", user_id=user_id),
+        ],
+    )
 
-    # Mock db.collection("categories").where().stream()
+    # Mock db.collection(...).where().stream()
     # Problem: The service calls db.collection() multiple times for different collections.
     # verification: default mock returns same mock_collection for any call.
     # We need to distinguish based on collection name.
@@ -96,13 +97,10 @@ def test_list_budgets_with_progress(mock_db):
     # Advanced Mocking Strategy
     # We mock the return_value of db.collection(name) to return DIFFERENT mocks
 
-    mock_cat_col = MagicMock()
     mock_budget_col = MagicMock()
     mock_trans_col = MagicMock()
 
     def side_effect_collection(name):
-        if name == "categories":
-            return mock_cat_col
         if name == "budgets":
             return mock_budget_col
         if name == "transactions":
@@ -111,10 +109,6 @@ def test_list_budgets_with_progress(mock_db):
 
     mock_db.collection.side_effect = side_effect_collection
 
-    # Configure Streams
-    mock_cat_col.where.return_value = mock_cat_col
-    mock_cat_col.stream.return_value = [cat1_doc, cat2_doc]
-
     # 2. Mock Budgets
     # Budget for "cat1" (Food) with 1000 limit
     budget_doc = MagicMock()
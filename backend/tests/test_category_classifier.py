@@ -0,0 +1,97 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app.services import category_classifier
+
+
+@pytest.fixture(autouse=True)
+def empty_model_cache():
+    category_classifier.clear_model_cache()
+    yield
+    category_classifier.clear_model_cache()
+
+
+@pytest.fixture
+def model_db():
+    with patch("app.services.category_classifier.get_db") as mock_get_db:
+        db = MagicMock()
+        mock_get_db.return_value = db
+        db.collection.return_value.document.return_value.get.return_value.exists = False
+        # Modelo (vazio) carregado em memória; learn() o atualiza no lugar
+        category_classifier._get_model("u1")
+        yield db
+
+
+def test_tokenize_normalizes_merchant_strings():
+    assert category_classifier.tokenize("UBER *TRIP 12/03") == ["uber", "trip"]
+    assert category_classifier.tokenize("NETFLIX.COM") == ["netflix"]
+    assert category_classifier.tokenize("Pagto Pix Padaria São João") == [
+        "padaria",
+        "sao",
+        "joao",
+    ]
+
+
+def test_known_merchant_is_predicted_with_high_confidence(model_db):
+    category_classifier.learn(model_db, "u1", [("UBER *TRIP", "cat_transport")] * 5)
+
+    cat_id, confidence = category_classifier.predict("u1", "UBER* TRIP 0803")
+
+    assert cat_id == "cat_transport"
+    assert confidence >= category_classifier.CONFIDENCE_THRESHOLD
+
+    # Um documento com Increment para todos os itens
+    model_db.collection.return_value.document.return_value.set.assert_called_once()
+
+
+def test_ambiguous_or_unknown_descriptions_stay_below_threshold(model_db):
+    category_classifier.learn(
+        model_db, "u1", [("Mercado Livre", "cat_shop"), ("Mercado Livre", "cat_home")]
+    )
+
+    cat_id, confidence = category_classifier.predict("u1", "Mercado Livre")
+    assert cat_id in {"cat_shop", "cat_home"}
+    assert confidence < category_classifier.CONFIDENCE_THRESHOLD
+    assert category_classifier.predict("u1", "Loja Desconhecida") == (None, 0.0)
+
+
+def test_deleted_categories_are_ignored(model_db):
+    category_classifier.learn(model_db, "u1", [("IFOOD", "cat_old")] * 5)
+
+    assert category_classifier.predict("u1", "IFOOD", valid_ids={"cat_new"}) == (
+        None,
+        0.0,
+    )
+
+
+def test_compaction_drops_zeroed_and_least_used_keys():
+    ref = MagicMock()
+    ref.get.return_value.exists = True
+    ref.get.return_value.to_dict.return_value = {
+        "merchants": {"uber_trip": {"c1": 5}, "ifood": {"c2": 0}},
+        "tokens": {"uber": {"c1": 9}, "trip": {"c1": 3, "c2": -1}, "rare": {"c2": 1}},
+        "token_totals": {"c1": 12},
+        "category_counts": {"c1": 5},
+    }
+    transaction = MagicMock()
+
+    with patch.object(category_classifier, "MAX_TOKENS", 2), patch.object(
+        category_classifier, "PRUNE_TO", 1.0
+    ):
+        model = category_classifier._compact_in_transaction.to_wrap(transaction, ref)
+
+    written = transaction.update.call_args.args[1]
+    assert written["merchants"] == {"uber_trip": {"c1": 5}}
+    assert written["tokens"] == {"uber": {"c1": 9}, "trip": {"c1": 3}}
+    assert model["category_counts"] == {"c1": 5}
+
+
+def test_learn_compacts_when_vocabulary_exceeds_limit(model_db):
+    with patch.object(category_classifier, "MAX_MERCHANTS", 1), patch.object(
+        category_classifier, "compact_model", return_value=None
+    ) as compact:
+        category_classifier.learn(model_db, "u1", [("UBER *TRIP", "c1")])
+        compact.assert_not_called()
+
+        category_classifier.learn(model_db, "u1", [("IFOOD", "c2")])
+        compact.assert_called_once_with("u1")
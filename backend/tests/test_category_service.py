@@ -10,6 +10,8 @@ from unittest.mock import MagicMock, patch
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from app.schemas.category import CategoryType
+from app.schemas.category import Category
+from app.services import category as category_service
 from app.services.category import list_categories
 
 
@@ -25,12 +27,12 @@ class TestCategoryService(unittest.TestCase):
         mock_db = MagicMock()
         mock_get_db.return_value = mock_db
 
-        # Setup the chain of .collection().where().where().stream()
-        # Note: In the code: db.collection().where(user).where(type).stream()
+        # Setup the chain of .collection().where().stream()
+        # Note: the whole tree is loaded with db.collection().where(user).stream()
+        # and the type filter is applied in memory
 
         mock_col = mock_db.collection.return_value
         mock_query_user = mock_col.where.return_value
-        mock_query_type = mock_query_user.where.return_value
 
         # Mock Docs
         # Root 1
@@ -60,7 +62,7 @@ class TestCategoryService(unittest.TestCase):
         }
 
         # Return these docs when stream is called
-        mock_query_type.stream.return_value = [doc1, doc2]
+        mock_query_user.stream.return_value = [doc1, doc2]
 
         # Call function
         # Note: The service code handles building the tree
@@ -80,5 +82,93 @@ class TestCategoryService(unittest.TestCase):
         self.assertEqual(child.parent_id, "root1")
 
 
+class TestCategoryTreeCache(unittest.TestCase):
+
+    def setUp(self):
+        category_service.clear_category_tree_cache()
+
+    def _doc(self, doc_id, parent_id=None):
+        doc = MagicMock()
+        doc.id = doc_id
+        doc.to_dict.return_value = {
+            "name": doc_id.title(),
+            "user_id": "user1",
+            "type": "expense",
+            "parent_id": parent_id,
+        }
+        return doc
+
+    def _db(self, version):
+        mock_db = MagicMock()
+        meta = mock_db.collection.return_value.document.return_value.get.return_value
+        meta.exists = True
+        meta.to_dict.return_value = {"version": version}
+        stream = mock_db.collection.return_value.where.return_value.stream
+        stream.return_value = [
+            self._doc("root"),
+            self._doc("child", "root"),
+            self._doc("grandchild", "child"),
+        ]
+        return mock_db, stream
+
+    @patch("app.services.category.get_db")
+    def test_tree_is_reused_while_version_is_unchanged(self, mock_get_db):
+        mock_db, stream = self._db(3)
+        mock_get_db.return_value = mock_db
+
+        first = category_service.get_category_tree("user1")
+        second = category_service.get_category_tree("user1")
+
+        self.assertIs(first, second)
+        self.assertEqual(stream.call_count, 1)
+        self.assertEqual(
+            set(first.descendants_of("root")), {"root", "child", "grandchild"}
+        )
+        self.assertEqual(first.parent_map["grandchild"].id, "child")
+        self.assertEqual(first.descendants_of("missing"), ("missing",))
+
+    @patch("app.services.category.get_db")
+    def test_version_change_reloads_tree(self, mock_get_db):
+        mock_db, stream = self._db(3)
+        mock_get_db.return_value = mock_db
+        category_service.get_category_tree("user1")
+
+        # Outro worker gravou uma categoria e incrementou a versão
+        meta = mock_db.collection.return_value.document.return_value.get.return_value
+        meta.to_dict.return_value = {"version": 4}
+        category_service.get_category_tree("user1")
+
+        self.assertEqual(stream.call_count, 2)
+
+    @patch("app.services.category.get_db")
+    def test_writes_bump_categories_version(self, mock_get_db):
+        mock_db, _ = self._db(3)
+        mock_get_db.return_value = mock_db
+        mock_db.collection.return_value.add.return_value = (None, MagicMock(id="new"))
+
+        category_service.create_category(
+            MagicMock(model_dump=MagicMock(return_value={"name": "Pets"})), "user1"
+        )
+
+        mock_db.collection.assert_any_call(category_service.META_COLLECTION_NAME)
+        meta_ref = mock_db.collection.return_value.document.return_value
+        meta_ref.set.assert_called_once()
+        self.assertTrue(meta_ref.set.call_args.kwargs["merge"])
+
+    def test_list_categories_does_not_mutate_cached_objects(self):
+        tree = category_service.CategoryTree(
+            1,
+            [
+                Category(id="root", name="Root", user_id="user1"),
+                Category(id="child", name="Child", parent_id="root", user_id="user1"),
+            ],
+        )
+        with patch.object(category_service, "get_category_tree", return_value=tree):
+            roots = list_categories("user1")
+
+        self.assertEqual([c.id for c in roots[0].subcategories], ["child"])
+        self.assertEqual(tree.flat["root"].subcategories, [])
+
+
 if __name__ == "__main__":
     unittest.main()
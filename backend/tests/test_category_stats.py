@@ -0,0 +1,88 @@
+import statistics
+from unittest.mock import MagicMock, patch
+
+from app.services import category_stats
+from app.services.analysis_service import AnalysisService
+
+
+def test_push_keeps_bounded_window_with_exact_stats():
+    values = [float(v) for v in range(1, 31)]
+    data = category_stats._payload("u1", "c1", values[:5])
+
+    data = category_stats._push(data, values[5:])
+
+    window = values[-category_stats.WINDOW_SIZE :]
+    assert data["window"] == window
+    assert data["count"] == category_stats.WINDOW_SIZE
+    assert abs(data["mean"] - statistics.mean(window)) < 1e-9
+    assert abs(data["m2"] / (data["count"] - 1) - statistics.variance(window)) < 1e-9
+
+
+def test_get_stats_returns_sample_stdev():
+    data = category_stats._payload("u1", "c1", [10.0, 20.0, 30.0])
+    with patch("app.services.category_stats.get_db") as mock_get_db:
+        snap = (
+            mock_get_db.return_value.collection.return_value.document.return_value.get.return_value
+        )
+        snap.exists = True
+        snap.to_dict.return_value = data
+
+        count, mean, stdev = category_stats.get_stats("u1", "c1")
+
+    assert (count, mean) == (3, 20.0)
+    assert abs(stdev - 10.0) < 1e-9
+
+
+def test_analyze_transaction_uses_stats_without_querying_history():
+    with patch(
+        "app.services.analysis_service.category_stats.get_stats",
+        return_value=(20, 50.0, 10.0),
+    ), patch("app.services.analysis_service.get_db") as mock_get_db:
+        service = AnalysisService()
+        assert service.analyze_transaction("u1", 60.0, "c1") is None
+        warning = service.analyze_transaction("u1", 100.0, "c1")
+
+    assert "100% maior" in warning
+    mock_get_db.assert_not_called()
+
+
+def test_record_expenses_seeds_missing_category_from_history():
+    db = MagicMock()
+    ref = db.collection.return_value.document.return_value
+
+    docs = []
+    for amount in (30.0, 20.0, 10.0):  # mais recente primeiro
+        doc = MagicMock()
+        doc.to_dict.return_value = {"amount": amount}
+        docs.append(doc)
+    db.collection.return_value.where.return_value.where.return_value.order_by.return_value.limit.return_value.stream.return_value = (
+        docs
+    )
+
+    with patch(
+        "app.services.category_stats._push_in_transaction", return_value=False
+    ) as push_mock:
+        category_stats.record_expenses(db, "u1", [("c1", 30.0)])
+
+    push_mock.assert_called_once()
+    payload = ref.set.call_args.args[0]
+    assert payload["window"] == [10.0, 20.0, 30.0]
+    assert payload["count"] == 3
+
+
+def test_refresh_categories_rewrites_window_from_history():
+    db = MagicMock()
+    docs = []
+    for amount in (30.0, 20.0):
+        doc = MagicMock()
+        doc.to_dict.return_value = {"amount": amount}
+        docs.append(doc)
+    query = db.collection.return_value.where.return_value.where.return_value
+    query.order_by.return_value.limit.return_value.stream.return_value = docs
+
+    category_stats.refresh_categories(db, "u1", ["c1", None, "c1"])
+
+    ref = db.collection.return_value.document.return_value
+    ref.set.assert_called_once()
+    # Histórico vem do mais recente: a janela fica em ordem cronológica
+    assert ref.set.call_args.args[0]["window"] == [20.0, 30.0]
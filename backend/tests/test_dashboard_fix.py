@@ -4,6 +4,7 @@ from unittest.mock import MagicMock, patch
 from app.schemas.account import Account, AccountType
 from app.schemas.category import Category, CategoryType
 from app.schemas.transaction import PaymentMethod, Transaction, TransactionType
+from app.services.category import CategoryTree
 from app.services.dashboard import get_dashboard_data
 
 
@@ -107,15 +108,83 @@ def test_get_dashboard_data_handles_string_dates(
         status="paid",
     )
 
+    # O dashboard agrega os dicts crus do Firestore (data como string legada)
+    raw_tx = {
+        **tx.model_dump(exclude={"category", "account", "destination_account"}),
+        "category_id": "cat_food",
+        "account_id": "acc_1",
+        "type": "expense",
+        "payment_method": "credit_card",
+        "date": "2025-12-01T10:00:00Z",
+    }
+
     with patch(
-        "app.services.dashboard.transaction_service.list_transactions"
+        "app.services.dashboard.transaction_service.list_raw_transactions"
     ) as mock_list:
-        mock_list.return_value = [tx]
+        mock_list.return_value = [raw_tx]
         mock_category_service.get_category.return_value = mock_cat_obj
-        mock_category_service.list_categories.return_value = [mock_cat_obj]
+        mock_category_service.get_category_tree.return_value = CategoryTree(
+            0, [mock_cat_obj]
+        )
 
         # 3. Execução
         summary = get_dashboard_data(user_id="user_123", month=12, year=2025)
 
     # 4. Verificação
     assert summary.expense_month == 150.0
+
+
+def test_aggregate_from_transactions_single_pass_filters_and_buckets():
+    from app.services.dashboard import _aggregate_from_transactions
+
+    rows = [
+        # Mês atual, conta filtrada
+        {"amount": 100.0, "type": "expense", "category_id": "sub", "account_id": "a1",
+         "payment_method": "pix", "date": datetime(2025, 12, 5, tzinfo=timezone.utc)},
+        # Outra conta: ignorada em tudo
+        {"amount": 999.0, "type": "expense", "category_id": "food", "account_id": "a2",
+         "payment_method": "pix", "date": datetime(2025, 12, 6, tzinfo=timezone.utc)},
+        # Fatura Cartão: excluída
+        {"amount": 500.0, "type": "transfer", "category_id": "inv", "account_id": "a1",
+         "payment_method": "pix", "date": datetime(2025, 12, 7, tzinfo=timezone.utc)},
+        # Mês anterior (string legada): só evolução
+        {"amount": 40.0, "type": "income", "category_id": "sal", "account_id": "a1",
+         "payment_method": "pix", "date": "2025-11-20T10:00:00"},
+    ]
+    parent = MagicMock(id="food")
+
+    with patch(
+        "app.services.dashboard.transaction_service.list_raw_transactions",
+        return_value=rows,
+    ):
+        income, expense, by_cat, evolution = _aggregate_from_transactions(
+            "user_123",
+            datetime(2025, 6, 1, tzinfo=timezone.utc),
+            datetime(2025, 12, 1, tzinfo=timezone.utc),
+            datetime(2025, 12, 31, 23, 59, 59, tzinfo=timezone.utc),
+            [(11, 2025), (12, 2025)],
+            "inv",
+            {"sub": parent},
+            ["a1"],
+            None,
+        )
+
+    assert (income, expense) == (0.0, 100.0)
+    assert by_cat == {"food": 100.0}
+    assert [(e.month, e.income, e.expense) for e in evolution] == [
+        ("11/25", 40.0, 0.0),
+        ("12/25", 0.0, 100.0),
+    ]
+
+
+def test_parse_date_normalizes_offsets_to_utc_like_rollups():
+    from app.services import monthly_rollup
+    from app.services.dashboard import _parse_date
+
+    raw = "2025-11-30T22:00:00-03:00"
+    parsed = _parse_date(raw)
+
+    assert parsed == datetime(2025, 12, 1, 1, tzinfo=timezone.utc)
+    assert parsed.utcoffset().total_seconds() == 0
+    # Mesmo mês no caminho sem rollup e no rollup
+    assert monthly_rollup.month_key(raw) == "2025-12"
@@ -42,14 +42,12 @@ MOCK_DEBT_2 = Debt(
 # --- Tests for IA Scanner (Document Analysis) ---
 
 
-@patch("app.services.document_analysis.get_preferences")
+@patch("app.services.document_analysis.get_subscription_tier")
 @patch("app.services.document_analysis._call_with_retry")
 @patch("app.services.document_analysis.client", MagicMock())
 def test_analyze_debt_document_success(mock_call_retry, mock_get_pref):
     # Mock User Tier
-    mock_pref = MagicMock()
-    mock_pref.subscription_tier = "premium"
-    mock_get_pref.return_value = mock_pref
+    mock_get_pref.return_value = "premium"
 
     # Mock AI Response
     mock_response = MagicMock()
@@ -75,12 +73,10 @@ def test_analyze_debt_document_success(mock_call_retry, mock_get_pref):
     mock_call_retry.assert_called()
 
 
-@patch("app.services.document_analysis.get_preferences")
+@patch("app.services.document_analysis.get_subscription_tier")
 def test_analyze_debt_document_free_tier(mock_get_pref):
     # Mock Free Tier
-    mock_pref = MagicMock()
-    mock_pref.subscription_tier = "free"
-    mock_get_pref.return_value = mock_pref
+    mock_get_pref.return_value = "free"
 
     result = DocumentAnalysisService.analyze_debt_document(
         "user_123", b"fake_content", "application/pdf"
@@ -94,12 +90,10 @@ def test_analyze_debt_document_free_tier(mock_get_pref):
 
 
 @patch("app.services.debt_service.list_debts")
-@patch("app.services.debt_service.get_preferences")
+@patch("app.services.debt_service.get_subscription_tier")
 def test_generate_payment_plan_avalanche(mock_get_pref, mock_list_debts):
     # Mock User Tier
-    mock_pref = MagicMock()
-    mock_pref.subscription_tier = "pro"  # Plan available for Pro
-    mock_get_pref.return_value = mock_pref
+    mock_get_pref.return_value = "pro"  # Plan available for Pro
 
     # Mock Debts
     mock_list_debts.return_value = [MOCK_DEBT_1, MOCK_DEBT_2]
@@ -125,12 +119,10 @@ def test_generate_payment_plan_avalanche(mock_get_pref, mock_list_debts):
 
 
 @patch("app.services.debt_service.list_debts")
-@patch("app.services.debt_service.get_preferences")
+@patch("app.services.debt_service.get_subscription_tier")
 def test_generate_payment_plan_snowball(mock_get_pref, mock_list_debts):
     # Mock User Tier
-    mock_pref = MagicMock()
-    mock_pref.subscription_tier = "pro"
-    mock_get_pref.return_value = mock_pref
+    mock_get_pref.return_value = "pro"
 
     # Mock Debts
     mock_list_debts.return_value = [MOCK_DEBT_1, MOCK_DEBT_2]
@@ -0,0 +1,181 @@
+import asyncio
+import importlib
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiosmtplib
+import pytest
+from app.services.email_service import BulkMailer, email_service
+
+email_module = importlib.import_module("app.services.email_service")
+
+
+class _FakeSMTP:
+    opened = []
+    connect_errors = []
+
+    def __init__(self, conf=None):
+        self.send_message = AsyncMock()
+        self.login = AsyncMock()
+        self.closed = False
+
+    async def connect(self):
+        if _FakeSMTP.connect_errors:
+            raise _FakeSMTP.connect_errors.pop(0)
+        _FakeSMTP.opened.append(self)
+
+    async def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+def _fake_smtp():
+    _FakeSMTP.opened = []
+    _FakeSMTP.connect_errors = []
+    return patch.object(email_module, "_smtp_client", _FakeSMTP)
+
+
+def _service():
+    service = MagicMock()
+    service.enabled = True
+    service.conf.SUPPRESS_SEND = 0
+    service.build_message = AsyncMock(side_effect=lambda subject, *a: subject)
+    return service
+
+
+async def _send_all(mailer, count):
+    async with mailer:
+        await asyncio.gather(
+            *(
+                mailer.send_email(f"m{i}", ["a@example.com"], "<p/>")
+                for i in range(count)
+            )
+        )
+
+
+def test_bulk_reuses_connections_and_renews_after_limit():
+    mailer = BulkMailer(_service(), connections=2, max_messages=3, per_second=0)
+    with _fake_smtp():
+        asyncio.run(_send_all(mailer, 10))
+
+    sent = sum(c.send_message.await_count for c in _FakeSMTP.opened)
+    assert sent == 10
+    # 2 sessões, renovadas a cada 3 mensagens: 4 conexões no total
+    assert len(_FakeSMTP.opened) == 4
+    assert all(c.closed for c in _FakeSMTP.opened)
+
+
+def test_bulk_reconnects_when_server_drops():
+    mailer = BulkMailer(_service(), connections=1, per_second=0)
+
+    async def scenario():
+        await mailer.send_email("m0", ["a@example.com"], "<p/>")
+        dropped = _FakeSMTP.opened[0]
+        dropped.send_message.side_effect = aiosmtplib.SMTPServerDisconnected("bye")
+        await mailer.send_email("m1", ["a@example.com"], "<p/>")
+        await mailer.close()
+
+    with _fake_smtp():
+        asyncio.run(scenario())
+
+    first, second = _FakeSMTP.opened
+    assert first.closed
+    second.send_message.assert_awaited_once_with("m1")
+
+
+def test_failed_reconnect_fails_only_the_current_message():
+    mailer = BulkMailer(_service(), connections=1, per_second=0)
+
+    async def scenario():
+        await mailer.send_email("m0", ["a@example.com"], "<p/>")
+        _FakeSMTP.opened[0].send_message.side_effect = (
+            aiosmtplib.SMTPServerDisconnected("bye")
+        )
+        _FakeSMTP.connect_errors = [aiosmtplib.SMTPConnectError("refused")]
+        with pytest.raises(aiosmtplib.SMTPConnectError):
+            await mailer.send_email("m1", ["a@example.com"], "<p/>")
+        # Próxima mensagem abre uma sessão nova
+        await mailer.send_email("m2", ["a@example.com"], "<p/>")
+        await mailer.close()
+
+    with _fake_smtp():
+        asyncio.run(scenario())
+
+    first, second = _FakeSMTP.opened
+    second.send_message.assert_awaited_once_with("m2")
+
+
+def test_first_connect_failure_is_retried_once():
+    mailer = BulkMailer(_service(), connections=1, per_second=0)
+
+    async def scenario():
+        _FakeSMTP.connect_errors = [aiosmtplib.SMTPConnectError("refused")]
+        await mailer.send_email("m0", ["a@example.com"], "<p/>")
+        await mailer.close()
+
+    with _fake_smtp():
+        asyncio.run(scenario())
+
+    (session,) = _FakeSMTP.opened
+    session.send_message.assert_awaited_once_with("m0")
+
+
+def test_build_message_uses_configured_sender():
+    service = email_module.EmailService()
+    service.conf = MagicMock(MAIL_FROM_NAME="MonFinTrack", MAIL_FROM="no@x.com")
+
+    message = asyncio.run(
+        service.build_message("Olá", ["a@example.com", "b@example.com"], "<p>é</p>")
+    )
+
+    assert message["From"] == "MonFinTrack <no@x.com>"
+    assert message["To"] == "a@example.com, b@example.com"
+    assert message["Subject"] == "Olá"
+    assert message["Message-ID"]
+    (part,) = message.get_payload()
+    assert part.get_content_type() == "text/html"
+    assert part.get_payload(decode=True).decode("utf-8") == "<p>é</p>"
+
+
+def test_smtp_client_uses_connection_config():
+    conf = email_module.ConnectionConfig(
+        MAIL_USERNAME="user",
+        MAIL_PASSWORD="secret",
+        MAIL_FROM="no@x.com",
+        MAIL_PORT=2525,
+        MAIL_SERVER="smtp.example.com",
+        MAIL_STARTTLS=True,
+        MAIL_SSL_TLS=False,
+    )
+
+    client = email_module._smtp_client(conf)
+
+    assert (client.hostname, client.port) == ("smtp.example.com", 2525)
+    assert (client.use_tls, client.validate_certs) == (False, True)
+    assert client.timeout == conf.TIMEOUT
+
+
+def test_rate_pacer_spaces_sends():
+    pacer = email_module._RatePacer(per_second=10)
+
+    async def scenario():
+        with patch.object(email_module.asyncio, "sleep", new=AsyncMock()) as sleep:
+            for _ in range(3):
+                await pacer.wait()
+        return [c.args[0] for c in sleep.await_args_list]
+
+    delays = asyncio.run(scenario())
+    assert len(delays) == 2
+    assert 0.09 < delays[0] <= 0.1 and 0.19 < delays[1] <= 0.2
+
+
+def test_templates_are_precompiled():
+    assert "weekly_report.html" in email_service.templates
+    with patch.object(email_service.env, "get_template") as get_template:
+        html = email_service.render_template(
+            "weekly_report.html",
+            {"name": "Ana", "data": {"alerts": []}, "logo_url": ""},
+        )
+    get_template.assert_not_called()
+    assert "Ana" in html
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app.core import limiter_storage
+from app.core.limiter import build_limiter, rate_limit_key
+from fastapi import Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+from google.cloud import firestore
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+
+
+class _InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+def _request(uid=None, ip="10.0.0.1"):
+    state = SimpleNamespace(uid=uid) if uid else SimpleNamespace()
+    return SimpleNamespace(state=state, client=SimpleNamespace(host=ip), headers={})
+
+
+def test_rate_limit_key_prefers_authenticated_uid():
+    assert rate_limit_key(_request(uid="u1")) == "uid:u1"
+    assert rate_limit_key(_request()) == "ip:10.0.0.1"
+
+
+def _storage(remote_total):
+    storage = limiter_storage.FirestoreStorage()
+    storage._sync_executor = _InlineExecutor()
+    db = MagicMock()
+    snap = MagicMock(exists=True)
+    snap.to_dict.return_value = {"count": remote_total}
+    ref = db.collection.return_value.document.return_value
+    ref.get.return_value = snap
+    return storage, db, ref
+
+
+def test_incr_counts_locally_and_syncs_remote_total():
+    storage, db, ref = _storage(remote_total=8)
+
+    with patch.object(limiter_storage, "get_db", return_value=db):
+        # Primeira chamada: decide com o que sabe (1) e sincroniza em seguida
+        assert storage.incr("k", 60) == 1
+        # 8 no Firestore = 1 desta instância + 7 de outras
+        assert storage.get("k") == 8
+        # Dentro do intervalo de sincronização: só memória
+        assert storage.incr("k", 60) == 9
+
+    ref.set.assert_called_once()
+    payload = ref.set.call_args.args[0]
+    assert payload["count"] == firestore.Increment(1)
+    assert ref.set.call_args.kwargs == {"merge": True}
+    assert ref.get.call_count == 1
+    assert storage.get_expiry("k") > 0
+
+
+def test_sync_failure_keeps_local_count():
+    storage, db, ref = _storage(remote_total=0)
+    ref.set.side_effect = Exception("unavailable")
+
+    with patch.object(limiter_storage, "get_db", return_value=db):
+        assert storage.incr("k", 60, amount=2) == 2
+
+    assert storage.get("k") == 2
+    storage.clear("k")
+    assert storage.get("k") == 0
+
+
+def _instance(limiter):
+    """Uma instância da API: rota limitada, uid vindo da autenticação."""
+    app = FastAPI()
+    app.state.limiter = limiter
+    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+    def current_user(request: Request):
+        request.state.uid = request.headers["x-uid"]
+
+    @app.get("/limited", dependencies=[Depends(current_user)])
+    @limiter.limit("2/minute")
+    def limited(request: Request):
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_redis_storage_shares_uid_quota_between_instances():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # scripts Lua do limits
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    def redis_limiter():
+        pool = redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection, server=server
+        )
+        return build_limiter("redis://localhost:6379/0", connection_pool=pool)
+
+    first, second = _instance(redis_limiter()), _instance(redis_limiter())
+    headers = {"x-uid": "u1"}
+
+    assert first.get("/limited", headers=headers).status_code == 200
+    assert second.get("/limited", headers=headers).status_code == 200
+    # Terceira chamada do mesmo uid, em outra instância: cota já consumida
+    assert first.get("/limited", headers=headers).status_code == 429
+    assert second.get("/limited", headers={"x-uid": "u2"}).status_code == 200
+    # Um contador por uid no Redis, não um por instância
+    keys = fakeredis.FakeRedis(server=server).keys()
+    assert len([k for k in keys if b"/slowapi/uid:u1/" in k]) == 1
@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+from app.services import monthly_rollup
+
+
+def test_month_key_normalizes_dates():
+    assert monthly_rollup.month_key(datetime(2025, 3, 10)) == "2025-03"
+    assert monthly_rollup.month_key("2025-03-31T23:30:00-03:00") == "2025-04"
+    assert (
+        monthly_rollup.month_key(datetime(2025, 1, 1, 1, tzinfo=timezone.utc))
+        == "2025-01"
+    )
+    assert monthly_rollup.month_key("not a date") is None
+
+
+def test_apply_change_moves_amount_between_months():
+    db = MagicMock()
+    batch = db.batch.return_value
+
+    old = {
+        "amount": 50.0,
+        "type": "expense",
+        "category_id": "c1",
+        "date": datetime(2025, 1, 5),
+    }
+    new = {**old, "date": datetime(2025, 2, 5)}
+
+    monthly_rollup.apply_change(db, "u1", old, new)
+
+    assert batch.set.call_count == 2
+    batch.commit.assert_called_once()
+
+
+def test_apply_change_skips_when_nothing_relevant_changed():
+    db = MagicMock()
+    old = {
+        "amount": 50.0,
+        "type": "expense",
+        "category_id": "c1",
+        "date": datetime(2025, 1, 5),
+    }
+    # Update persiste datas como string (mode="json"): mesmo mês, sem delta
+    new = {**old, "date": "2025-01-05T00:00:00", "title": "Outro"}
+
+    monthly_rollup.apply_change(db, "u1", old, new)
+
+    db.batch.assert_not_called()
+
+
+def test_get_rollups_returns_none_until_rebuilt():
+    with patch("app.services.monthly_rollup.get_db") as mock_get_db:
+        db = MagicMock()
+        mock_get_db.return_value = db
+        db.get_all.return_value = []
+
+        assert monthly_rollup.get_rollups("u1", ["2025-01"]) is None
+
+
+def test_get_rollups_fills_missing_months():
+    with patch("app.services.monthly_rollup.get_db") as mock_get_db:
+        db = MagicMock()
+        mock_get_db.return_value = db
+
+        meta = MagicMock(exists=True)
+        meta.reference.id = "u1"
+        meta.to_dict.return_value = {"ready": True}
+        jan = MagicMock(exists=True)
+        jan.reference.id = "u1_2025-01"
+        jan.to_dict.return_value = {
+            "count": 2,
+            "categories": {"c1": {"expense": 30.0}, "c2": {"income": 100.0}},
+        }
+        db.get_all.return_value = [meta, jan]
+
+        rollups = monthly_rollup.get_rollups("u1", ["2025-01", "2025-02"])
+
+    assert rollups["2025-02"] == {"count": 0, "categories": {}}
+    assert monthly_rollup.type_total(rollups["2025-01"], "expense") == 30.0
+    assert monthly_rollup.type_total(rollups["2025-01"], "income", ["c2"]) == 0
+
+
+def test_apply_transactions_joins_caller_batch():
+    db = MagicMock()
+    batch = MagicMock()
+    data = {
+        "amount": 50.0,
+        "type": "expense",
+        "category_id": "c1",
+        "date": datetime(2025, 1, 5),
+    }
+
+    monthly_rollup.apply_transactions(db, "u1", [data, data], batch=batch)
+
+    # Um documento por mês, sem commit próprio: vai junto com a transação
+    batch.set.assert_called_once()
+    batch.commit.assert_not_called()
+    db.batch.assert_not_called()
+
+
+def test_rebuild_clears_ready_before_rewriting():
+    with patch("app.services.monthly_rollup.get_db") as mock_get_db:
+        db = MagicMock()
+        mock_get_db.return_value = db
+        tx = MagicMock()
+        tx.to_dict.return_value = {
+            "amount": 50.0,
+            "type": "expense",
+            "category_id": "c1",
+            "date": datetime(2025, 1, 5),
+        }
+        db.collection.return_value.where.return_value.stream.side_effect = [[tx], []]
+
+        assert monthly_rollup.rebuild_user_rollups("u1") == (1, 1)
+
+    meta_ref = db.collection.return_value.document.return_value
+    writes = [c.args[0] for c in meta_ref.set.call_args_list]
+    assert writes[0]["ready"] is False
+    assert writes[-1]["ready"] is True
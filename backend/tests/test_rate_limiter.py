@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app.core import rate_limiter
+from fastapi import HTTPException
+from google.cloud import firestore
+
+NOW = datetime(2026, 3, 10, 15, 30, tzinfo=timezone.utc)
+
+
+def _snap(data):
+    snap = MagicMock()
+    snap.exists = data is not None
+    snap.to_dict.return_value = data
+    return snap
+
+
+def _reserve(data, pending=0, limit=50):
+    """Executa a função da transação (sem o wrapper de retry do Firestore)."""
+    transaction, ref = MagicMock(), MagicMock()
+    ref.get.return_value = _snap(data)
+    result = rate_limiter._reserve_in_transaction.to_wrap(
+        transaction, ref, "chat", limit, pending, NOW
+    )
+    update = transaction.set.call_args.args[1] if transaction.set.called else None
+    return result, update
+
+
+def test_window_counts_only_last_24_hours():
+    buckets = {
+        "2026031015": 3,  # hora atual
+        "2026030916": 2,  # 23h atrás (dentro)
+        "2026030915": 7,  # 24h atrás (fora)
+    }
+    assert rate_limiter._window_used(buckets, NOW) == 5
+
+
+def test_reserve_increments_current_bucket_and_drops_stale():
+    (allowed, used), update = _reserve(
+        {"buckets": {"chat": {"2026031014": 4, "2026030101": 9}}}, pending=2
+    )
+
+    assert allowed and used == 7
+    changes = update["buckets"]["chat"]
+    assert changes["2026031015"] == firestore.Increment(3)
+    assert changes["2026030101"] is firestore.DELETE_FIELD
+    assert "2026031014" not in changes
+
+
+def test_reserve_blocks_at_limit_but_keeps_pending_usage():
+    (allowed, used), update = _reserve(
+        {"buckets": {"chat": {"2026031015": 49}}}, pending=1
+    )
+
+    assert not allowed and used == 50
+    assert update["buckets"]["chat"] == {"2026031015": firestore.Increment(1)}
+
+
+def test_reserve_migrates_legacy_timestamp_list():
+    legacy = [NOW - timedelta(minutes=5), (NOW - timedelta(hours=30)).isoformat()]
+    (allowed, used), update = _reserve({"chat": legacy})
+
+    assert allowed and used == 2
+    assert update["buckets"]["chat"] == {"2026031015": 2}
+    assert update["chat"] is firestore.DELETE_FIELD
+
+
+def test_local_lease_serves_allows_without_firestore_reads():
+    limiter = rate_limiter.RateLimiter()
+    limiter._writer = MagicMock()
+
+    with patch.object(
+        rate_limiter, "_reserve_in_transaction", return_value=(True, 10)
+    ) as reserve, patch.object(rate_limiter, "get_db"):
+        for _ in range(1 + rate_limiter.LEASE_MAX):
+            limiter.check_limit("u1", "chat", "premium")
+
+    # 1 transação; os próximos LEASE_MAX usos saem da concessão local
+    reserve.assert_called_once()
+    limiter._writer.submit.assert_called_once_with(
+        limiter._flush_pending, ("u1", "chat")
+    )
+    assert limiter._leases[("u1", "chat")].pending == rate_limiter.LEASE_MAX
+
+
+def test_small_remaining_quota_always_goes_to_firestore():
+    limiter = rate_limiter.RateLimiter()
+
+    with patch.object(
+        rate_limiter, "_reserve_in_transaction", side_effect=[(True, 49), (False, 50)]
+    ) as reserve, patch.object(rate_limiter, "get_db"):
+        limiter.check_limit("u1", "chat", "pro")
+        with pytest.raises(HTTPException) as exc:
+            limiter.check_limit("u1", "chat", "pro")
+
+    assert exc.value.status_code == 429
+    assert reserve.call_count == 2
+
+
+def test_free_tier_is_blocked_without_io():
+    limiter = rate_limiter.RateLimiter()
+    with patch.object(rate_limiter, "get_db") as get_db:
+        with pytest.raises(HTTPException) as exc:
+            limiter.check_limit("u1", "chat", "free")
+    assert exc.value.status_code == 403
+    get_db.assert_not_called()
+
+
+def test_usage_info_reads_compact_state_plus_local_pending():
+    limiter = rate_limiter.RateLimiter()
+    limiter._leases[("u1", "chat")] = rate_limiter._Lease(0, 0.0)
+    limiter._leases[("u1", "chat")].pending = 2
+    now_key = rate_limiter._bucket_key(datetime.now(timezone.utc))
+
+    with patch.object(rate_limiter, "get_db") as get_db:
+        doc_ref = get_db.return_value.collection.return_value.document.return_value
+        doc_ref.get.return_value = _snap({"buckets": {"chat": {now_key: 5}}})
+        info = limiter.get_usage_info("u1", "chat", "pro")
+
+    assert info == {"used": 7, "limit": 50, "remaining": 43}
+
+
+def test_expired_leases_without_pending_usage_are_evicted():
+    limiter = rate_limiter.RateLimiter()
+    limiter._leases[("idle", "chat")] = rate_limiter._Lease(5, 0.0)
+    busy = rate_limiter._Lease(0, 0.0)
+    busy.pending = 3
+    limiter._leases[("busy", "chat")] = busy
+    flushed = rate_limiter._Lease(0, 0.0)
+    flushed.pending = 1
+    limiter._leases[("flushed", "chat")] = flushed
+
+    # Gravação do pendente de uma concessão vencida também a descarta
+    assert limiter._take_pending(("flushed", "chat")) == 1
+
+    with patch.object(
+        rate_limiter, "_reserve_in_transaction", return_value=(True, 10)
+    ), patch.object(rate_limiter, "get_db"):
+        limiter.check_limit("u1", "chat", "premium")
+
+    # Uso pendente ainda não gravado é mantido
+    assert set(limiter._leases) == {("busy", "chat"), ("u1", "chat")}
@@ -0,0 +1,58 @@
+import importlib
+import io
+from unittest.mock import MagicMock, patch
+
+from app.services import receipt_image
+from PIL import Image
+
+# app.services re-exporta a instância AIService com o mesmo nome do módulo
+ai_service = importlib.import_module("app.services.ai_service")
+
+
+def _png(size=(4000, 3000)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_prepare_receipt_downsizes_grayscales_and_is_idempotent():
+    content, mime = receipt_image.prepare_receipt(_png(), "image/png")
+
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(content)) as img:
+        assert img.format == "JPEG" and img.mode == "L"
+        assert max(img.size) == receipt_image.MAX_DIMENSION
+
+    # Reprocessar o anexo salvo não muda os bytes (mesmo hash de cache)
+    again, again_mime = receipt_image.prepare_receipt(content, mime)
+    assert again == content and again_mime == "image/jpeg"
+
+
+def test_prepare_receipt_passes_through_pdf_and_invalid_images():
+    assert receipt_image.prepare_receipt(b"%PDF-1.4", "application/pdf") == (
+        b"%PDF-1.4",
+        "application/pdf",
+    )
+    assert receipt_image.prepare_receipt(b"not an image", "image/png") == (
+        b"not an image",
+        "image/png",
+    )
+
+
+def test_parse_receipt_uses_content_hash_cache():
+    cached = {"title": "Padaria", "amount": 12.5, "items": []}
+    cache_doc = MagicMock(exists=True)
+    cache_doc.to_dict.return_value = {"result": cached}
+    db = MagicMock()
+    db.collection.return_value.document.return_value.get.return_value = cache_doc
+
+    with patch.object(ai_service, "client", MagicMock()), patch.object(
+        ai_service, "get_db", return_value=db
+    ), patch.object(ai_service, "_call_with_retry") as call_mock:
+        result = ai_service.parse_receipt(b"img", "image/jpeg", "u1")
+
+    assert result == cached
+    call_mock.assert_not_called()
+    digest = receipt_image.content_hash(b"img")
+    db.collection.assert_called_with("receipt_scans")
+    db.collection.return_value.document.assert_called_with(f"u1_{digest}")
@@ -143,13 +143,11 @@ class TestDebtServiceSecurity:
     def test_delete_debt_rejects_wrong_user(self):
         """Deleting another user's debt must fail."""
         with patch("app.services.debt_service.get_db") as mock_get_db, patch(
-            "app.services.debt_service.get_preferences"
+            "app.services.debt_service.get_subscription_tier"
         ) as mock_prefs:
             mock_db = MagicMock()
             mock_get_db.return_value = mock_db
-            mock_pref = MagicMock()
-            mock_pref.subscription_tier = "pro"
-            mock_prefs.return_value = mock_pref
+            mock_prefs.return_value = "pro"
 
             mock_doc = MagicMock()
             mock_doc.exists = True
@@ -170,10 +168,8 @@ class TestDebtServiceSecurity:
 
     def test_tier_check_blocks_free_users(self):
         """Free users must be blocked from debt operations."""
-        with patch("app.services.debt_service.get_preferences") as mock_prefs:
-            mock_pref = MagicMock()
-            mock_pref.subscription_tier = "free"
-            mock_prefs.return_value = mock_pref
+        with patch("app.services.debt_service.get_subscription_tier") as mock_prefs:
+            mock_prefs.return_value = "free"
 
             from app.services.debt_service import check_tier_eligibility
 
@@ -184,10 +180,8 @@ class TestDebtServiceSecurity:
 
     def test_tier_check_allows_pro_users(self):
         """Pro users must be allowed debt operations."""
-        with patch("app.services.debt_service.get_preferences") as mock_prefs:
-            mock_pref = MagicMock()
-            mock_pref.subscription_tier = "pro"
-            mock_prefs.return_value = mock_pref
+        with patch("app.services.debt_service.get_subscription_tier") as mock_prefs:
+            mock_prefs.return_value = "pro"
 
             from app.services.debt_service import check_tier_eligibility
 
@@ -196,10 +190,8 @@ class TestDebtServiceSecurity:
 
     def test_tier_check_allows_premium_users(self):
         """Premium users must be allowed debt operations."""
-        with patch("app.services.debt_service.get_preferences") as mock_prefs:
-            mock_pref = MagicMock()
-            mock_pref.subscription_tier = "premium"
-            mock_prefs.return_value = mock_pref
+        with patch("app.services.debt_service.get_subscription_tier") as mock_prefs:
+            mock_prefs.return_value = "premium"
 
             from app.services.debt_service import check_tier_eligibility
 
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app import worker
+from app.services import recurrence as recurrence_service
+
+
+def test_next_due_at_follows_last_processed_and_due_day():
+    data = {
+        "active": True,
+        "periodicity": "monthly",
+        "due_day": 31,
+        "last_processed_at": datetime(2025, 1, 31),
+    }
+    assert recurrence_service.compute_next_due_at(data) == datetime(2025, 2, 28)
+
+    # Primeira ocorrência: due_day do mês corrente
+    first = {"active": True, "periodicity": "monthly", "due_day": 10}
+    assert recurrence_service.compute_next_due_at(
+        first, today=datetime(2025, 3, 20, 15)
+    ) == datetime(2025, 3, 10)
+
+    yearly = {"active": True, "periodicity": "yearly", "due_day": 5, "due_month": 1}
+    assert recurrence_service.compute_next_due_at(
+        yearly, today=datetime(2025, 3, 20)
+    ) == datetime(2026, 1, 5)
+
+    assert recurrence_service.compute_next_due_at({**data, "active": False}) is None
+
+
+def test_parse_shard_and_partition():
+    assert worker.parse_shard("1/4") == (1, 4)
+    with pytest.raises(argparse.ArgumentTypeError):
+        worker.parse_shard("4/4")
+
+    users = [f"user-{i}" for i in range(50)]
+    owners = [[u for u in users if worker.in_shard(u, (i, 3))] for i in range(3)]
+    assert sorted(sum(owners, [])) == sorted(users)
+
+    # Fatias = intervalos disjuntos de shard_bucket, dentro do limite do `in`
+    buckets = [worker.shard_buckets((i, 4)) for i in range(4)]
+    assert sorted(sum(buckets, [])) == list(range(recurrence_service.SHARD_BUCKETS))
+    assert max(len(b) for b in buckets) <= 30
+    with pytest.raises(argparse.ArgumentTypeError):
+        worker.parse_shard(f"0/{recurrence_service.SHARD_BUCKETS + 1}")
+
+
+def test_default_shard_validates_cloud_run_task_env(monkeypatch):
+    monkeypatch.setenv("CLOUD_RUN_TASK_INDEX", "2")
+    monkeypatch.setenv("CLOUD_RUN_TASK_COUNT", "4")
+    assert worker.default_shard() == (2, 4)
+
+    # Mais tasks que buckets: fatias vazias falham antes de consultar
+    monkeypatch.setenv("CLOUD_RUN_TASK_INDEX", "3")
+    monkeypatch.setenv("CLOUD_RUN_TASK_COUNT", "40")
+    with pytest.raises(argparse.ArgumentTypeError):
+        worker.default_shard()
+
+    monkeypatch.delenv("CLOUD_RUN_TASK_INDEX")
+    monkeypatch.delenv("CLOUD_RUN_TASK_COUNT")
+    assert worker.default_shard() == (0, 1)
+
+
+def test_sharded_worker_filters_bucket_in_the_query():
+    db = MagicMock()
+    collection = db.collection.return_value
+    collection.where.return_value.where.return_value.stream.return_value = []
+
+    worker._due_recurrences_by_user(db, datetime(2025, 4, 10), (1, 3))
+
+    bucket_filter = collection.where.call_args.kwargs["filter"]
+    assert (bucket_filter.field_path, bucket_filter.op_string) == ("shard_bucket", "in")
+    assert bucket_filter.value == worker.shard_buckets((1, 3))
+    due_filter = collection.where.return_value.where.call_args.kwargs["filter"]
+    assert due_filter.field_path == "next_due_at"
+
+
+def _doc(doc_id, data):
+    doc = MagicMock()
+    doc.id = doc_id
+    doc.to_dict.return_value = data
+    return doc
+
+
+def test_worker_processes_only_due_recurrences_and_catches_up():
+    db = MagicMock()
+    rec = {
+        "user_id": "u1",
+        "name": "Aluguel",
+        "amount": 1500.0,
+        "active": True,
+        "periodicity": "monthly",
+        "due_day": 5,
+        "category_id": "c1",
+        "account_id": "a1",
+        "last_processed_at": datetime(2025, 1, 5),
+        "next_due_at": datetime(2025, 2, 5),
+        "skipped_dates": ["2025-03-05"],
+    }
+    db.collection.return_value.where.return_value.stream.return_value = [
+        _doc("r1", rec)
+    ]
+
+    with patch.object(worker, "get_db", return_value=db), patch.object(
+        worker.transaction_service, "create_transaction_once"
+    ) as create_mock, patch.object(worker, "datetime") as dt_mock:
+        dt_mock.now.return_value = datetime(2025, 4, 10)
+        dt_mock.fromisoformat = datetime.fromisoformat
+        processed = asyncio.run(worker.generate_due_recurrences(concurrency=2))
+
+    # Fev e Abr geradas, Mar pulada
+    assert processed == 2
+    dates = [c.args[0].date for c in create_mock.call_args_list]
+    assert dates == [datetime(2025, 2, 5), datetime(2025, 4, 5)]
+
+    query_filter = db.collection.return_value.where.call_args.kwargs["filter"]
+    assert query_filter.field_path == "next_due_at"
+    assert query_filter.op_string == "<="
+
+    # ID determinístico por vencimento, avanço da recorrência no mesmo batch
+    assert create_mock.call_args.args[2] == "rec_r1_20250405"
+    ((rec_ref, advance),) = create_mock.call_args.kwargs["extra_updates"]
+    assert advance == {
+        "last_processed_at": datetime(2025, 4, 5),
+        "next_due_at": datetime(2025, 5, 5),
+    }
+
+
+def test_worker_skips_occurrence_created_by_previous_run():
+    db = MagicMock()
+    rec = {
+        "user_id": "u1",
+        "name": "Aluguel",
+        "amount": 1500.0,
+        "periodicity": "monthly",
+        "due_day": 5,
+        "category_id": "c1",
+        "account_id": "a1",
+        "last_processed_at": datetime(2025, 3, 5),
+        "next_due_at": datetime(2025, 4, 5),
+    }
+
+    with patch.object(
+        worker.transaction_service, "create_transaction_once", return_value=None
+    ):
+        generated = worker._process_recurrence(db, "r1", rec, datetime(2025, 4, 10))
+
+    assert generated == 0
+    db.collection.return_value.document.return_value.update.assert_called_once_with(
+        {"last_processed_at": datetime(2025, 4, 5), "next_due_at": datetime(2025, 5, 5)}
+    )
+
+
+def test_auto_pay_queries_due_items_and_pays_per_user():
+    db = MagicMock()
+    pending = db.collection.return_value.where.return_value.where.return_value
+    due = [
+        _doc("t1", {"user_id": "u1"}),
+        _doc("t2", {"user_id": "u2"}),
+        _doc("t3", {"user_id": "u1"}),
+    ]
+    # `date` em string ISO (edição antiga): vencida entra, futura não
+    legacy = [
+        _doc("t4", {"user_id": "u2", "date": "2025-04-10T08:00:00"}),
+        _doc("t5", {"user_id": "u2", "date": "2025-04-11T08:00:00-03:00"}),
+    ]
+
+    def where(filter):
+        query = MagicMock()
+        query.stream.return_value = due if filter.op_string == "<=" else legacy
+        return query
+
+    pending.where.side_effect = where
+
+    with patch.object(worker, "get_db", return_value=db), patch.object(
+        worker.transaction_service,
+        "pay_transactions",
+        side_effect=lambda uid, snaps: len(snaps),
+    ) as pay_mock, patch.object(worker, "datetime") as dt_mock:
+        dt_mock.now.return_value = datetime(2025, 4, 10, 12)
+        paid = asyncio.run(worker.process_auto_payments())
+
+    assert paid == 4
+    filters = [c.kwargs["filter"] for c in pending.where.call_args_list]
+    assert [(f.field_path, f.op_string) for f in filters] == [
+        ("date", "<="),
+        ("date", ">="),
+    ]
+    by_user = {c.args[0]: [s.id for s in c.args[1]] for c in pay_mock.call_args_list}
+    assert by_user == {"u1": ["t1", "t3"], "u2": ["t2", "t4"]}
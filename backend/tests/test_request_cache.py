@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock, patch
+
+from app.core import request_cache
+from app.services import account as account_service
+
+
+def _account_doc(doc_id, balance):
+    doc = MagicMock()
+    doc.id = doc_id
+    doc.to_dict.return_value = {
+        "name": "Conta",
+        "type": "checking",
+        "balance": balance,
+        "user_id": "u1",
+    }
+    return doc
+
+
+def test_memoize_is_noop_outside_request_scope():
+    calls = []
+
+    @request_cache.memoize("things")
+    def load(user_id):
+        calls.append(user_id)
+        return [user_id]
+
+    load("u1")
+    load("u1")
+
+    assert calls == ["u1", "u1"]
+
+
+def test_list_accounts_reads_once_per_request():
+    with patch("app.services.account.get_db") as mock_get_db:
+        db = MagicMock()
+        mock_get_db.return_value = db
+        db.collection.return_value.where.return_value.stream.return_value = [
+            _account_doc("a1", 10.0)
+        ]
+
+        with request_cache.request_scope():
+            first = account_service.list_accounts("u1")
+            first.append("mutated by caller")
+            second = account_service.list_accounts("u1")
+
+    assert db.collection.return_value.where.return_value.stream.call_count == 1
+    assert [a.id for a in second] == ["a1"]
+
+
+def test_writes_invalidate_memoized_reads():
+    with patch("app.services.account.get_db") as mock_get_db:
+        db = MagicMock()
+        mock_get_db.return_value = db
+        stream = db.collection.return_value.where.return_value.stream
+        stream.side_effect = [[_account_doc("a1", 10.0)], [_account_doc("a1", 25.0)]]
+
+        snapshot = db.collection.return_value.document.return_value.get.return_value
+        snapshot.exists = True
+        snapshot.to_dict.return_value = {"user_id": "u1"}
+
+        with request_cache.request_scope():
+            assert account_service.list_accounts("u1")[0].balance == 10.0
+            account_service.delete_account("a1", "u1")
+            assert account_service.list_accounts("u1")[0].balance == 25.0
+
+    assert stream.call_count == 2
@@ -293,6 +293,7 @@ class TestTransactionIsolation:
             # Mock query chain
             mock_query = MagicMock()
             mock_query.where.return_value = mock_query
+            mock_query.order_by.return_value = mock_query
             mock_query.stream.return_value = iter([])
             mock_db_transaction.collection.return_value.where.return_value = mock_query
 
@@ -405,13 +406,11 @@ class TestSubscriptionSecurity:
             assert "Você ainda não possui uma assinatura vinculada" in exc_info.value.detail
     def test_subscription_tier_check_enforced_on_premium_features(self):
         """Free users are blocked from premium-only features (document analysis)."""
-        with patch("app.services.document_analysis.get_preferences") as pref_mock:
+        with patch("app.services.document_analysis.get_subscription_tier") as pref_mock:
             from app.services.document_analysis import DocumentAnalysisService
 
             # Mock a free-tier user
-            free_prefs = MagicMock()
-            free_prefs.subscription_tier = "free"
-            pref_mock.return_value = free_prefs
+            pref_mock.return_value = "free"
 
             # DocumentAnalysisService returns error dict (not raises) for free users
             result = DocumentAnalysisService.analyze_debt_document(
@@ -434,14 +433,13 @@ class TestBalanceManipulation:
     def test_balance_update_rejects_foreign_account(self, mock_db_transaction):
         """_update_account_balance should not modify accounts not owned by user."""
         mock_doc = MagicMock()
+        mock_doc.id = "acc_user_a"
         mock_doc.exists = True
         mock_doc.to_dict.return_value = {
             "user_id": USER_A,
             "balance": 1000.0,
         }
-        mock_db_transaction.collection.return_value.document.return_value.get.return_value = (
-            mock_doc
-        )
+        mock_db_transaction.get_all.return_value = [mock_doc]
 
         # User B tries to affect User A's account balance
         transaction_service._update_account_balance(
@@ -454,19 +452,18 @@ class TestBalanceManipulation:
         )
 
         # Balance should NOT be updated (user_id mismatch)
-        mock_db_transaction.collection.return_value.document.return_value.update.assert_not_called()
+        mock_db_transaction.batch.return_value.update.assert_not_called()
 
     def test_balance_update_allows_owner(self, mock_db_transaction):
         """_update_account_balance should work for the legitimate owner."""
         mock_doc = MagicMock()
+        mock_doc.id = "acc_user_a"
         mock_doc.exists = True
         mock_doc.to_dict.return_value = {
             "user_id": USER_A,
             "balance": 1000.0,
         }
-        mock_db_transaction.collection.return_value.document.return_value.get.return_value = (
-            mock_doc
-        )
+        mock_db_transaction.get_all.return_value = [mock_doc]
 
         transaction_service._update_account_balance(
             mock_db_transaction,
@@ -477,14 +474,10 @@ class TestBalanceManipulation:
             revert=False,
         )
 
-        # Balance should be updated
-        mock_db_transaction.collection.return_value.document.return_value.update.assert_called_once()
-        call_args = mock_db_transaction.collection.return_value.document.return_value.update.call_args[
-            0
-        ][
-            0
-        ]
-        assert call_args["balance"] == 500.0  # 1000 - 500
+        # Balance should be updated with a server-side increment
+        mock_db_transaction.batch.return_value.update.assert_called_once()
+        call_args = mock_db_transaction.batch.return_value.update.call_args[0][1]
+        assert call_args["balance"].value == -500.0
 
 
 # ============================================================
@@ -546,6 +539,7 @@ class TestN1QueryFix:
 
             mock_query = MagicMock()
             mock_query.where.return_value = mock_query
+            mock_query.order_by.return_value = mock_query
             mock_query.stream.return_value = iter(mock_transactions)
             mock_db_transaction.collection.return_value.where.return_value = mock_query
 
@@ -597,6 +591,7 @@ class TestN1QueryFix:
 
             mock_query = MagicMock()
             mock_query.where.return_value = mock_query
+            mock_query.order_by.return_value = mock_query
             mock_query.stream.return_value = iter([mock_t])
             mock_db_transaction.collection.return_value.where.return_value = mock_query
 
@@ -1,5 +1,5 @@
 import asyncio
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 import stripe
@@ -317,3 +317,29 @@ def test_webhook_invalid_payload(mock_construct_event, stripe_service):
         asyncio.run(stripe_service.handle_webhook(b"invalid_payload", "sig"))
     assert exc_info.value.status_code == 400
     assert exc_info.value.detail == "Invalid payload"
+
+
+def test_subscription_change_propagates_tier(stripe_service, mock_db):
+    mock_user_doc = MagicMock()
+    mock_user_doc.reference.id = "user_123"
+    mock_db.collection().where().limit().stream.return_value = [mock_user_doc]
+    mock_db.collection().document().get.return_value.exists = False
+
+    with patch("app.services.user_preference.set_subscription_tier") as set_tier:
+        asyncio.run(
+            stripe_service._handle_subscription_deleted({"customer": "cus_123"})
+        )
+
+    set_tier.assert_called_once_with("user_123", "free")
+
+
+def test_propagate_tier_runs_off_the_event_loop(stripe_service):
+    with patch(
+        "app.services.stripe_service.asyncio.to_thread", new_callable=AsyncMock
+    ) as to_thread, patch(
+        "app.services.user_preference.set_subscription_tier"
+    ) as set_tier:
+        asyncio.run(stripe_service._propagate_tier("user_123", "pro"))
+
+    # Chamadas bloqueantes ao Firebase Auth vão para uma thread
+    to_thread.assert_awaited_once_with(set_tier, "user_123", "pro")
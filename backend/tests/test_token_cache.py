@@ -0,0 +1,107 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app.core import security
+from fastapi import HTTPException
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    security.clear_token_cache()
+    yield
+    security.clear_token_cache()
+
+
+def _claims(uid="u1", ttl=3600, **extra):
+    now = int(time.time())
+    return {"uid": uid, "iat": now - 10, "exp": now + ttl, **extra}
+
+
+def _creds(token):
+    creds = MagicMock()
+    creds.credentials = token
+    return creds
+
+
+def test_repeated_token_skips_verification():
+    with patch.object(security, "auth") as mock_auth:
+        mock_auth.verify_id_token.return_value = _claims()
+
+        first = security.get_current_user(_creds("tok-a"))
+        second = security.get_current_user(_creds("tok-a"))
+        security.get_current_user(_creds("tok-b"))
+
+    assert first == second
+    assert first is not second
+    assert mock_auth.verify_id_token.call_count == 2
+
+
+def test_expired_entries_are_verified_again():
+    with patch.object(security, "auth") as mock_auth:
+        mock_auth.verify_id_token.return_value = _claims(ttl=-1)
+
+        security.verify_token("tok")
+        security.verify_token("tok")
+
+    # Token sem `exp` futuro não entra no cache
+    assert mock_auth.verify_id_token.call_count == 2
+
+
+def test_cache_is_bounded():
+    with patch.object(security, "auth") as mock_auth, patch.object(
+        security, "TOKEN_CACHE_MAX_ENTRIES", 2
+    ):
+        mock_auth.verify_id_token.return_value = _claims()
+        for token in ("a", "b", "c"):
+            security.verify_token(token)
+        security.verify_token("a")
+
+    assert len(security._token_cache) == 2
+    assert mock_auth.verify_id_token.call_count == 4
+
+
+def test_revoked_user_tokens_are_rejected():
+    with patch.object(security, "auth") as mock_auth:
+        mock_auth.RevokedIdTokenError = ValueError
+        mock_auth.verify_id_token.return_value = _claims(
+            auth_time=int(time.time()) - 60
+        )
+        security.get_current_user(_creds("tok"))
+
+        security.revoke_user_tokens("u1")
+
+        with pytest.raises(HTTPException) as exc:
+            security.get_current_user(_creds("tok"))
+        assert security.get_current_user_optional(_creds("tok")) is None
+
+    assert exc.value.status_code == 401
+    assert security._token_cache == {}
+
+
+def test_warm_public_keys_fetches_certificates():
+    verifier = MagicMock()
+    with patch.object(security.auth, "_get_client") as get_client:
+        get_client.return_value._token_verifier = verifier
+        assert security.warm_public_keys() is True
+
+    verifier.request.assert_called_once_with(security._token_gen.ID_TOKEN_CERT_URI)
+
+
+def test_warm_public_keys_internals_still_exist():
+    """Caminho interno usado por warm_public_keys (quebra ao atualizar o SDK)."""
+    # Pacote real via o módulo já importado (outros testes trocam sys.modules)
+    utils = security.auth._utils
+    firebase_admin = utils.firebase_admin
+
+    app = firebase_admin.initialize_app(
+        utils.EmulatorAdminCredentials(),
+        {"projectId": "demo"},
+        name="warm-keys-contract",
+    )
+    try:
+        verifier = security.auth._get_client(app)._token_verifier
+        assert callable(verifier.request)
+        assert security._token_gen.ID_TOKEN_CERT_URI.startswith("https://")
+    finally:
+        firebase_admin.delete_app(app)
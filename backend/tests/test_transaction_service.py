@@ -10,8 +10,10 @@ from app.schemas.transaction import (
     TransactionCreate,
     TransactionStatus,
     TransactionType,
+    TransactionUpdate,
 )
 from app.services import transaction as transaction_service
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 
 
 @pytest.fixture
@@ -67,10 +69,12 @@ def test_create_transaction_simple(mock_db, mock_external_services):
 
     mock_doc_ref = MagicMock()
     mock_doc_ref.id = "trans1"
-    mock_db.collection.return_value.add.return_value = (None, mock_doc_ref)
+    mock_db.collection.return_value.document.return_value = mock_doc_ref
+    batch = mock_db.batch.return_value
 
     # Execute
-    result = transaction_service.create_transaction(t_in, user_id)
+    with patch("app.services.transaction.monthly_rollup") as rollup_mock:
+        result = transaction_service.create_transaction(t_in, user_id)
 
     # Verify
     assert result.id == "trans1"
@@ -84,8 +88,15 @@ def test_create_transaction_simple(mock_db, mock_external_services):
         user_id,
         revert=False,
         destination_account_id=t_in.destination_account_id,
+        owned_account_ids={"acc1"},
+        batch=batch,
     )
-    mock_db.collection.return_value.add.assert_called_once()
+    # Documento, saldo e agregado mensal no mesmo commit
+    batch.set.assert_called_once()
+    assert batch.set.call_args.args[0] is mock_doc_ref
+    assert rollup_mock.apply_transaction.call_args.kwargs["batch"] is batch
+    batch.commit.assert_called_once()
+    mock_db.collection.return_value.add.assert_not_called()
 
 
 def test_create_unified_transaction_installments(mock_db, mock_external_services):
@@ -120,36 +131,56 @@ def test_create_unified_transaction_installments(mock_db, mock_external_services
         id="acc1", name="Bank", type="checking", balance=1000, user_id=user_id
     )
 
-    # Mock db add - returns distinct IDs
-    def add_side_effect(data):
-        m = MagicMock()
-        m.id = f"trans_{data['installment_number']}"
-        return (None, m)
+    # Parcelas são gravadas num WriteBatch com IDs gerados pelo cliente
+    doc_refs = [MagicMock(id=f"trans_{i}") for i in range(1, 4)]
+    mock_db.collection.return_value.document.side_effect = doc_refs
+    batch = mock_db.batch.return_value
 
-    mock_db.collection.return_value.add.side_effect = add_side_effect
+    with patch("app.services.transaction.analysis_service") as analysis_mock, patch(
+        "app.services.transaction._apply_balance_deltas"
+    ) as deltas_mock, patch(
+        "app.services.transaction.category_stats"
+    ) as stats_mock, patch(
+        "app.services.transaction.monthly_rollup"
+    ) as rollup_mock:
+        rollup_mock.touched_months.return_value = {"2023-01"}
+        analysis_mock.analyze_transaction.return_value = None
 
-    # Execute
-    results = transaction_service.create_unified_transaction(t_in, user_id)
+        # Execute
+        results = transaction_service.create_unified_transaction(t_in, user_id)
 
     # Verify
     assert len(results) == 3
+    assert [r.id for r in results] == ["trans_1", "trans_2", "trans_3"]
 
-    # Check 1st Installment
+    # Check 1st Installment (keeps input status PAID)
     assert results[0].description == "Laptop (1/3)"
-    # Status should be respected (PAID)
-    # The code passes the input status to the first one?
-    # Logic: if i==0: pass (keeps input status).
-    # Since t_in.status is PAID, first should be PAID.
-    # Check if balance updated for first
-    # Implementation calls create_transaction for each. create_transaction calls balance update if PAID.
-    # So balance update should be called for the first one.
 
     # Check 2nd Installment
     assert results[1].description == "Laptop (2/3)"
     assert results[1].status == TransactionStatus.PENDING  # Others are PENDING
 
-    # Verify balance calls: Should be 1 (only first is paid)
-    assert balance_mock.call_count == 1
+    # Category/account validated and anomaly analysis run only once
+    cat_mock.get_category.assert_called_once()
+    acc_mock.get_account.assert_called_once()
+    analysis_mock.analyze_transaction.assert_called_once()
+
+    # One batch: 3 sets + combined balance delta (only first is paid)
+    assert batch.set.call_count == 3
+    mock_db.collection.return_value.add.assert_not_called()
+    balance_mock.assert_not_called()
+    deltas_mock.assert_called_once()
+    assert deltas_mock.call_args.args[1] == {"acc1": -100.0}
+    assert deltas_mock.call_args.kwargs["batch"] is batch
+    # Agregados mensais das parcelas entram no mesmo commit
+    rollup_mock.apply_transactions.assert_called_once()
+    assert len(rollup_mock.apply_transactions.call_args.args[2]) == 3
+    assert rollup_mock.apply_transactions.call_args.kwargs["batch"] is batch
+    batch.commit.assert_called_once()
+
+    # Estatísticas de anomalia recebem as 3 parcelas numa única chamada
+    stats_mock.record_expenses.assert_called_once()
+    assert len(stats_mock.record_expenses.call_args.args[2]) == 3
 
 
 def test_create_unified_transaction_recurrence(mock_db, mock_external_services):
@@ -184,10 +215,11 @@ def test_create_unified_transaction_recurrence(mock_db, mock_external_services):
         id="acc1", name="Bank", type="checking", balance=1000, user_id=user_id
     )
 
-    mock_db.collection.return_value.add.return_value = (None, MagicMock(id="trans1"))
+    mock_db.collection.return_value.document.return_value = MagicMock(id="trans1")
 
     # Execute
-    results = transaction_service.create_unified_transaction(t_in, user_id)
+    with patch("app.services.transaction.monthly_rollup"):
+        results = transaction_service.create_unified_transaction(t_in, user_id)
 
     # Verify
     assert len(results) == 1
@@ -213,11 +245,14 @@ def test_delete_transaction_simple(mock_db, mock_external_services):
     mock_doc.reference = mock_doc_ref
     mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
 
+    batch = mock_db.batch.return_value
+
     # Execute
-    transaction_service.delete_transaction("trans1", user_id)
+    with patch("app.services.transaction.monthly_rollup") as rollup_mock:
+        transaction_service.delete_transaction("trans1", user_id)
 
     # Verify
-    mock_doc_ref.delete.assert_called_once()
+    batch.delete.assert_called_once_with(mock_doc_ref)
     # Should revert balance because it was PAID expense
     balance_mock.assert_called_once_with(
         mock_db,
@@ -227,4 +262,371 @@ def test_delete_transaction_simple(mock_db, mock_external_services):
         user_id,
         revert=True,
         destination_account_id=None,
+        batch=batch,
+    )
+    rollup_mock.apply_transaction.assert_called_once_with(
+        mock_db, user_id, mock_doc.to_dict.return_value, sign=-1, batch=batch
+    )
+    batch.commit.assert_called_once()
+
+
+def test_update_expense_amount_refreshes_category_stats(
+    mock_db, mock_external_services
+):
+    cat_mock, acc_mock, _, _ = mock_external_services
+    user_id = "user123"
+    cat_mock.get_category.return_value = None
+    acc_mock.get_account.return_value = None
+
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "user_id": user_id,
+        "title": "Mercado",
+        "amount": 5000.0,
+        "type": "expense",
+        "account_id": "acc1",
+        "category_id": "cat1",
+        "payment_method": "other",
+        "status": TransactionStatus.PENDING,
+        "date": datetime(2025, 4, 1),
+    }
+    mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+
+    with patch.object(transaction_service, "monthly_rollup"), patch.object(
+        transaction_service, "category_classifier"
+    ), patch.object(transaction_service, "category_stats") as stats_mock:
+        transaction_service.update_transaction(
+            "trans1", TransactionUpdate(amount=50.0, category_id="cat2"), user_id
+        )
+        # Valor digitado errado sai da janela das duas categorias
+        stats_mock.refresh_categories.assert_called_once_with(
+            mock_db, user_id, {"cat1", "cat2"}
+        )
+
+        stats_mock.refresh_categories.reset_mock()
+        transaction_service.update_transaction(
+            "trans1", TransactionUpdate(title="Feira"), user_id
+        )
+        stats_mock.refresh_categories.assert_called_once_with(mock_db, user_id, set())
+
+
+def test_delete_expense_refreshes_category_stats(mock_db, mock_external_services):
+    user_id = "user123"
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "user_id": user_id,
+        "amount": 5000.0,
+        "type": "expense",
+        "account_id": "acc1",
+        "category_id": "cat1",
+        "status": TransactionStatus.PENDING,
+    }
+    mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+
+    with patch.object(transaction_service, "monthly_rollup"), patch.object(
+        transaction_service, "category_stats"
+    ) as stats_mock:
+        transaction_service.delete_transaction("trans1", user_id)
+
+    stats_mock.refresh_categories.assert_called_once_with(mock_db, user_id, {"cat1"})
+
+
+def test_update_transaction_keeps_dates_as_timestamps(
+    mock_db, mock_external_services
+):
+    cat_mock, acc_mock, _, _ = mock_external_services
+    user_id = "user123"
+    cat_mock.get_category.return_value = None
+    acc_mock.get_account.return_value = Account(
+        id="acc1", name="Bank", type="checking", balance=100, user_id=user_id
     )
+
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "user_id": user_id,
+        "title": "Aluguel",
+        "description": "Aluguel",
+        "amount": 50.0,
+        "type": "expense",
+        "account_id": "acc1",
+        "category_id": "cat1",
+        "payment_method": "other",
+        "status": TransactionStatus.PENDING,
+        "date": datetime(2025, 4, 1),
+    }
+    mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+
+    new_date = datetime(2025, 4, 10, 8)
+    with patch.object(transaction_service, "monthly_rollup"), patch.object(
+        transaction_service, "category_classifier"
+    ):
+        transaction_service.update_transaction(
+            "trans1", TransactionUpdate(date=new_date, status="pending"), user_id
+        )
+
+    batch = mock_db.batch.return_value
+    assert batch.update.call_args.args[0] is mock_doc.reference
+    written = batch.update.call_args.args[1]
+    # Timestamp, não string ISO: o worker consulta `date <= hoje`
+    assert written["date"] == new_date
+    assert written["status"] == "pending"
+
+
+def test_list_transactions_pushes_limit_without_date_range(mock_db, mock_external_services):
+    cat_mock, acc_mock, _, _ = mock_external_services
+    cat_mock.list_all_categories_flat.return_value = []
+    acc_mock.list_accounts.return_value = []
+
+    mock_query = MagicMock()
+    mock_query.where.return_value = mock_query
+    mock_query.order_by.return_value = mock_query
+    mock_query.limit.return_value = mock_query
+    mock_query.stream.return_value = iter([])
+    mock_db.collection.return_value.where.return_value = mock_query
+
+    transaction_service.list_transactions("user123", limit=15)
+
+    mock_query.order_by.assert_called_once()
+    mock_query.limit.assert_called_once_with(15)
+
+
+def test_list_transactions_falls_back_when_index_missing(mock_db, mock_external_services):
+    from google.api_core.exceptions import FailedPrecondition
+
+    cat_mock, acc_mock, _, _ = mock_external_services
+    cat_mock.list_all_categories_flat.return_value = []
+    acc_mock.list_accounts.return_value = []
+
+    def failing_stream():
+        raise FailedPrecondition("The query requires an index")
+        yield  # pragma: no cover
+
+    planned_query = MagicMock()
+    planned_query.where.return_value = planned_query
+    planned_query.order_by.return_value = planned_query
+    planned_query.limit.return_value = planned_query
+    planned_query.stream.side_effect = failing_stream
+
+    fallback_query = MagicMock()
+    docs = []
+    for i, day in enumerate([5, 20, 12]):
+        doc = MagicMock()
+        doc.id = f"t{i}"
+        doc.to_dict.return_value = {
+            "user_id": "user123",
+            "title": f"Compra {i}",
+            "amount": 10.0,
+            "type": "expense",
+            "category_id": "cat1",
+            "account_id": "acc1",
+            "date": datetime(2024, 1, day),
+            "payment_method": "pix",
+        }
+        docs.append(doc)
+    fallback_query.stream.return_value = iter(docs)
+
+    mock_db.collection.return_value.where.side_effect = [planned_query, fallback_query]
+
+    result = transaction_service.list_transactions(
+        "user123", start_date=datetime(2024, 1, 10), limit=1
+    )
+
+    # Fallback filtra, ordena e corta em memória
+    assert [t.id for t in result] == ["t1"]
+
+
+def _tx_doc(doc_id, day):
+    doc = MagicMock()
+    doc.id = doc_id
+    doc.to_dict.return_value = {
+        "user_id": "user123",
+        "title": f"Compra {doc_id}",
+        "amount": 10.0,
+        "type": "expense",
+        "category_id": "cat1",
+        "account_id": "acc1",
+        "date": datetime(2024, 1, day),
+        "payment_method": "pix",
+    }
+    return doc
+
+
+def test_cursor_roundtrip():
+    cursor = transaction_service.encode_cursor("t1", datetime(2024, 1, 5, 10, 30))
+    assert transaction_service.decode_cursor(cursor) == {
+        "date": datetime(2024, 1, 5, 10, 30),
+        "__name__": "t1",
+    }
+
+    with pytest.raises(ValueError):
+        transaction_service.decode_cursor("not-a-cursor")
+
+
+def test_transactions_route_rejects_only_bad_cursors(client):
+    with patch.object(transaction_service, "list_transactions_page") as page_mock:
+        response = client.get("/api/transactions?cursor=not-a-cursor")
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+        page_mock.assert_not_called()
+
+        # Outros ValueError (ex: datas) não viram "Invalid cursor"
+        page_mock.side_effect = ValueError("bad date")
+        response = client.get("/api/transactions?page_size=10")
+        assert response.status_code == 500
+
+
+def test_iter_transactions_walks_pages_with_start_after(mock_db, mock_external_services):
+    cat_mock, acc_mock, _, _ = mock_external_services
+    cat_mock.list_all_categories_flat.return_value = []
+    acc_mock.list_accounts.return_value = []
+
+    mock_query = MagicMock()
+    mock_query.where.return_value = mock_query
+    mock_query.order_by.return_value = mock_query
+    mock_query.start_after.return_value = mock_query
+    mock_query.limit.return_value = mock_query
+    mock_query.stream.side_effect = [
+        iter([_tx_doc("t3", 20), _tx_doc("t2", 12)]),
+        iter([_tx_doc("t1", 5)]),
+    ]
+    mock_db.collection.return_value.where.return_value = mock_query
+
+    result = list(transaction_service.iter_transactions("user123", page_size=2))
+
+    assert [t.id for t in result] == ["t3", "t2", "t1"]
+    mock_query.start_after.assert_called_once_with(
+        {"date": datetime(2024, 1, 12), "__name__": "t2"}
+    )
+    assert mock_query.stream.call_count == 2
+
+
+def test_list_transactions_page_returns_cursor_only_when_full(
+    mock_db, mock_external_services
+):
+    cat_mock, acc_mock, _, _ = mock_external_services
+    cat_mock.list_all_categories_flat.return_value = []
+    acc_mock.list_accounts.return_value = []
+
+    mock_query = MagicMock()
+    mock_query.where.return_value = mock_query
+    mock_query.order_by.return_value = mock_query
+    mock_query.limit.return_value = mock_query
+    mock_query.stream.return_value = iter([_tx_doc("t1", 5)])
+    mock_db.collection.return_value.where.return_value = mock_query
+
+    items, next_cursor = transaction_service.list_transactions_page(
+        "user123", page_size=10
+    )
+
+    assert [t.id for t in items] == ["t1"]
+    assert next_cursor is None
+    mock_query.limit.assert_called_once_with(10)
+    mock_query.start_after.assert_not_called()
+
+
+def test_create_transaction_once_is_idempotent(mock_db, mock_external_services):
+    cat_mock, acc_mock, _, balance_mock = mock_external_services
+    user_id = "user123"
+    cat_mock.get_category.return_value = Category(
+        id="cat1",
+        name="Home",
+        type="expense",
+        icon="",
+        color="",
+        is_custom=False,
+        user_id=user_id,
+    )
+    acc_mock.get_account.return_value = Account(
+        id="acc1", name="Bank", type="checking", balance=100, user_id=user_id
+    )
+    t_in = TransactionCreate(
+        title="Aluguel (04/2025)",
+        amount=1500.0,
+        type=TransactionType.EXPENSE,
+        category_id="cat1",
+        account_id="acc1",
+        date=datetime(2025, 4, 5),
+        status=TransactionStatus.PENDING,
+        payment_method=PaymentMethod.OTHER,
+    )
+    rec_ref = MagicMock()
+    batch = mock_db.batch.return_value
+
+    with patch("app.services.transaction.monthly_rollup") as rollup_mock, patch(
+        "app.services.transaction.category_stats"
+    ), patch(
+        "app.services.transaction.category_classifier"
+    ) as classifier_mock, patch(
+        "app.services.transaction.analysis_service"
+    ) as analysis_mock:
+        analysis_mock.analyze_transaction.return_value = None
+        result = transaction_service.create_transaction_once(
+            t_in, user_id, "rec_r1_20250405", [(rec_ref, {"next_due_at": None})]
+        )
+
+        mock_db.collection.return_value.document.assert_called_with("rec_r1_20250405")
+        batch.create.assert_called_once()
+        batch.update.assert_called_once_with(rec_ref, {"next_due_at": None})
+        batch.commit.assert_called_once()
+        # Agregado mensal vai no mesmo batch: se o create falha, ele também
+        assert rollup_mock.apply_transaction.call_args.kwargs["batch"] is batch
+        classifier_mock.learn.assert_called_once()
+        assert result.id == "rec_r1_20250405"
+
+        # Segunda execução: o documento já existe, nada é reaplicado
+        batch.commit.side_effect = AlreadyExists("exists")
+        assert (
+            transaction_service.create_transaction_once(t_in, user_id, "rec_r1_20250405")
+            is None
+        )
+        classifier_mock.learn.assert_called_once()
+
+    balance_mock.assert_not_called()
+
+
+def _pending(doc_id, account_id, amount, t_type="expense"):
+    snap = MagicMock()
+    snap.id = doc_id
+    snap.to_dict.return_value = {
+        "account_id": account_id,
+        "amount": amount,
+        "type": t_type,
+        "status": "pending",
+    }
+    return snap
+
+
+def test_pay_transactions_aggregates_balance_per_account(mock_db):
+    snaps = [
+        _pending("t1", "acc1", 100.0),
+        _pending("t2", "acc1", 50.0),
+        _pending("t3", "acc2", 30.0, "income"),
+    ]
+    batch = mock_db.batch.return_value
+
+    with patch("app.services.transaction._apply_balance_deltas") as deltas_mock:
+        paid = transaction_service.pay_transactions("user123", snaps)
+
+    assert paid == 3
+    assert batch.update.call_count == 3
+    assert batch.update.call_args.args[1]["status"] == "paid"
+    batch.commit.assert_called_once()
+    assert deltas_mock.call_args.args[1] == {"acc1": -150.0, "acc2": 30.0}
+    assert deltas_mock.call_args.kwargs["batch"] is batch
+
+
+def test_pay_transactions_skips_items_changed_since_read(mock_db):
+    snaps = [_pending("t1", "acc1", 100.0), _pending("t2", "acc1", 50.0)]
+    batch = mock_db.batch.return_value
+    # Lote falha (t2 mudou); item a item: t1 grava, t2 falha de novo
+    stale = FailedPrecondition("stale")
+    batch.commit.side_effect = [stale, None, stale]
+
+    with patch("app.services.transaction._apply_balance_deltas"):
+        paid = transaction_service.pay_transactions("user123", snaps)
+
+    assert paid == 1
+    assert batch.commit.call_count == 3
@@ -115,3 +115,65 @@ def test_upload_avatar():
 
         assert "signed=true" in result
         mock_storage_service.upload_file.assert_called_once()
+
+
+def _tier_db(mock_get_db, tier):
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {"subscription_tier": tier}
+    mock_db = MagicMock()
+    mock_db.collection.return_value.document.return_value.get.return_value = mock_doc
+    mock_get_db.return_value = mock_db
+    return mock_db.collection.return_value.document.return_value
+
+
+def test_subscription_tier_from_token_claim():
+    """A verified `tier` claim avoids the Firestore read."""
+    from app.services import user_preference
+
+    user_preference.clear_tier_cache()
+    with patch("app.services.user_preference.get_db") as mock_get_db:
+        doc_ref = _tier_db(mock_get_db, "free")
+        claims = {"uid": "u1", "tier": "premium", "iat": 100}
+
+        assert user_preference.get_subscription_tier("u1", claims) == "premium"
+        doc_ref.get.assert_not_called()
+
+
+def test_subscription_tier_cached_without_claim():
+    """Without the claim, Firestore is read once and cached."""
+    from app.services import user_preference
+
+    user_preference.clear_tier_cache()
+    with patch("app.services.user_preference.get_db") as mock_get_db:
+        doc_ref = _tier_db(mock_get_db, "pro")
+
+        assert user_preference.get_subscription_tier("u1") == "pro"
+        assert user_preference.get_subscription_tier("u1", {"uid": "u1"}) == "pro"
+        doc_ref.get.assert_called_once()
+        doc_ref.set.assert_not_called()
+
+
+def test_webhook_tier_change_overrides_stale_claim():
+    """After a plan change, older tokens' claims are ignored."""
+    from app.services import user_preference
+
+    user_preference.clear_tier_cache()
+    with patch("app.services.user_preference.auth") as mock_auth, patch(
+        "app.services.user_preference.get_db"
+    ) as mock_get_db:
+        mock_auth.get_user.return_value.custom_claims = {"admin": True}
+        doc_ref = _tier_db(mock_get_db, "free")
+
+        user_preference.set_subscription_tier("u1", "free")
+        mock_auth.set_custom_user_claims.assert_called_once_with(
+            "u1", {"admin": True, "tier": "free"}
+        )
+
+        stale = {"uid": "u1", "tier": "premium", "iat": 100}
+        assert user_preference.get_subscription_tier("u1", stale) == "free"
+
+        # Cache local vencido: a claim velha continua ignorada
+        user_preference._tier_cache.clear()
+        assert user_preference.get_subscription_tier("u1", stale) == "free"
+        doc_ref.get.assert_called_once()
@@ -0,0 +1,158 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.api import jobs
+from app.services import weekly_report
+
+
+def _user(uid, **data):
+    doc = MagicMock()
+    doc.id = uid
+    doc.to_dict.return_value = {"email": f"{uid}@example.com", **data}
+    return doc
+
+
+def test_current_run_id_is_iso_week():
+    assert weekly_report.current_run_id(datetime(2026, 10, 12)) == "2026-W42"
+
+
+def test_run_resumes_from_cursor_and_checkpoints_each_page():
+    db = MagicMock()
+    pages = [
+        [_user("u3"), _user("u4", last_weekly_report_run="2026-W42")],
+        [_user("u5", email=None)],
+    ]
+    running = 0
+    peak = 0
+
+    async def send(db_, user_id, user_data, start, end, timer, mailer):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        with timer.stage("email"):
+            await asyncio.sleep(0)
+        running -= 1
+        return True
+
+    with patch.object(weekly_report, "get_db", return_value=db), patch.object(
+        weekly_report, "_users_page", side_effect=pages + [[]]
+    ) as page_mock, patch.object(
+        weekly_report, "send_user_report", side_effect=send
+    ) as send_mock:
+        totals = asyncio.run(
+            weekly_report.process_weekly_reports(
+                "2026-W42", {"cursor": "u2"}, concurrency=1, page_size=2
+            )
+        )
+
+    assert totals == {"sent": 1, "skipped": 2}
+    assert peak == 1
+    # Retoma do cursor salvo e avança pelo último ID de cada página
+    assert [c.args[1] for c in page_mock.call_args_list] == ["u2", "u4"]
+    assert [c.args[1] for c in send_mock.call_args_list] == ["u3"]
+
+    run_ref = db.collection.return_value.document.return_value
+    updates = [c.args[0] for c in run_ref.update.call_args_list]
+    assert updates[0] == {"last_weekly_report_run": "2026-W42"}
+    checkpoints = [u for u in updates if "cursor" in u]
+    assert [u["cursor"] for u in checkpoints] == ["u4", "u5"]
+    assert "stage_seconds.email" in checkpoints[0]
+    assert updates[-1]["status"] == weekly_report.STATUS_COMPLETED
+
+
+def test_claim_respects_lease_and_completed_runs():
+    now = datetime(2026, 10, 12, 9, tzinfo=timezone.utc)
+    ref = MagicMock()
+    transaction = MagicMock()
+
+    def claim(data):
+        snap = ref.get.return_value
+        snap.exists = data is not None
+        snap.to_dict.return_value = data
+        return weekly_report._claim_in_transaction.to_wrap(
+            transaction, ref, "2026-W42", now
+        )
+
+    assert claim(None)[0] is True
+    assert claim({"status": "completed"})[0] is False
+    assert claim({"status": "running", "updated_at": now})[0] is False
+
+    stale = datetime(2026, 10, 12, tzinfo=timezone.utc)
+    claimed, checkpoint = claim(
+        {"status": "running", "updated_at": stale, "cursor": "u9"}
+    )
+    assert claimed is True
+    assert checkpoint["cursor"] == "u9"
+
+
+def test_cron_endpoint_only_enqueues(client):
+    with patch.object(
+        weekly_report, "claim_run", return_value=(True, {"cursor": None})
+    ), patch.object(
+        weekly_report, "process_weekly_reports", new_callable=AsyncMock
+    ) as process_mock:
+        response = client.post(
+            "/api/jobs/weekly-report?run_id=2026-W42",
+            headers={"x-cron-secret": jobs.CRON_SECRET},
+        )
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+    process_mock.assert_awaited_once_with("2026-W42", {"cursor": None})
+
+    with patch.object(
+        weekly_report, "claim_run", return_value=(False, {"status": "completed"})
+    ):
+        response = client.post(
+            "/api/jobs/weekly-report", headers={"x-cron-secret": jobs.CRON_SECRET}
+        )
+    assert response.json()["status"] == "completed"
+
+
+def test_renew_fails_after_another_process_takes_over():
+    ref = MagicMock()
+    ref.get.return_value.exists = True
+    ref.get.return_value.to_dict.return_value = {
+        "status": "running",
+        "owner": "new-owner",
+    }
+    transaction = MagicMock()
+    now = datetime(2026, 10, 12, 9, tzinfo=timezone.utc)
+
+    renew = weekly_report._renew_in_transaction.to_wrap
+    assert renew(transaction, ref, "old-owner", now) is False
+    transaction.update.assert_not_called()
+    assert renew(transaction, ref, "new-owner", now) is True
+    transaction.update.assert_called_once_with(ref, {"updated_at": now})
+
+
+def test_run_stops_sending_when_lease_is_lost():
+    db = MagicMock()
+    users = [_user("u1"), _user("u2"), _user("u3")]
+
+    async def send(*args):
+        await asyncio.sleep(0.05)  # página lenta: o heartbeat roda no meio
+        return True
+
+    with patch.object(weekly_report, "get_db", return_value=db), patch.object(
+        weekly_report, "_users_page", return_value=users
+    ), patch.object(
+        weekly_report, "send_user_report", side_effect=send
+    ) as send_mock, patch.object(
+        weekly_report, "renew_run", return_value=False
+    ), patch.object(
+        weekly_report, "RUN_HEARTBEAT_SECONDS", 0.01
+    ):
+        result = asyncio.run(
+            weekly_report.process_weekly_reports(
+                "2026-W42", {"cursor": None, "owner": "old"}, concurrency=1
+            )
+        )
+
+    assert result is None
+    assert send_mock.call_count == 1
+    run_ref = db.collection.return_value.document.return_value
+    updates = [c.args[0] for c in run_ref.update.call_args_list]
+    # Nem checkpoint nem conclusão: a execução agora é do novo dono
+    assert not any("cursor" in u or "status" in u for u in updates)